@@ -0,0 +1,214 @@
+"""
+タイムラインパーサーのベンチマーク
+
+従来の「全体を json.loads → キーパスごとに try/except でたどる」方式と、
+workers.timeline_parser（デコード済み / 生 bytes / 枝刈りデコード）を、
+1ページあたりの CPU 時間と tracemalloc のピークメモリで比べる。
+
+    # 記録済みのレスポンス（Scraper(save=True) や fetch_latest_tweet の出力）を使う
+    PYTHONPATH=src python scripts/bench_timeline_parser.py data/UserTweets_*.json
+
+    # 引数なしなら UserTweets 相当の合成ページ（20ツイート）を使う
+    PYTHONPATH=src python scripts/bench_timeline_parser.py
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List
+
+from workers.timeline_parser import iter_tweets
+
+
+# ---------------------------------------------------------------------- #
+# 比較対象: 以前の twitter_poll._extract_tweets_from_timeline
+# ---------------------------------------------------------------------- #
+def _legacy_parse_tweet_result(tweet_result: Dict) -> Iterable[Dict[str, Any]]:
+    if not tweet_result:
+        return
+    if tweet_result.get("__typename") == "TweetWithVisibilityResults":
+        tweet_result = tweet_result.get("tweet", tweet_result)
+    legacy = tweet_result.get("legacy", {})
+    full_text = legacy.get("full_text", "")
+    if not full_text:
+        return
+    rest_id = tweet_result.get("rest_id", "")
+    core = tweet_result.get("core", {})
+    user_legacy = core.get("user_results", {}).get("result", {}).get("legacy", {})
+    yield {
+        "id": rest_id,
+        "text": full_text,
+        "user_id": int(legacy.get("user_id_str", 0)),
+        "username": user_legacy.get("screen_name", legacy.get("screen_name", "")),
+        "created_at": legacy.get("created_at"),
+        "url": f"https://twitter.com/i/web/status/{rest_id}",
+    }
+
+
+def legacy_extract(raw: List[Dict]) -> Iterable[Dict[str, Any]]:
+    for item in raw:
+        instructions = []
+        try:
+            instructions = item["data"]["user"]["result"]["timeline_v2"]["timeline"]["instructions"]
+        except (KeyError, TypeError):
+            pass
+        if not instructions:
+            try:
+                instructions = item["data"]["search_by_raw_query"]["search_timeline"]["timeline"]["instructions"]
+            except (KeyError, TypeError):
+                pass
+        for instr in instructions:
+            for entry in instr.get("entries") or []:
+                content = entry.get("content", {})
+                tweet_result = None
+                try:
+                    tweet_result = content["itemContent"]["tweet_results"]["result"]
+                except (KeyError, TypeError):
+                    pass
+                if tweet_result is not None:
+                    yield from _legacy_parse_tweet_result(tweet_result)
+                    continue
+                for sub_item in content.get("items", []):
+                    try:
+                        tweet_result = sub_item["item"]["itemContent"]["tweet_results"]["result"]
+                    except (KeyError, TypeError):
+                        continue
+                    yield from _legacy_parse_tweet_result(tweet_result)
+
+
+# ---------------------------------------------------------------------- #
+# 合成ページ
+# ---------------------------------------------------------------------- #
+def _user(i: int) -> Dict[str, Any]:
+    return {
+        "__typename": "User",
+        "id": f"VXNlcjo{i}",
+        "rest_id": str(i),
+        "is_blue_verified": True,
+        "profile_image_shape": "Circle",
+        "legacy": {
+            "screen_name": f"user{i}",
+            "name": f"User {i}",
+            "description": "Day trader. Not financial advice. " * 4,
+            "followers_count": 12345,
+            "friends_count": 321,
+            "profile_banner_url": "https://pbs.twimg.com/profile_banners/" + "x" * 40,
+            "profile_image_url_https": "https://pbs.twimg.com/profile_images/" + "y" * 40,
+            "entities": {"description": {"urls": []}, "url": {"urls": [{"expanded_url": "https://example.com"}]}},
+            "pinned_tweet_ids_str": [],
+        },
+    }
+
+
+def _tweet_entry(tid: int, uid: int) -> Dict[str, Any]:
+    hashtags = [{"indices": [0, 8], "text": f"tag{k}"} for k in range(3)]
+    media = [
+        {
+            "display_url": "pic.twitter.com/abc",
+            "media_url_https": "https://pbs.twimg.com/media/" + "z" * 20,
+            "original_info": {"height": 1080, "width": 1920, "focus_rects": [{"x": 0, "y": 0, "w": 1920, "h": 1075}] * 4},
+            "sizes": {s: {"h": 600, "w": 1200, "resize": "fit"} for s in ("large", "medium", "small", "thumb")},
+        }
+    ]
+    return {
+        "entryId": f"tweet-{tid}",
+        "sortIndex": str(tid),
+        "content": {
+            "entryType": "TimelineTimelineItem",
+            "__typename": "TimelineTimelineItem",
+            "itemContent": {
+                "itemType": "TimelineTweet",
+                "__typename": "TimelineTweet",
+                "tweet_results": {
+                    "result": {
+                        "__typename": "Tweet",
+                        "rest_id": str(tid),
+                        "core": {"user_results": {"result": _user(uid)}},
+                        "edit_control": {"edit_tweet_ids": [str(tid)], "editable_until_msecs": "1700000000000", "is_edit_eligible": True, "edits_remaining": "5"},
+                        "is_translatable": False,
+                        "views": {"count": "12345", "state": "EnabledWithCount"},
+                        "source": '<a href="https://mobile.twitter.com" rel="nofollow">Twitter Web App</a>',
+                        "legacy": {
+                            "id_str": str(tid),
+                            "user_id_str": str(uid),
+                            "created_at": "Wed Oct 10 20:19:24 +0000 2018",
+                            "full_text": f"$AAPL BUY above 190 #デイトレアラート {tid}",
+                            "favorite_count": 10,
+                            "retweet_count": 2,
+                            "lang": "en",
+                            "display_text_range": [0, 48],
+                            "entities": {"hashtags": hashtags, "symbols": [{"text": "AAPL", "indices": [0, 5]}], "urls": [], "user_mentions": [], "media": media},
+                            "extended_entities": {"media": media},
+                        },
+                    }
+                },
+                "tweetDisplayType": "Tweet",
+            },
+        },
+    }
+
+
+def synthetic_page(n: int = 20) -> bytes:
+    entries = [_tweet_entry(1_700_000_000_000_000_000 + i, 42) for i in range(n)]
+    entries.append({"entryId": "cursor-top-1", "content": {"entryType": "TimelineTimelineCursor", "value": "abc", "cursorType": "Top"}})
+    entries.append({"entryId": "cursor-bottom-1", "content": {"entryType": "TimelineTimelineCursor", "value": "def", "cursorType": "Bottom"}})
+    page = {
+        "data": {
+            "user": {
+                "result": {
+                    "__typename": "User",
+                    "timeline_v2": {
+                        "timeline": {
+                            "instructions": [
+                                {"type": "TimelineClearCache"},
+                                {"type": "TimelineAddEntries", "entries": entries},
+                            ],
+                            "metadata": {"scribeConfig": {"page": "profileBest"}},
+                        }
+                    },
+                }
+            }
+        }
+    }
+    return json.dumps(page).encode()
+
+
+# ---------------------------------------------------------------------- #
+# 計測
+# ---------------------------------------------------------------------- #
+def _measure(name: str, fn: Callable[[bytes], List[Dict[str, Any]]], pages: List[bytes], repeat: int) -> None:
+    count = len(fn(pages[0]))
+    started = time.process_time()
+    for _ in range(repeat):
+        for raw in pages:
+            fn(raw)
+    cpu_us = (time.process_time() - started) / (repeat * len(pages)) * 1e6
+
+    tracemalloc.start()
+    for raw in pages:
+        fn(raw)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<32} tweets/page={count:<4} cpu={cpu_us:9.1f} us/page  peak={peak / 1024:8.1f} KiB")
+
+
+def main() -> None:
+    paths = [Path(p) for p in sys.argv[1:]]
+    pages = [p.read_bytes() for p in paths] if paths else [synthetic_page()]
+    repeat = max(1, 2000 // len(pages))
+    print(f"{len(pages)} page(s), {sum(map(len, pages)) / len(pages) / 1024:.1f} KiB/page, repeat={repeat}")
+
+    _measure("json.loads + legacy walk", lambda raw: list(legacy_extract([json.loads(raw)])), pages, repeat)
+    _measure("json.loads + iter_tweets", lambda raw: list(iter_tweets([json.loads(raw)])), pages, repeat)
+    _measure("iter_tweets(bytes)", lambda raw: list(iter_tweets(raw)), pages, repeat)
+    _measure("iter_tweets(bytes, prune=True)", lambda raw: list(iter_tweets(raw, prune=True)), pages, repeat)
+
+    decoded = [[json.loads(raw)] for raw in pages]
+    _measure("walk only: legacy", lambda raw: list(legacy_extract(decoded[0])), pages, repeat)
+    _measure("walk only: iter_tweets", lambda raw: list(iter_tweets(decoded[0])), pages, repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Alpaca Trading REST API のローカル代替サーバー
+
+AsyncAlpacaBroker（と ALPACA_BASE_URL を向けた AlpacaBroker）が使うエンドポイントだけを実装する。
+成行注文は --price で即約定し、client_order_id の重複は本物と同じく 422 を返す。
+遅延・429/503 の注入に加えて、「注文は受け付けたのに応答を落とす」ケースも再現できる
+（--lost-reply-rate。再試行で二重発注しないことの確認用）。
+
+  POST   /v2/orders
+  GET    /v2/orders
+  GET    /v2/orders:by_client_order_id?client_order_id=...
+  DELETE /v2/orders
+  GET    /v2/positions
+  GET    /v2/account
+
+使い方:
+  python scripts/fake_alpaca_server.py --port 8768 --latency 0.05 --lost-reply-rate 0.1
+  ALPACA_BASE_URL=http://localhost:8768 python scripts/smoke_async_alpaca.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeAlpaca:
+    def __init__(self, price: float):
+        self.price = price
+        self.orders: Dict[str, Dict[str, Any]] = {}
+        self.by_client_id: Dict[str, str] = {}
+        self.positions: Dict[str, Dict[str, float]] = {}
+        self.lock = threading.Lock()
+
+    def submit(self, body: Dict[str, Any]) -> tuple[int, Dict[str, Any]]:
+        coid = body.get("client_order_id") or uuid.uuid4().hex
+        with self.lock:
+            if coid in self.by_client_id:
+                return 422, {"code": 40010001, "message": "client_order_id must be unique"}
+            qty = float(body["qty"])
+            market = body.get("type") == "market"
+            order = {
+                "id": str(uuid.uuid4()),
+                "client_order_id": coid,
+                "symbol": body["symbol"],
+                "side": body["side"],
+                "type": body.get("type"),
+                "time_in_force": body.get("time_in_force"),
+                "qty": body["qty"],
+                "limit_price": body.get("limit_price"),
+                "status": "filled" if market else "new",
+                "filled_qty": body["qty"] if market else "0",
+                "filled_avg_price": str(self.price) if market else None,
+                "submitted_at": datetime.now(timezone.utc).isoformat(),
+            }
+            self.orders[order["id"]] = order
+            self.by_client_id[coid] = order["id"]
+            if market:
+                pos = self.positions.setdefault(body["symbol"], {"qty": 0.0, "avg": self.price})
+                pos["qty"] += qty if body["side"] == "buy" else -qty
+        return 200, order
+
+    def account(self) -> Dict[str, Any]:
+        return {
+            "id": "fake-account",
+            "status": "ACTIVE",
+            "currency": "USD",
+            "cash": "100000",
+            "portfolio_value": "100000",
+            "buying_power": "200000",
+            "equity": "100000",
+            "pattern_day_trader": False,
+            "trading_blocked": False,
+            "account_blocked": False,
+        }
+
+
+def make_handler(fake: FakeAlpaca, latency: float, error_rate: float, lost_reply_rate: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def log_message(self, fmt, *args):  # noqa: N802 - BaseHTTPRequestHandler API
+            pass
+
+        def _send(self, status: int, body: Any) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _handle(self) -> None:
+            # keep-alive なので、エラーを返す場合も本文は読み切っておく
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            if latency:
+                time.sleep(latency)
+            if not self.headers.get("APCA-API-KEY-ID"):
+                return self._send(401, {"message": "unauthorized"})
+            url = urlparse(self.path)
+            if random.random() < error_rate:
+                return self._send(random.choice([429, 503]), {"message": "injected"})
+            if self.command == "POST" and url.path == "/v2/orders":
+                status, body = fake.submit(json.loads(raw or b"{}"))
+                if status == 200 and random.random() < lost_reply_rate:
+                    # 注文は通ったが応答が届かない
+                    return self._send(504, {"message": "gateway timeout"})
+                return self._send(status, body)
+            if self.command == "GET" and url.path == "/v2/orders:by_client_order_id":
+                coid = parse_qs(url.query).get("client_order_id", [""])[0]
+                order_id = fake.by_client_id.get(coid)
+                if order_id is None:
+                    return self._send(404, {"message": "order not found"})
+                return self._send(200, fake.orders[order_id])
+            if self.command == "GET" and url.path == "/v2/orders":
+                return self._send(200, list(fake.orders.values()))
+            if self.command == "DELETE" and url.path == "/v2/orders":
+                with fake.lock:
+                    open_orders = [o for o in fake.orders.values() if o["status"] == "new"]
+                    for o in open_orders:
+                        o["status"] = "canceled"
+                return self._send(207, [{"id": o["id"], "status": 200} for o in open_orders])
+            if self.command == "GET" and url.path == "/v2/positions":
+                return self._send(200, [
+                    {"symbol": sym, "qty": str(p["qty"]), "avg_entry_price": str(p["avg"])}
+                    for sym, p in fake.positions.items() if p["qty"]
+                ])
+            if self.command == "GET" and url.path == "/v2/account":
+                return self._send(200, fake.account())
+            return self._send(404, {"message": "not found"})
+
+        do_GET = do_POST = do_DELETE = _handle
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8768)
+    parser.add_argument("--price", type=float, default=100.0, help="fill price for market orders")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered 429/503")
+    parser.add_argument("--lost-reply-rate", type=float, default=0.0, help="fraction of accepted orders answered 504")
+    args = parser.parse_args()
+
+    fake = FakeAlpaca(args.price)
+    handler = make_handler(fake, args.latency, args.error_rate, args.lost_reply_rate)
+    server = ThreadingHTTPServer(("localhost", args.port), handler)
+    print(f"fake Alpaca REST server on http://localhost:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+OpenAI 互換 LLM のローカル代替サーバー
+
+llm.openai_client.OpenAILLM が送る PROMPT（1件）と BATCH_PROMPT（複数件）のどちらにも
+それらしい JSON を返す。応答には固定の遅延と1件あたりの遅延を足し、同時処理数も絞れるので、
+バッチ化・並列度・キャッシュの効果を実際の API を使わずに測れる。
+
+  POST /v1/chat/completions  -> chat.completions と同じ形の応答
+  GET  /stats                -> 受けたリクエスト数・投稿数・同時処理数の最大値
+
+使い方:
+  python scripts/fake_llm_server.py --latency 0.3 --per-item 0.02 --max-concurrency 4 --port 8767
+  LLM_PROVIDER=openai OPENAI_API_KEY=dummy OPENAI_API_BASE=http://localhost:8767/v1 \\
+      uvicorn api.main:app --port 8000
+  # /signals/batch に投げて /metrics/pipeline と /stats を見る
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+# プロンプト末尾の「投稿: <<<...>>>」
+POST_PATTERN = re.compile(r"投稿: <<<(?P<body>.*)>>>", re.S)
+TICKER_PATTERN = re.compile(r"\$?\b(?P<ticker>[A-Z]{1,5})\b")
+BUY_WORDS = ("buy", "long", "買")
+SELL_WORDS = ("sell", "short", "売")
+STOPWORDS = {"BUY", "SELL", "LONG", "SHORT", "I", "A", "THE", "NOW"}
+
+
+def extract(text: str) -> Dict[str, Any]:
+    """本文から決め打ちで抽出する（ticker が無ければ null）"""
+    ticker = next(
+        (m.group("ticker") for m in TICKER_PATTERN.finditer(text) if m.group("ticker") not in STOPWORDS),
+        None,
+    )
+    lower = text.lower()
+    if any(w in lower for w in SELL_WORDS):
+        side = "SELL"
+    elif any(w in lower for w in BUY_WORDS):
+        side = "BUY"
+    else:
+        ticker, side = None, "BUY"
+    return {"ticker": ticker, "side": side, "confidence": 0.9 if ticker else 0.0, "timeframe": None, "stop": None, "take": None}
+
+
+def answer(prompt: str) -> tuple[str, int]:
+    """プロンプトに対する応答本文と投稿数を返す"""
+    m = POST_PATTERN.search(prompt)
+    body = m.group("body") if m else prompt
+    try:
+        items = json.loads(body)
+    except ValueError:
+        items = None
+    if isinstance(items, list):
+        rows = [{"id": item.get("id"), **extract(str(item.get("text", "")))} for item in items]
+        return json.dumps(rows, ensure_ascii=False), len(rows)
+    return json.dumps(extract(body), ensure_ascii=False), 1
+
+
+class Stats:
+    def __init__(self):
+        self.requests = 0
+        self.items = 0
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def enter(self, items: int) -> None:
+        with self._lock:
+            self.requests += 1
+            self.items += items
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def leave(self) -> None:
+        with self._lock:
+            self.active -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"requests": self.requests, "items": self.items, "active": self.active, "peak_active": self.peak}
+
+
+def make_handler(latency: float, per_item: float, error_rate: float, slots: Optional[threading.Semaphore]):
+    stats = Stats()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):  # noqa: N802 - BaseHTTPRequestHandler API
+            pass
+
+        def _send(self, status: int, body: Any) -> None:
+            data = json.dumps(body, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):  # noqa: N802 - BaseHTTPRequestHandler API
+            if self.path == "/stats":
+                return self._send(200, stats.snapshot())
+            return self._send(404, {"error": "not found"})
+
+        def do_POST(self):  # noqa: N802 - BaseHTTPRequestHandler API
+            # keep-alive で次のリクエストがずれないよう、先に本文を読み切る
+            raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                return self._send(404, {"error": "not found"})
+            if random.random() < error_rate:
+                return self._send(429, {"error": {"message": "injected rate limit", "type": "rate_limit"}})
+            try:
+                req = json.loads(raw)
+                prompt = "\n".join(str(m.get("content", "")) for m in req.get("messages", []))
+            except ValueError:
+                return self._send(400, {"error": {"message": "invalid json"}})
+            content, items = answer(prompt)
+            if slots is not None:
+                slots.acquire()
+            stats.enter(items)
+            try:
+                time.sleep(latency + per_item * items)
+            finally:
+                stats.leave()
+                if slots is not None:
+                    slots.release()
+            return self._send(200, {
+                "id": f"chatcmpl-fake-{stats.requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": req.get("model", "fake"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": len(prompt), "completion_tokens": len(content), "total_tokens": len(prompt) + len(content)},
+            })
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds added to every completion")
+    parser.add_argument("--per-item", type=float, default=0.02, help="extra seconds per post in a batch prompt")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="completions processed at once (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of completions answered 429")
+    args = parser.parse_args()
+
+    slots = threading.Semaphore(args.max_concurrency) if args.max_concurrency > 0 else None
+    server = ThreadingHTTPServer(("localhost", args.port), make_handler(args.latency, args.per_item, args.error_rate, slots))
+    print(f"fake LLM server on http://localhost:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
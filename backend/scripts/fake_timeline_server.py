@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Twitter タイムラインのローカル代替サーバー
+
+workers.twitter_poll の HttpTimelineSource が読む形（Scraper と同じ JSON）を返す。
+ユーザーごとに一定間隔で新しいツイートが増え、タイムラインは実物と同じく新しい順
+（先頭に固定ツイート）で返す。遅延・エラー・ユーザー解決の失敗も再現できる。
+
+  GET /users?names=a,b       -> scraper.users と同じ形のリスト
+  GET /timeline/{user_id}    -> scraper.tweets と同じ形のリスト
+  GET /search?q=...          -> scraper.search と同じ形のリスト（全ユーザー分）
+
+使い方:
+  python scripts/fake_timeline_server.py --users alice,bob --tweets-per-min 6 --port 8766
+  TWITTER_TIMELINE_URL=http://localhost:8766 TWITTER_USERS=alice,bob python -m workers.twitter_poll
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import parse_qs, urlparse
+
+TICKERS = ["AAPL", "MSFT", "NVDA", "TSLA", "AMZN"]
+PAGE_SIZE = 20
+
+
+class FakeTimelines:
+    def __init__(self, users: List[str], tweets_per_min: float):
+        self.users = {name: 1000 + i for i, name in enumerate(users)}
+        self.names = {uid: name for name, uid in self.users.items()}
+        self.interval = 60.0 / tweets_per_min if tweets_per_min > 0 else float("inf")
+        self.started = time.time()
+        self._next_id = 1_800_000_000_000_000_000
+        self._tweets: Dict[int, List[Dict[str, Any]]] = {uid: [] for uid in self.users.values()}
+        self._lock = threading.Lock()
+        # 固定ツイート（古い ID のまま常に先頭に出る）
+        for uid in self._tweets:
+            self._tweets[uid].append(self._new_tweet(uid, pinned=True))
+
+    def _new_tweet(self, uid: int, pinned: bool = False) -> Dict[str, Any]:
+        self._next_id += random.randint(1, 1000)
+        side = random.choice(["BUY", "SELL"])
+        text = "Pinned: rules of this account" if pinned else f"${random.choice(TICKERS)} {side} now"
+        return {"id": self._next_id, "uid": uid, "text": text, "pinned": pinned, "ts": datetime.now(timezone.utc)}
+
+    def _advance(self) -> None:
+        # 経過時間に応じて各ユーザーのツイートを増やす
+        due = int((time.time() - self.started) / self.interval) if self.interval != float("inf") else 0
+        for uid, tweets in self._tweets.items():
+            while len(tweets) - 1 < due:
+                tweets.append(self._new_tweet(uid))
+
+    def timeline(self, uid: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._advance()
+            tweets = self._tweets.get(uid, [])
+            pinned = [t for t in tweets if t["pinned"]]
+            recent = sorted((t for t in tweets if not t["pinned"]), key=lambda t: -t["id"])
+            return pinned + recent[:PAGE_SIZE]
+
+    def search(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._advance()
+            tweets = [t for ts in self._tweets.values() for t in ts if not t["pinned"]]
+        return sorted(tweets, key=lambda t: -t["id"])[:PAGE_SIZE]
+
+    # -- Scraper と同じ形の JSON ---------------------------------------- #
+    def _user(self, uid: int) -> Dict[str, Any]:
+        return {"__typename": "User", "rest_id": str(uid), "legacy": {"screen_name": self.names[uid]}}
+
+    def _entry(self, t: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "entryId": f"tweet-{t['id']}",
+            "content": {
+                "entryType": "TimelineTimelineItem",
+                "itemContent": {
+                    "itemType": "TimelineTweet",
+                    "tweet_results": {
+                        "result": {
+                            "__typename": "Tweet",
+                            "rest_id": str(t["id"]),
+                            "core": {"user_results": {"result": self._user(t["uid"])}},
+                            "legacy": {
+                                "id_str": str(t["id"]),
+                                "user_id_str": str(t["uid"]),
+                                "created_at": t["ts"].strftime("%a %b %d %H:%M:%S +0000 %Y"),
+                                "full_text": t["text"],
+                            },
+                        }
+                    },
+                },
+            },
+        }
+
+    def page(self, tweets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        instructions = [{"type": "TimelineAddEntries", "entries": [self._entry(t) for t in tweets]}]
+        return [{"data": {"user": {"result": {"timeline_v2": {"timeline": {"instructions": instructions}}}}}}]
+
+    def users_payload(self, names: List[str]) -> List[Dict[str, Any]]:
+        return [{"data": {"user": {"result": self._user(self.users[n])}}} for n in names if n in self.users]
+
+
+def make_handler(fake: FakeTimelines, latency: float, error_rate: float, fail_users: int):
+    state = {"user_failures": fail_users}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):  # noqa: N802 - BaseHTTPRequestHandler API
+            pass
+
+        def _send(self, status: int, body: Any) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):  # noqa: N802 - BaseHTTPRequestHandler API
+            if latency:
+                time.sleep(latency)
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path == "/users":
+                if state["user_failures"] > 0:
+                    state["user_failures"] -= 1
+                    return self._send(503, {"error": "user lookup unavailable"})
+                names = [n for n in query.get("names", [""])[0].split(",") if n]
+                return self._send(200, fake.users_payload(names))
+            if random.random() < error_rate:
+                return self._send(random.choice([429, 503]), {"error": "injected"})
+            if url.path.startswith("/timeline/"):
+                return self._send(200, fake.page(fake.timeline(int(url.path.rsplit("/", 1)[-1]))))
+            if url.path == "/search":
+                return self._send(200, fake.page(fake.search()))
+            return self._send(404, {"error": "not found"})
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--users", default="alice,bob")
+    parser.add_argument("--tweets-per-min", type=float, default=6.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of timeline requests answered 429/503")
+    parser.add_argument("--fail-users", type=int, default=0, help="answer the first N /users requests with 503")
+    args = parser.parse_args()
+
+    fake = FakeTimelines([u.strip() for u in args.users.split(",") if u.strip()], args.tweets_per_min)
+    server = ThreadingHTTPServer(("localhost", args.port), make_handler(fake, args.latency, args.error_rate, args.fail_users))
+    print(f"fake timeline server on http://localhost:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+trade_updates ストリームのローカル代替サーバー
+
+Alpaca と同じ認証・listen の手順を受け付け、標準入力に書いた行をイベントとして配信する。
+  <broker_order_id> <SYMBOL> <buy|sell> <qty> <price> [partial]   約定（partial を付けると一部約定）
+  <broker_order_id> cancel                                        取消
+
+使い方:
+  python scripts/fake_trade_updates_server.py --port 8765
+  TRADE_UPDATES_URL=ws://localhost:8765 python -m workers.trade_updates
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import uuid
+from datetime import datetime, timezone
+
+import websockets
+
+clients: set = set()
+filled: dict = {}
+
+
+def build_event(line: str) -> dict | None:
+    parts = line.split()
+    if len(parts) == 2 and parts[1] == "cancel":
+        order = {"id": parts[0], "status": "canceled", "symbol": "", "side": "buy", "qty": "0"}
+        return {"event": "canceled", "order": order}
+    if len(parts) not in (5, 6):
+        return None
+    order_id, symbol, side, qty, price = parts[:5]
+    partial = len(parts) == 6
+    total = filled.get(order_id, 0.0) + float(qty)
+    filled[order_id] = total
+    order = {
+        "id": order_id,
+        "symbol": symbol.upper(),
+        "side": side.lower(),
+        "qty": str(total if not partial else total * 2),
+        "filled_qty": str(total),
+        "filled_avg_price": price,
+        "status": "partially_filled" if partial else "filled",
+    }
+    return {
+        "event": "partial_fill" if partial else "fill",
+        "execution_id": uuid.uuid4().hex,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "qty": qty,
+        "price": price,
+        "order": order,
+    }
+
+
+async def handler(ws) -> None:
+    auth = json.loads(await ws.recv())
+    await ws.send(json.dumps({"stream": "authorization", "data": {"status": "authorized", "action": auth.get("action")}}))
+    await ws.recv()  # listen
+    await ws.send(json.dumps({"stream": "listening", "data": {"streams": ["trade_updates"]}}))
+    clients.add(ws)
+    try:
+        await ws.wait_closed()
+    finally:
+        clients.discard(ws)
+
+
+async def read_stdin() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            return
+        event = build_event(line)
+        if event is None:
+            print("unrecognised line:", line.strip(), file=sys.stderr)
+            continue
+        msg = json.dumps({"stream": "trade_updates", "data": event})
+        for ws in list(clients):
+            await ws.send(msg)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    async with websockets.serve(handler, "localhost", args.port):
+        print(f"fake trade_updates server on ws://localhost:{args.port}", file=sys.stderr)
+        await read_stdin()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
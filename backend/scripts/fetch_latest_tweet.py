@@ -2,6 +2,7 @@
 指定ユーザーの最新ツイートを取得し、LLMで解析するスクリプト
 """
 import os
+import sys
 import json
 import re
 from pathlib import Path
@@ -11,6 +12,10 @@ import httpx
 BASE_DIR = Path(__file__).resolve().parent.parent
 ENV_PATH = BASE_DIR / ".env"
 
+sys.path.insert(0, str(BASE_DIR / "src"))
+
+from workers.timeline_parser import iter_tweets
+
 load_dotenv(ENV_PATH)
 
 FEATURES = {
@@ -62,7 +67,7 @@ def get_headers():
         "accept": "*/*",
     }
 
-def fetch_latest_tweet(username: str) -> dict | None:
+def fetch_latest_tweet(username: str) -> bytes | None:
     auth_token = os.getenv("X_AUTH_TOKEN")
     ct0 = os.getenv("X_CT0")
     
@@ -125,34 +130,14 @@ def fetch_latest_tweet(username: str) -> dict | None:
             print(f"Response: {resp.text[:500]}")
             return None
         
-        return resp.json()
+        # デコードは extract_tweets 側で必要なキーだけ残して行う
+        return resp.content
 
-def extract_tweets(data: dict) -> list[dict]:
-    tweets = []
-    try:
-        instructions = data["data"]["user"]["result"]["timeline_v2"]["timeline"]["instructions"]
-        for inst in instructions:
-            for entry in inst.get("entries", []):
-                content = entry.get("content", {})
-                item_content = content.get("itemContent", {})
-                result = item_content.get("tweet_results", {}).get("result", {})
-                
-                if result.get("__typename") == "Tweet":
-                    legacy = result.get("legacy", {})
-                elif result.get("__typename") == "TweetWithVisibilityResults":
-                    legacy = result.get("tweet", {}).get("legacy", {})
-                else:
-                    continue
-                
-                if legacy and legacy.get("full_text"):
-                    tweets.append({
-                        "id": legacy.get("id_str"),
-                        "text": legacy.get("full_text"),
-                        "created_at": legacy.get("created_at"),
-                    })
-    except (KeyError, TypeError):
-        pass
-    return tweets
+def extract_tweets(data: bytes | dict) -> list[dict]:
+    return [
+        {"id": t["id"], "text": t["text"], "created_at": t["created_at"]}
+        for t in iter_tweets(data)
+    ]
 
 def filter_daytrade_alerts(tweets: list[dict]) -> list[dict]:
     return [t for t in tweets if "#デイトレアラート" in t["text"]]
@@ -0,0 +1,43 @@
+"""
+Alpaca の assets から取引可能な US 株のティッカー一覧を取得し、
+SYMBOL_UNIVERSE_PATH（既定 ./data/symbols.txt）のスナップショットを置き換える。
+
+API は起動時にこのファイルを読み込むので、更新後は再起動で反映される。
+
+    PYTHONPATH=src python scripts/refresh_symbol_universe.py
+"""
+
+import logging
+
+from app.config import settings
+from app.universe import symbol_universe
+
+
+def fetch_tradable_symbols() -> list[str]:
+    if not settings.alpaca_api_key or not settings.alpaca_secret_key:
+        raise RuntimeError("Alpaca API キーが設定されていません")
+
+    from alpaca.trading.client import TradingClient
+    from alpaca.trading.enums import AssetClass, AssetStatus
+    from alpaca.trading.requests import GetAssetsRequest
+
+    client = TradingClient(
+        api_key=settings.alpaca_api_key,
+        secret_key=settings.alpaca_secret_key,
+        paper=settings.alpaca_paper,
+    )
+    assets = client.get_all_assets(
+        GetAssetsRequest(status=AssetStatus.ACTIVE, asset_class=AssetClass.US_EQUITY)
+    )
+    return [a.symbol for a in assets if a.tradable]
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    symbols = fetch_tradable_symbols()
+    count = symbol_universe.save(symbols)
+    print(f"{count} symbols written to {symbol_universe.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Smoke test for the async Alpaca broker.
+
+Submits a batch of market orders concurrently, then checks that every order
+was accepted exactly once (no duplicates from retries) and that positions and
+account can be read back. Meant to run against scripts/fake_alpaca_server.py:
+
+    python scripts/fake_alpaca_server.py --latency 0.05 --lost-reply-rate 0.2 --error-rate 0.1 &
+    ALPACA_BASE_URL=http://localhost:8768 ALPACA_API_KEY=test ALPACA_SECRET_KEY=test \
+        python scripts/smoke_async_alpaca.py --orders 50
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from broker.alpaca_async import AsyncAlpacaBroker
+
+
+async def run(n: int, concurrency: int) -> int:
+    base_url = os.getenv("ALPACA_BASE_URL", "")
+    if not base_url:
+        print("❌ ALPACA_BASE_URL is not set (point it at scripts/fake_alpaca_server.py).")
+        return 1
+    broker = AsyncAlpacaBroker(
+        api_key=os.getenv("ALPACA_API_KEY", "test"),
+        secret_key=os.getenv("ALPACA_SECRET_KEY", "test"),
+        base_url=base_url,
+        backoff=0.05,
+    )
+    legs = [
+        {"ticker": f"SYM{i % 10}", "side": "BUY", "qty": 1, "order_type": "MARKET", "client_order_id": f"smoke-{i}"}
+        for i in range(n)
+    ]
+    started = time.perf_counter()
+    results = await broker.place_orders(legs, concurrency=concurrency)
+    elapsed = time.perf_counter() - started
+    errors = [r for r in results if r["status"] == "ERROR"]
+    print(f"📤 {n} orders in {elapsed:.2f}s ({n / elapsed:.0f} orders/s), {len(errors)} errors")
+    for r in errors[:5]:
+        print(f"  ⚠️  {r['ticker']}: {r['reason']}")
+
+    resp = await broker._client.get("/v2/orders")
+    placed = [o for o in resp.json() if o["client_order_id"].startswith("smoke-")]
+    ids = {o["client_order_id"] for o in placed}
+    ok = len(placed) == len(ids) == n - len(errors)
+    print(f"{'✅' if ok else '❌'} server has {len(placed)} smoke orders, {len(ids)} unique client_order_ids")
+
+    positions = await broker.positions()
+    account = await broker.account()
+    print(f"📈 {len(positions)} positions, buying power {account['buying_power']:,.2f}")
+    await broker.aclose()
+    return 0 if ok else 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args.orders, args.concurrency)))
+
+
+if __name__ == "__main__":
+    main()
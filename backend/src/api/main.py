@@ -1,23 +1,30 @@
-import hashlib
+import asyncio
+import json
 import logging
+import uuid
 from pathlib import Path
-from typing import Iterable, List
+from typing import List
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from app.db import init_db, get_session
-from app.models import Order, Position, Signal, PnL
+from app.models import Order, Position, Signal, SignalJob, PnL
 from app.performance import build_equity_from_pnl
 from app.backtest import run_sma_crossover
+from app.sweep import run_sma_sweep, shutdown_pool as shutdown_sweep_pool
 from app.config import settings
-from app.schemas import SignalIn, ExtractedSignal
-from app.utils import naive_extract
-from app.risk import risk_guard
+from app.schemas import OrderBatchIn, SignalBatchIn, SignalIn
+from app.extraction import TieredExtractor
+from app.universe import symbol_universe
+from app.dedup import backfill_signal_keys, dedup_index, message_keys
+from app.pipeline import SignalPipeline
+from app.prices import price_cache
+from app.risk import order_throttle, risk_guard
+from app.broker_state import broker_state
 from app.cookie_store import save_cookies, load_cookies, get_version
 from llm.base import LLM
-from broker import get_broker
 from sqlmodel import select
 
 logger = logging.getLogger("api")
@@ -29,9 +36,22 @@ app = FastAPI(title="Discord-LLM-Trader")
 @app.on_event("startup")
 def on_startup():
     init_db()
+    backfill_signal_keys()
+    symbol_universe.load()
+    price_cache.start()
+    risk_guard.start()
+    pipeline.start()
     logger.setLevel(logging.INFO)
 
 
+@app.on_event("shutdown")
+def on_shutdown():
+    pipeline.stop()
+    risk_guard.stop()
+    price_cache.stop()
+    shutdown_sweep_pool()
+
+
 llm_client: LLM | None = None
 if settings.llm_provider == "openai" and settings.openai_api_key:
     try:
@@ -43,44 +63,35 @@ if settings.llm_provider == "openai" and settings.openai_api_key:
             settings.openai_api_base or None,
         )
         logger.info("OpenAI LLM initialised: %s (base_url=%s)", settings.openai_model, settings.openai_api_base or "default")
+        if settings.llm_batch_max > 1:
+            from llm.batching import BatchingLLM
+
+            llm_client = BatchingLLM(
+                llm_client,
+                max_batch=settings.llm_batch_max,
+                window_ms=settings.llm_batch_window_ms,
+                max_concurrency=settings.llm_max_concurrency,
+            )
+        if settings.llm_cache_enabled:
+            from llm.cache import CachedLLM
+            from llm.openai_client import PROMPT_VERSION
+
+            llm_client = CachedLLM(
+                llm_client,
+                model=settings.openai_model,
+                prompt_version=PROMPT_VERSION,
+                path=settings.llm_cache_path,
+                ttl_sec=settings.llm_cache_ttl_sec,
+                memory_size=settings.llm_cache_memory_size,
+                max_rows=settings.llm_cache_max_rows,
+            )
     except Exception as e:  # pragma: no cover - logging/optional dependency
         logger.warning("OpenAI LLM initialisation failed: %s", e)
 
 
-def extract_signal(text: str) -> ExtractedSignal | None:
-    if llm_client:
-        try:
-            result = llm_client.extract(text)
-            if result:
-                return result
-        except Exception as e:  # pragma: no cover - defensive logging
-            logger.warning("LLM extraction failed: %s", e)
-    return naive_extract(text)
-
-
-def ensure_int(value, default: int = 0) -> int:
-    try:
-        if value is None:
-            return default
-        return int(value)
-    except (TypeError, ValueError):
-        return default
-
-
-def has_duplicate(session, keys: Iterable[str], url: str | None) -> bool:
-    for key in keys:
-        if not key:
-            continue
-        existing = session.exec(select(Signal.id).where(Signal.message_id == key)).first()
-        if existing:
-            logger.info("duplicate signal detected via key=%s", key)
-            return True
-    if url:
-        existing = session.exec(select(Signal.id).where(Signal.content.contains(url))).first()
-        if existing:
-            logger.info("duplicate signal detected via url=%s", url)
-            return True
-    return False
+# 明確なメッセージはルールだけで確定し、曖昧なものだけ LLM に回す
+extractor = TieredExtractor(llm_client, threshold=settings.rule_confidence_threshold)
+pipeline = SignalPipeline(extractor.extract)
 
 
 @app.get("/health")
@@ -235,122 +246,285 @@ def run_sma_backtest(payload: SmaBacktestIn):
     }
 
 
-@app.post("/signals")
-def receive_signal(payload: SignalIn):
-    parsed = extract_signal(payload.text)
-    if not parsed:
-        logger.warning(
-            "signal extraction failed source=%s meta=%s", payload.source, payload.meta
+class WindowRange(BaseModel):
+    start: int
+    stop: int  # 上限を含む
+    step: int = 1
+
+    def values(self) -> List[int]:
+        return list(range(self.start, self.stop + 1, max(self.step, 1)))
+
+    def __len__(self) -> int:
+        return len(range(self.start, self.stop + 1, max(self.step, 1)))
+
+
+class SmaSweepIn(BaseModel):
+    symbols: List[str]
+    timeframe: str = "1Day"
+    start: str
+    end: str
+    short_window: WindowRange
+    long_window: WindowRange
+    initial_equity: float = 100_000.0
+    top: int = 50
+
+
+@app.post("/backtest/sma/sweep")
+def run_sma_backtest_sweep(payload: SmaSweepIn):
+    """
+    SMA クロス戦略のパラメータスイープ。
+    銘柄 × short_window × long_window をプロセスプールで評価し、リターン順に返す。
+    """
+    # 巨大な範囲は展開する前に弾く（組み合わせ数は run_sma_sweep 側で正確に数える）
+    longest = max(len(payload.short_window), len(payload.long_window))
+    if settings.sweep_max_grid > 0 and longest > settings.sweep_max_grid:
+        raise HTTPException(status_code=422, detail=f"sweep grid too large (max {settings.sweep_max_grid})")
+    try:
+        results = run_sma_sweep(
+            symbols=payload.symbols,
+            timeframe=payload.timeframe,
+            start=payload.start,
+            end=payload.end,
+            short_windows=payload.short_window.values(),
+            long_windows=payload.long_window.values(),
+            initial_equity=payload.initial_equity,
         )
-        raise HTTPException(status_code=422, detail="Failed to extract signal from text")
-
-    url = payload.meta.get("url")
-    message_id_candidates: List[str] = []
-    for key in (payload.meta.get("message_id"), payload.meta.get("id"), url):
-        if key:
-            message_id_candidates.append(str(key))
-
-    message_id = message_id_candidates[0] if message_id_candidates else None
-    if not message_id:
-        message_id = f"{payload.source}:{hashlib.sha256(payload.text.encode('utf-8')).hexdigest()}"
-
-    author = (
-        payload.meta.get("username")
-        or payload.meta.get("author")
-        or payload.meta.get("user")
-        or payload.source
-    )
-    channel_id = ensure_int(
-        payload.meta.get("channel_id")
-        or payload.meta.get("chat_id")
-        or payload.meta.get("user_id")
-    )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {
+        "count": len(results),
+        "results": [
+            {
+                "rank": rank,
+                "symbol": r.symbol,
+                "short_window": r.short_window,
+                "long_window": r.long_window,
+                "final_equity": r.final_equity,
+                "total_return_pct": r.total_return_pct,
+                "max_drawdown_pct": r.max_drawdown_pct,
+                "num_trades": r.num_trades,
+            }
+            for rank, r in enumerate(results[: payload.top], start=1)
+        ],
+    }
 
-    content = payload.text
-    if url and url not in content:
-        content = f"{content}\n\nSource: {url}"
+
+@app.post("/signals", status_code=202)
+def receive_signal(payload: SignalIn, response: Response):
+    """
+    生メッセージを保存して job_id を返す（202）。
+    抽出 → リスクチェック → 発注はパイプラインのワーカーで非同期に行う。
+    """
+    if not payload.text.strip():
+        raise HTTPException(status_code=422, detail="text is empty")
+
+    message_id, keys = message_keys(payload.source, payload.text, payload.meta)
+
+    duplicate_key = dedup_index.cached(keys)
+    if duplicate_key:
+        logger.info(
+            "duplicate signal skipped source=%s key=%s meta=%s",
+            payload.source,
+            duplicate_key,
+            payload.meta,
+        )
+        response.status_code = 200
+        return {"status": "duplicate"}
 
     with get_session() as s:
-        if has_duplicate(s, [message_id, *message_id_candidates[1:]], url):
+        job = SignalJob(
+            source=payload.source,
+            message_id=message_id,
+            text=payload.text,
+            meta=json.dumps(payload.meta, ensure_ascii=False, default=str),
+        )
+        s.add(job)
+        s.flush()
+        # キーが1件でも既存なら重複（並行リクエストとの競合もここで決着する）
+        if not dedup_index.claim(s, keys, None):
+            s.rollback()
             logger.info(
                 "duplicate signal skipped source=%s message_id=%s meta=%s",
                 payload.source,
                 message_id,
                 payload.meta,
             )
+            response.status_code = 200
             return {"status": "duplicate"}
-
-        signal = Signal(
-            message_id=message_id,
-            author=str(author),
-            channel_id=channel_id,
-            content=content,
-            ticker=parsed.ticker,
-            side=parsed.side,
-            confidence=parsed.confidence,
-            timeframe=parsed.timeframe,
-            stop=parsed.stop,
-            take=parsed.take,
-        )
-        s.add(signal)
         s.commit()
-        s.refresh(signal)
-
-    logger.info(
-        "signal stored id=%s source=%s ticker=%s side=%s meta=%s parsed=%s",
-        signal.id,
-        payload.source,
-        parsed.ticker,
-        parsed.side,
-        payload.meta,
-        parsed.model_dump(),
-    )
+        job_id = job.id
+    dedup_index.remember(keys)
 
-    # 自動注文実行（信頼度閾値を超えた場合のみ）
-    order_result = None
-    
-    if settings.auto_trade_enabled and parsed.confidence is not None and parsed.confidence >= settings.min_confidence:
-        try:
-            # 注文数量を計算（default_order_usd / price、価格がなければ1株）
-            qty = 1.0  # デフォルト1株
-            
-            # リスクチェック
-            if not risk_guard.can_open(parsed.ticker, qty if parsed.side == "BUY" else -qty):
-                logger.warning("risk check failed for %s, skipping order", parsed.ticker)
-            else:
-                broker = get_broker()
-                order_result = broker.place_order(
-                    ticker=parsed.ticker,
-                    side=parsed.side,
-                    qty=qty,
-                    price=None,  # 成行注文
-                    order_type="MARKET",
-                    tif="DAY",
-                )
-                
-                # 注文をDBに保存
-                with get_session() as s:
-                    order = Order(
-                        broker=broker.name,
-                        ticker=parsed.ticker,
-                        side=parsed.side,
-                        qty=qty,
-                        price=order_result.get("price"),
-                        status=order_result.get("status", "NEW"),
-                        reason=order_result.get("reason"),
-                        signal_id=signal.id,
+    pipeline.submit(job_id)
+    logger.info("signal accepted job=%s source=%s meta=%s", job_id, payload.source, payload.meta)
+    return {"status": "accepted", "job_id": job_id}
+
+
+@app.post("/signals/batch", status_code=202)
+def receive_signal_batch(payload: SignalBatchIn, response: Response):
+    """
+    複数メッセージをまとめて受け付ける。重複判定は全キーに対する IN 検索1回、
+    新規分の SignalJob とキーの保存は1トランザクションで行い、件ごとの結果を返す。
+    抽出以降は /signals と同じくパイプラインのワーカーが並行して処理する。
+    """
+    if len(payload.items) > settings.signal_batch_max:
+        raise HTTPException(status_code=422, detail=f"too many items (max {settings.signal_batch_max})")
+
+    results: List[dict] = [{"status": "duplicate"} for _ in payload.items]
+    pending = []  # (index, message_id, keys)
+    batch_keys: set = set()
+    for i, item in enumerate(payload.items):
+        if not item.text.strip():
+            results[i] = {"status": "invalid", "detail": "text is empty"}
+            continue
+        message_id, keys = message_keys(item.source, item.text, item.meta)
+        # 同じバッチ内の重複と、直近に受け付けたキーはここで弾く
+        if batch_keys.intersection(keys) or dedup_index.cached(keys):
+            continue
+        batch_keys.update(keys)
+        pending.append((i, message_id, keys))
+
+    accepted = []  # (index, job_id, keys)
+    # 並行リクエストとキーが衝突した場合は、既存キーを読み直してやり直す
+    for _ in range(3):
+        if not pending:
+            break
+        with get_session() as s:
+            existing = dedup_index.existing(s, (k for _, _, keys in pending for k in keys))
+            fresh = [p for p in pending if not existing.intersection(p[2])]
+            jobs = []
+            for i, message_id, keys in fresh:
+                item = payload.items[i]
+                jobs.append(
+                    SignalJob(
+                        source=item.source,
+                        message_id=message_id,
+                        text=item.text,
+                        meta=json.dumps(item.meta, ensure_ascii=False, default=str),
                     )
-                    s.add(order)
-                    s.commit()
-                
-                logger.info(
-                    "auto order placed signal_id=%s ticker=%s side=%s status=%s",
-                    signal.id,
-                    parsed.ticker,
-                    parsed.side,
-                    order_result.get("status"),
                 )
-        except Exception as e:
-            logger.error("auto order failed for signal_id=%s: %s", signal.id, e)
+            s.add_all(jobs)
+            s.flush()
+            if not dedup_index.claim(s, [k for _, _, keys in fresh for k in keys], None):
+                s.rollback()
+                continue
+            s.commit()
+            accepted = [(i, job.id, keys) for (i, _, keys), job in zip(fresh, jobs)]
+            pending = []
+    if pending:
+        raise HTTPException(status_code=409, detail="conflicting concurrent submissions, retry")
+
+    for i, job_id, keys in accepted:
+        dedup_index.remember(keys)
+        pipeline.submit(job_id)
+        results[i] = {"status": "accepted", "job_id": job_id}
+
+    logger.info("signal batch received=%d accepted=%d", len(payload.items), len(accepted))
+    if not accepted:
+        response.status_code = 200
+    return {"accepted": len(accepted), "results": results}
+
+
+@app.post("/orders/bulk")
+async def place_bulk_orders(payload: OrderBatchIn):
+    """
+    複数レッグの注文をまとめて出す。各レッグをリスクチェックし、通ったものを同時に送信する。
+    結果は入力と同じ順（棄却されたレッグは status=RISK_REJECTED）。
+    """
+    if not payload.legs:
+        raise HTTPException(status_code=422, detail="legs is empty")
+    if len(payload.legs) > settings.signal_batch_max:
+        raise HTTPException(status_code=422, detail=f"too many legs (max {settings.signal_batch_max})")
+    results: list = [None] * len(payload.legs)
+    orders, positions = [], []
+    for i, leg in enumerate(payload.legs):
+        side = leg.side.upper()
+        price = leg.price or price_cache.last_price(leg.ticker)
+        # レッグごとの冪等キー。約定するまでリスクの予約にも使う
+        client_order_id = f"bulk-{uuid.uuid4().hex}"
+        reason = risk_guard.check(leg.ticker, leg.qty if side == "BUY" else -leg.qty, price, reserve=client_order_id)
+        if reason:
+            results[i] = {"ticker": leg.ticker, "side": side, "status": "RISK_REJECTED", "reason": reason}
+            continue
+        orders.append({**leg.model_dump(), "side": side, "client_order_id": client_order_id})
+        positions.append(i)
+    if orders:
+        try:
+            placed = await asyncio.wrap_future(pipeline.place_orders(orders))
+        except Exception:
+            for order in orders:
+                risk_guard.release(order["client_order_id"])
+            raise
+        for i, result in zip(positions, placed):
+            results[i] = result
+    return {"results": results}
+
+
+@app.get("/signals/jobs/{job_id}")
+def get_signal_job(job_id: int):
+    """受け付けたシグナルの処理状況"""
+    with get_session() as s:
+        job = s.get(SignalJob, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="job not found")
+        return job
+
+
+@app.get("/broker/positions")
+def get_broker_positions():
+    """ブローカー側の建玉（キャッシュから返す。fetched_at / age_sec / stale で古さがわかる）"""
+    return broker_state.positions()
+
+
+@app.get("/broker/account")
+def get_broker_account():
+    """ブローカーの口座サマリー（キャッシュから返す）"""
+    try:
+        return broker_state.account()
+    except NotImplementedError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+
+
+@app.get("/metrics/broker-state")
+def get_broker_state_metrics():
+    """建玉・口座キャッシュのヒット数とブローカーへの取得回数"""
+    return broker_state.snapshot()
+
+
+@app.get("/risk/state")
+def get_risk_state():
+    """リスク管理のポジションブック（建玉・グロスエクスポージャー・当日実現損益）"""
+    return risk_guard.snapshot()
+
+
+@app.get("/prices")
+def get_prices():
+    """直近価格キャッシュ（元データの時刻と古さ）"""
+    return price_cache.snapshot()
+
+
+@app.get("/risk/throttle")
+def get_throttle_state():
+    """発注スロットルの上限とバケツ残量"""
+    return order_throttle.snapshot()
+
+
+@app.get("/metrics/pipeline")
+def get_pipeline_metrics():
+    """パイプラインのキュー長とステージ別レイテンシ"""
+    return pipeline.snapshot()
+
+
+@app.get("/metrics/llm-cache")
+def get_llm_cache_metrics():
+    """LLM 抽出キャッシュのヒット/ミス数"""
+    stats = getattr(llm_client, "stats", None)
+    if stats is None:
+        return {"enabled": False}
+    return {"enabled": True, **stats()}
+
 
-    return {"signal": signal, "order": order_result}
+@app.get("/metrics/extraction")
+def get_extraction_metrics():
+    """抽出の層（rule / llm / rule_fallback / none）ごとの件数とレイテンシ"""
+    return extractor.snapshot()
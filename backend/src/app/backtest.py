@@ -2,10 +2,12 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Iterable, List
+from typing import List, Tuple
 
+import numpy as np
 from sqlmodel import select
 
+from .barstore import bar_store
 from .db import get_session
 from .models import MarketBar
 
@@ -31,20 +33,134 @@ class BacktestResult:
     trades: List[Trade]
 
 
-def _sma(values: List[float], window: int) -> List[float | None]:
-    out: List[float | None] = []
-    acc: float = 0.0
-    for i, v in enumerate(values):
-        acc += v
-        if i >= window:
-            acc -= values[i - window]
-        if i + 1 < window:
-            out.append(None)
-        else:
-            out.append(acc / window)
+@dataclass
+class BarArrays:
+    """1銘柄・1時間足のバーを列ごとの連続配列で持つ（ts は datetime64[us]、昇順）。"""
+
+    ts: np.ndarray
+    open: np.ndarray
+    close: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+
+def load_bars(symbol: str, timeframe: str, start_dt: datetime, end_dt: datetime) -> BarArrays:
+    """
+    バーストアから memmap のビューとして読み出す（コピーなし）。
+    ストアに無い銘柄・時間足は MarketBar から必要な列だけを読み出して NumPy 配列にする。
+    """
+    cols = bar_store.read(symbol, timeframe, start_dt, end_dt)
+    if len(cols):
+        return BarArrays(ts=cols.ts, open=cols.open, close=cols.close)
+
+    with get_session() as s:
+        rows = s.exec(
+            select(MarketBar.ts, MarketBar.open, MarketBar.close)
+            .where(
+                MarketBar.symbol == symbol,
+                MarketBar.timeframe == timeframe,
+                MarketBar.ts >= start_dt,
+                MarketBar.ts <= end_dt,
+            )
+            .order_by(MarketBar.ts)
+        ).all()
+
+    n = len(rows)
+    ts = np.array([r[0].replace(tzinfo=None) for r in rows], dtype="datetime64[us]")
+    opens = np.fromiter((r[1] for r in rows), dtype=np.float64, count=n)
+    closes = np.fromiter((r[2] for r in rows), dtype=np.float64, count=n)
+    return BarArrays(ts=ts, open=opens, close=closes)
+
+
+def _sma(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    単純移動平均。window 本そろうまでは NaN。
+
+    従来のループ（acc += v; acc -= values[i - window]）と丸めまで一致させるため、
+    足す値と引く値を交互に並べた列を np.cumsum（先頭から順に加算する）で累積する。
+    累積和どうしの差を取る方法は丸め誤差で横ばいの相場に偽のクロスを作る。
+    """
+    n = len(values)
+    out = np.full(n, np.nan)
+    if window <= 0 or n < window:
+        return out
+    values = np.asarray(values, dtype=np.float64)
+    steps = np.empty(window + 2 * (n - window), dtype=np.float64)
+    steps[:window] = values[:window]
+    steps[window::2] = values[window:]
+    steps[window + 1 :: 2] = -values[: n - window]
+    acc = np.cumsum(steps)
+    out[window - 1] = acc[window - 1]
+    out[window:] = acc[window + 1 :: 2]
+    out[window - 1 :] /= window
     return out
 
 
+def _crossover_trades(
+    close: np.ndarray, short_window: int, long_window: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    クロスからエントリー/イグジットのバー位置を求める。
+
+    バー i の判定には i-1 と i の SMA 差を使い、約定はバー i の始値。
+    ゴールデンクロス（prev <= 0 < cur）とデッドクロス（prev >= 0 > cur）の
+    連続する同種イベントを畳み、ノーポジから始まる交互列にする。
+    未決済の最終エントリーは含めない。
+    """
+    diff = _sma(close, short_window) - _sma(close, long_window)
+    prev_diff = diff[:-1]
+    cur_diff = diff[1:]
+    # NaN との比較は常に False なので、SMA が揃わない期間は自然に除外される
+    golden = (prev_diff <= 0) & (cur_diff > 0)
+    dead = (prev_diff >= 0) & (cur_diff < 0)
+
+    events = np.flatnonzero(golden | dead) + 1
+    kinds = golden[events - 1]
+    if len(events):
+        keep = np.empty(len(events), dtype=bool)
+        keep[0] = True
+        keep[1:] = kinds[1:] != kinds[:-1]
+        events, kinds = events[keep], kinds[keep]
+        if len(kinds) and not kinds[0]:
+            events, kinds = events[1:], kinds[1:]
+
+    entries = events[kinds]
+    exits = events[~kinds]
+    return entries[: len(exits)], exits
+
+
+def simulate_sma_crossover(
+    opens: np.ndarray,
+    closes: np.ndarray,
+    short_window: int,
+    long_window: int,
+    initial_equity: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, float, float]:
+    """
+    配列上で SMA クロス戦略を評価する。
+
+    :return: (entries, exits, pnls, final_equity, max_drawdown_pct)
+    """
+    entries, exits = _crossover_trades(closes, short_window, long_window)
+    entry_prices = opens[entries]
+    exit_prices = opens[exits]
+
+    # 損益は従来実装と同じ順序の演算で積み上げる（ループは約定の回数分だけ）
+    pnls = np.empty(len(exits), dtype=np.float64)
+    equity = initial_equity
+    peak = initial_equity
+    max_dd_pct = 0.0
+    for k, (entry_price, exit_price) in enumerate(zip(entry_prices.tolist(), exit_prices.tolist())):
+        trade_pnl = (exit_price - entry_price) * (equity / entry_price)
+        equity += trade_pnl
+        pnls[k] = trade_pnl
+        peak = max(peak, equity)
+        if peak > 0:
+            max_dd_pct = min(max_dd_pct, (equity - peak) / peak * 100.0)
+    return entries, exits, pnls, equity, max_dd_pct
+
+
 def run_sma_crossover(
     symbol: str,
     timeframe: str,
@@ -63,19 +179,9 @@ def run_sma_crossover(
     start_dt = datetime.fromisoformat(start)
     end_dt = datetime.fromisoformat(end)
 
-    with get_session() as s:
-        bars = s.exec(
-            select(MarketBar)
-            .where(
-                MarketBar.symbol == symbol,
-                MarketBar.timeframe == timeframe,
-                MarketBar.ts >= start_dt,
-                MarketBar.ts <= end_dt,
-            )
-            .order_by(MarketBar.ts)
-        ).all()
+    bars = load_bars(symbol, timeframe, start_dt, end_dt)
 
-    if not bars:
+    if not len(bars):
         return BacktestResult(
             symbol=symbol,
             start=start,
@@ -87,63 +193,29 @@ def run_sma_crossover(
             trades=[],
         )
 
-    closes = [b.close for b in bars]
-    short_sma = _sma(closes, short_window)
-    long_sma = _sma(closes, long_window)
-
-    in_position = False
-    entry_price = 0.0
-    equity = initial_equity
-    peak = initial_equity
-    max_dd_pct = 0.0
-    trades: List[Trade] = []
-
-    for i in range(1, len(bars)):
-        prev_short = short_sma[i - 1]
-        prev_long = long_sma[i - 1]
-        cur_short = short_sma[i]
-        cur_long = long_sma[i]
-
-        # シグナルがまだ計算できない期間はスキップ
-        if prev_short is None or prev_long is None or cur_short is None or cur_long is None:
-            continue
-
-        bar_next = bars[i]
-        price = bar_next.open
-
-        # クロス判定（シンプルに sign の変化を見る）
-        prev_diff = prev_short - prev_long
-        cur_diff = cur_short - cur_long
-
-        # ゴールデンクロス: ノーポジ → ロング
-        if not in_position and prev_diff <= 0 < cur_diff:
-            in_position = True
-            entry_price = price
-            continue
-
-        # デッドクロス: ロング → ノーポジ
-        if in_position and prev_diff >= 0 > cur_diff:
-            in_position = False
-            exit_price = price
-            pnl_price = exit_price - entry_price
-            # 1単位あたりのPnLを equity にスケール
-            size = equity / entry_price
-            trade_pnl = pnl_price * size
-            equity += trade_pnl
-            trades.append(
-                Trade(
-                    entry_date=bars[i - 1].ts.date().isoformat(),
-                    exit_date=bar_next.ts.date().isoformat(),
-                    entry_price=entry_price,
-                    exit_price=exit_price,
-                    pnl=trade_pnl,
-                )
-            )
+    entries, exits, pnls, equity, max_dd_pct = simulate_sma_crossover(
+        bars.open, bars.close, short_window, long_window, initial_equity
+    )
 
-        peak = max(peak, equity)
-        if peak > 0:
-            dd = (equity - peak) / peak * 100.0
-            max_dd_pct = min(max_dd_pct, dd)
+    # entry_date は従来実装どおり決済バーの1本前の日付
+    entry_dates = np.datetime_as_string(bars.ts[exits - 1], unit="D")
+    exit_dates = np.datetime_as_string(bars.ts[exits], unit="D")
+    trades: List[Trade] = [
+        Trade(
+            entry_date=entry_date,
+            exit_date=exit_date,
+            entry_price=entry_price,
+            exit_price=exit_price,
+            pnl=pnl,
+        )
+        for entry_date, exit_date, entry_price, exit_price, pnl in zip(
+            entry_dates.tolist(),
+            exit_dates.tolist(),
+            bars.open[entries].tolist(),
+            bars.open[exits].tolist(),
+            pnls.tolist(),
+        )
+    ]
 
     total_return_pct = (equity / initial_equity - 1.0) * 100.0
 
@@ -157,4 +229,3 @@ def run_sma_crossover(
         max_drawdown_pct=max_dd_pct,
         trades=trades,
     )
-
@@ -0,0 +1,242 @@
+"""
+列指向のバーストア
+
+(timeframe, symbol) ごとにディレクトリを切り、ts / open / high / low / close / volume を
+それぞれリトルエンディアンの固定長バイナリファイルとして追記する。
+ts は UTC の datetime64[us]、価格・出来高は float64。
+読み出しは np.memmap のスライスなので、必要な範囲のページだけがロードされ
+コピーも発生しない。行数は最短の列ファイルで決まり、追記途中で落ちても
+次回の追記時に揃え直す。
+
+列ファイルはバージョンごとのディレクトリ（v000001/ ...）に置き、CURRENT ファイルが
+使用中のバージョンを指す。過去のバーを差し込むマージは新しいバージョンに全列を書いてから
+CURRENT を1回の rename で切り替えるので、途中で落ちても列がずれない。
+CURRENT が無い古いストアは銘柄ディレクトリ直下の列ファイルをそのまま読む。
+API・同期スケジューラ・取得スクリプトは別プロセスで同じ銘柄に書くので、追記・マージ・
+切り替え・掃除は銘柄ディレクトリの .lock を flock で取ってから行う。
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows ではプロセス内のロックだけで動かす
+    fcntl = None
+
+from .config import settings
+
+log = logging.getLogger(__name__)
+
+COLUMNS: Dict[str, np.dtype] = {
+    "ts": np.dtype("<M8[us]"),
+    "open": np.dtype("<f8"),
+    "high": np.dtype("<f8"),
+    "low": np.dtype("<f8"),
+    "close": np.dtype("<f8"),
+    "volume": np.dtype("<f8"),
+}
+
+
+@dataclass
+class BarColumns:
+    ts: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    @classmethod
+    def empty(cls) -> "BarColumns":
+        return cls(**{name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()})
+
+
+def to_datetime64(dt: datetime) -> np.datetime64:
+    """tz 付きは UTC に変換してから naive な datetime64[us] にする。"""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(dt, "us")
+
+
+CURRENT = "CURRENT"
+
+
+class BarStore:
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+
+    def _base(self, symbol: str, timeframe: str) -> Path:
+        return self.root / timeframe / symbol.upper()
+
+    def _dir(self, symbol: str, timeframe: str) -> Path:
+        """列ファイルのあるディレクトリ（CURRENT が指すバージョン）"""
+        base = self._base(symbol, timeframe)
+        try:
+            return base / (base / CURRENT).read_text(encoding="utf-8").strip()
+        except FileNotFoundError:
+            return base
+
+    def _rows(self, path: Path) -> int:
+        sizes = []
+        for name, dtype in COLUMNS.items():
+            f = path / f"{name}.bin"
+            sizes.append(f.stat().st_size // dtype.itemsize if f.exists() else 0)
+        return min(sizes)
+
+    def _map(self, path: Path, n: int) -> BarColumns:
+        if n == 0:
+            return BarColumns.empty()
+        return BarColumns(
+            **{
+                name: np.memmap(path / f"{name}.bin", dtype=dtype, mode="r", shape=(n,))
+                for name, dtype in COLUMNS.items()
+            }
+        )
+
+    def read(
+        self,
+        symbol: str,
+        timeframe: str,
+        start: datetime | None = None,
+        end: datetime | None = None,
+    ) -> BarColumns:
+        """[start, end] の範囲を memmap のビューで返す（ts 昇順）。"""
+        path = self._dir(symbol, timeframe)
+        cols = self._map(path, self._rows(path))
+        if not len(cols):
+            return cols
+        lo = int(np.searchsorted(cols.ts, to_datetime64(start), side="left")) if start else 0
+        hi = int(np.searchsorted(cols.ts, to_datetime64(end), side="right")) if end else len(cols)
+        return BarColumns(**{name: getattr(cols, name)[lo:hi] for name in COLUMNS})
+
+    def last_ts(self, symbol: str, timeframe: str) -> datetime | None:
+        """最終バーの時刻（UTC, naive）。"""
+        path = self._dir(symbol, timeframe)
+        n = self._rows(path)
+        if n == 0:
+            return None
+        ts = np.memmap(path / "ts.bin", dtype=COLUMNS["ts"], mode="r", shape=(n,))
+        return ts[-1].astype(datetime)
+
+    def last_bar(self, symbol: str, timeframe: str) -> Dict[str, Any] | None:
+        """最終バー（ts は UTC, naive の datetime、他は float）。"""
+        path = self._dir(symbol, timeframe)
+        n = self._rows(path)
+        if n == 0:
+            return None
+        bar: Dict[str, Any] = {}
+        for name, dtype in COLUMNS.items():
+            col = np.memmap(path / f"{name}.bin", dtype=dtype, mode="r", shape=(n,))
+            bar[name] = col[-1].astype(datetime) if name == "ts" else float(col[-1])
+        return bar
+
+    def symbols(self, timeframe: str) -> list[str]:
+        """その時間足で保存済みの銘柄一覧。"""
+        path = self.root / timeframe
+        if not path.is_dir():
+            return []
+        return sorted(p.name for p in path.iterdir() if p.is_dir())
+
+    def append(self, symbol: str, timeframe: str, bars: BarColumns) -> int:
+        """
+        バーを追記し、追加した本数を返す。
+        既存の最終 ts 以前のバーは、既存と重複するものを除いてマージし直す。
+        """
+        if not len(bars):
+            return 0
+        order = np.argsort(bars.ts, kind="stable")
+        incoming = {name: np.asarray(getattr(bars, name), dtype=dtype)[order] for name, dtype in COLUMNS.items()}
+        # 同一 ts は後勝ちで1本にする
+        ts = incoming["ts"]
+        keep = np.append(ts[1:] != ts[:-1], True)
+        incoming = {name: col[keep] for name, col in incoming.items()}
+
+        with self._locked(self._base(symbol, timeframe)):
+            path = self._dir(symbol, timeframe)
+            path.mkdir(parents=True, exist_ok=True)
+            n = self._rows(path)
+            self._truncate(path, n)
+            if n:
+                last = np.memmap(path / "ts.bin", dtype=COLUMNS["ts"], mode="r", shape=(n,))[-1]
+                if incoming["ts"][0] <= last:
+                    return self._merge(self._base(symbol, timeframe), path, n, incoming)
+            for name in COLUMNS:
+                with open(path / f"{name}.bin", "ab") as f:
+                    f.write(incoming[name].tobytes())
+            return len(incoming["ts"])
+
+    @contextmanager
+    def _locked(self, base: Path) -> Iterator[None]:
+        """プロセス内はスレッドロック、プロセス間は銘柄ごとのロックファイルで排他する"""
+        with self._lock:
+            base.mkdir(parents=True, exist_ok=True)
+            with open(base / ".lock", "a") as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                yield
+
+    def _truncate(self, path: Path, n: int) -> None:
+        for name, dtype in COLUMNS.items():
+            f = path / f"{name}.bin"
+            if f.exists() and f.stat().st_size != n * dtype.itemsize:
+                os.truncate(f, n * dtype.itemsize)
+
+    def _merge(self, base: Path, path: Path, n: int, incoming: Dict[str, np.ndarray]) -> int:
+        existing = self._map(path, n)
+        new_mask = ~np.isin(incoming["ts"], existing.ts)
+        added = int(new_mask.sum())
+        if not added:
+            return 0
+        merged_ts = np.concatenate((existing.ts, incoming["ts"][new_mask]))
+        order = np.argsort(merged_ts, kind="stable")
+        version = self._next_version(base)
+        target = base / version
+        target.mkdir()
+        for name in COLUMNS:
+            merged = np.concatenate((getattr(existing, name), incoming[name][new_mask]))[order]
+            with open(target / f"{name}.bin", "wb") as f:
+                merged.tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+        # 全列が揃ってから CURRENT を切り替える
+        tmp = base / f"{CURRENT}.tmp"
+        tmp.write_text(version, encoding="utf-8")
+        os.replace(tmp, base / CURRENT)
+        self._cleanup(base, current=version, previous=path)
+        log.info("bar store merged %d bars into %s", added, target)
+        return added
+
+    @staticmethod
+    def _next_version(base: Path) -> str:
+        versions = [int(p.name[1:]) for p in base.iterdir() if p.is_dir() and p.name[:1] == "v" and p.name[1:].isdigit()]
+        return f"v{max(versions, default=0) + 1:06d}"
+
+    @staticmethod
+    def _cleanup(base: Path, current: str, previous: Path) -> None:
+        """使われなくなったバージョンを消す（読み出し中のリーダーのため直前の1世代は残す）"""
+        for p in base.iterdir():
+            if p.is_dir() and p.name[:1] == "v" and p.name[1:].isdigit():
+                if p.name not in (current, previous.name):
+                    shutil.rmtree(p, ignore_errors=True)
+            elif p.suffix == ".bin" and previous != base:
+                # CURRENT 導入前の直下の列ファイル（直前の世代でなくなったもの）
+                p.unlink(missing_ok=True)
+
+
+bar_store = BarStore(settings.bar_store_dir)
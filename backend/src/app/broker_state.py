@@ -0,0 +1,197 @@
+"""
+ブローカー状態（建玉・口座）のキャッシュ
+
+positions() / account() の結果を TTL 付きでメモリに持ち、ファイルにも書いて
+API の複数ワーカーや trade_updates ワーカーと共有する（cookie_store と同じ考え方）。
+約定が入ったら invalidate() で無効化し、次の参照でだけブローカーに取りに行く。
+ファイルの更新時刻が変わったときだけ読み直すので、通常の参照は os.stat 1回で済む。
+書き込みはロックファイルを取ってから読み直してマージするので、他プロセスの無効化を消さない。
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows ではロック無しで動かす
+    fcntl = None
+
+from .config import settings
+
+log = logging.getLogger(__name__)
+
+KINDS = ("positions", "account")
+
+
+def _fetch_positions() -> Dict[str, Any]:
+    from broker import get_broker
+
+    return get_broker().positions()
+
+
+def _fetch_account() -> Dict[str, Any]:
+    from broker import get_broker
+
+    return get_broker().account()
+
+
+class BrokerStateCache:
+    def __init__(
+        self,
+        path: str | Path,
+        ttl_sec: float,
+        fetchers: Optional[Dict[str, Callable[[], Dict[str, Any]]]] = None,
+    ):
+        self.path = Path(path)
+        self.ttl_sec = ttl_sec
+        self._fetchers = fetchers or {"positions": _fetch_positions, "account": _fetch_account}
+        # kind -> {"data", "fetched_at", "invalidated_at"}（時刻は epoch 秒）
+        self._state: Dict[str, Dict[str, Any]] = {}
+        self._mtime: float | None = None
+        self._lock = threading.Lock()
+        self._fetch_locks = {kind: threading.Lock() for kind in KINDS}
+        self.hits = 0
+        self.fetches = 0
+
+    # ------------------------------------------------------------------ #
+    # 共有ファイル
+    # ------------------------------------------------------------------ #
+    def _read_file(self) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning("broker state file unreadable: %s", e)
+            return None
+
+    def _merge(self, shared: Dict[str, Any]) -> None:
+        """ファイル側の値を取り込む（data は新しく取得した方、invalidated_at は遅い方）"""
+        with self._lock:
+            for kind, entry in shared.items():
+                mine = self._state.setdefault(kind, {})
+                if entry.get("fetched_at", 0) > mine.get("fetched_at", 0):
+                    mine["data"] = entry.get("data")
+                    mine["fetched_at"] = entry["fetched_at"]
+                if entry.get("invalidated_at", 0) > mine.get("invalidated_at", 0):
+                    mine["invalidated_at"] = entry["invalidated_at"]
+
+    def _sync_from_file(self) -> None:
+        try:
+            mtime = self.path.stat().st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        shared = self._read_file()
+        if shared is None:
+            return
+        self._merge(shared)
+        self._mtime = mtime
+
+    def _write_file(self) -> None:
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path.with_suffix(f"{self.path.suffix}.lock"), "a") as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                # 最後に読んでから他プロセスが書いた無効化・取得結果を取り込んでから書く
+                shared = self._read_file()
+                if shared:
+                    self._merge(shared)
+                with self._lock:
+                    payload = json.dumps(self._state)
+                tmp = self.path.with_suffix(f"{self.path.suffix}.{os.getpid()}.tmp")
+                tmp.write_text(payload, encoding="utf-8")
+                os.replace(tmp, self.path)
+                self._mtime = self.path.stat().st_mtime
+        except Exception as e:
+            log.warning("broker state file write failed: %s", e)
+
+    # ------------------------------------------------------------------ #
+    # public
+    # ------------------------------------------------------------------ #
+    def _fresh(self, entry: Dict[str, Any], now: float) -> bool:
+        fetched_at = entry.get("fetched_at")
+        return (
+            fetched_at is not None
+            and now - fetched_at < self.ttl_sec
+            and fetched_at > entry.get("invalidated_at", 0)
+        )
+
+    def get(self, kind: str, allow_stale: bool = True) -> Dict[str, Any]:
+        """キャッシュ済みの値を返す。期限切れ・無効化済みならブローカーから取り直す。
+
+        取得に失敗した場合、allow_stale なら古い値に stale=True と error を付けて返す。
+        """
+        self._sync_from_file()
+        now = time.time()
+        entry = self._state.get(kind, {})
+        if self._fresh(entry, now):
+            self.hits += 1
+            return self._view(entry, now)
+        # 同じ種類の取得は1本にまとめ、待っている間に他のスレッドが取ってきた値を使う
+        with self._fetch_locks[kind]:
+            self._sync_from_file()
+            now = time.time()
+            entry = self._state.get(kind, {})
+            if self._fresh(entry, now):
+                self.hits += 1
+                return self._view(entry, now)
+            # 取得中に入った無効化を取りこぼさないよう、取得開始時刻を fetched_at にする
+            started = time.time()
+            try:
+                data = self._fetchers[kind]()
+            except Exception as e:
+                if not allow_stale or "data" not in entry:
+                    raise
+                log.warning("broker %s fetch failed, serving cached value: %s", kind, e)
+                return {**self._view(entry, now), "stale": True, "error": str(e)}
+            self.fetches += 1
+            with self._lock:
+                entry = self._state.setdefault(kind, {})
+                entry["data"] = data
+                entry["fetched_at"] = started
+        self._write_file()
+        return self._view(entry, time.time())
+
+    def positions(self, allow_stale: bool = True) -> Dict[str, Any]:
+        return self.get("positions", allow_stale)
+
+    def account(self, allow_stale: bool = True) -> Dict[str, Any]:
+        return self.get("account", allow_stale)
+
+    def invalidate(self, *kinds: str) -> None:
+        """約定などで状態が変わったときに呼ぶ（他プロセスにもファイル経由で伝わる）"""
+        self._sync_from_file()
+        now = time.time()
+        changed = False
+        with self._lock:
+            for kind in kinds or KINDS:
+                entry = self._state.setdefault(kind, {})
+                # 取得後にまだ誰も無効化していないときだけ書く（約定が続いてもファイル書き込みは1回）
+                if entry.get("invalidated_at", 0) <= entry.get("fetched_at", 0):
+                    entry["invalidated_at"] = now
+                    changed = True
+        if changed:
+            self._write_file()
+
+    def _view(self, entry: Dict[str, Any], now: float) -> Dict[str, Any]:
+        fetched_at = entry.get("fetched_at")
+        return {
+            "data": entry.get("data"),
+            "fetched_at": fetched_at,
+            "age_sec": round(now - fetched_at, 3) if fetched_at else None,
+            "stale": not self._fresh(entry, now),
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"ttl_sec": self.ttl_sec, "hits": self.hits, "fetches": self.fetches}
+
+
+broker_state = BrokerStateCache(settings.broker_state_path, settings.broker_state_ttl_sec)
@@ -15,26 +15,122 @@ class Settings(BaseModel):
     openai_api_key: str = os.getenv("OPENAI_API_KEY", "")
     openai_api_base: str = os.getenv("OPENAI_API_BASE", "")  # Groq: https://api.groq.com/openai/v1
     openai_model: str = os.getenv("OPENAI_MODEL", "llama-3.3-70b-versatile")  # Groq無料モデル
+    # マイクロバッチ: window_ms 待つか batch_max 件たまったら1リクエストにまとめる（1 で無効）
+    llm_batch_max: int = int(os.getenv("LLM_BATCH_MAX", "16"))
+    llm_batch_window_ms: int = int(os.getenv("LLM_BATCH_WINDOW_MS", "50"))
+    llm_max_concurrency: int = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+    # 抽出結果キャッシュ（メモリ LRU + SQLite ファイル）
+    llm_cache_enabled: bool = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+    llm_cache_path: str = os.getenv("LLM_CACHE_PATH", "./data/llm_cache.sqlite3")
+    llm_cache_ttl_sec: int = int(os.getenv("LLM_CACHE_TTL_SEC", "86400"))
+    llm_cache_memory_size: int = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "2048"))
+    llm_cache_max_rows: int = int(os.getenv("LLM_CACHE_MAX_ROWS", "100000"))
 
 
     max_daily_loss: float = float(os.getenv("MAX_DAILY_LOSS", "500"))
+    # 銘柄ごとの建玉上限。価格が分かるときは MAX_POSITION_USD（0 なら「DEFAULT_ORDER_USD の
+    # 注文 N 回分」）の金額、分からないときは株数として扱う。1株だけの建玉は常に許可する
     max_position_per_ticker: int = int(os.getenv("MAX_POSITION_PER_TICKER", "2"))
+    max_position_usd: float = float(os.getenv("MAX_POSITION_USD", "0"))
+    # 1注文の金額上限。1株でもこれを超える銘柄は発注しない（SKIPPED）。スロットルの金額バケツも
+    # 最低この金額を入れられる容量にする
+    max_order_usd: float = float(os.getenv("MAX_ORDER_USD", "1000"))
+    # 全銘柄合計の建玉金額（|数量|×平均単価）の上限（0 で無効）
+    max_gross_exposure: float = float(os.getenv("MAX_GROSS_EXPOSURE", "0"))
+    # 発注スロットル（1分あたりの件数 / 想定金額。件数 0 でその単位は無効、金額 0 で金額制限なし）
+    # バケツの容量は burst_sec 秒分。待ち時間が max_delay_sec を超える注文は棄却する
+    throttle_global_orders_per_min: float = float(os.getenv("THROTTLE_GLOBAL_ORDERS_PER_MIN", "30"))
+    throttle_global_notional_per_min: float = float(os.getenv("THROTTLE_GLOBAL_NOTIONAL_PER_MIN", "5000"))
+    throttle_ticker_orders_per_min: float = float(os.getenv("THROTTLE_TICKER_ORDERS_PER_MIN", "2"))
+    throttle_ticker_notional_per_min: float = float(os.getenv("THROTTLE_TICKER_NOTIONAL_PER_MIN", "1000"))
+    throttle_source_orders_per_min: float = float(os.getenv("THROTTLE_SOURCE_ORDERS_PER_MIN", "10"))
+    throttle_source_notional_per_min: float = float(os.getenv("THROTTLE_SOURCE_NOTIONAL_PER_MIN", "2000"))
+    throttle_burst_sec: float = float(os.getenv("THROTTLE_BURST_SEC", "10"))
+    throttle_max_delay_sec: float = float(os.getenv("THROTTLE_MAX_DELAY_SEC", "30"))
+    # ポジションブックとブローカー建玉の突き合わせ間隔（0 で起動時のみ）
+    risk_reconcile_interval_sec: int = int(os.getenv("RISK_RECONCILE_INTERVAL_SEC", "60"))
+    # リスクチェックを通って約定待ちの注文の予約を保持する上限秒数（約定・突き合わせで先に消える）
+    risk_reservation_ttl_sec: float = float(os.getenv("RISK_RESERVATION_TTL_SEC", "300"))
     default_order_usd: float = float(os.getenv("DEFAULT_ORDER_USD", "200"))
+    # 直近価格キャッシュ: 読み込む時間足（同じ銘柄は最も新しいバーの終値を使う）、
+    # 更新間隔、発注数量の計算に使える価格の古さの上限（0 で無制限）
+    price_timeframes: list[str] = [
+    x.strip() for x in os.getenv("PRICE_TIMEFRAMES", "1Min,5Min,15Min,1Hour,1Day").split(",") if x.strip()
+    ]
+    price_refresh_sec: int = int(os.getenv("PRICE_REFRESH_SEC", "30"))
+    price_max_age_sec: int = int(os.getenv("PRICE_MAX_AGE_SEC", str(4 * 86400)))
     market: str = os.getenv("MARKET", "US")
+    # 取引可能銘柄のスナップショット（1行1銘柄）。ファイルがなければ銘柄チェックをしない
+    symbol_universe_path: str = os.getenv("SYMBOL_UNIVERSE_PATH", "./data/symbols.txt")
+
+    # バックテストのパラメータスイープで使うプロセス数（0 なら CPU コア数）
+    sweep_max_workers: int = int(os.getenv("SWEEP_MAX_WORKERS", "0"))
+    # 1リクエストで評価する組み合わせ（銘柄 × short × long）の上限
+    sweep_max_grid: int = int(os.getenv("SWEEP_MAX_GRID", "20000"))
 
     # 自動取引設定
     auto_trade_enabled: bool = os.getenv("AUTO_TRADE_ENABLED", "false").lower() == "true"
     min_confidence: float = float(os.getenv("MIN_CONFIDENCE", "0.7"))
+    # ルール抽出のスコアがこれ未満、または矛盾がある場合だけ LLM に回す
+    rule_confidence_threshold: float = float(os.getenv("RULE_CONFIDENCE_THRESHOLD", "0.8"))
+
+    # シグナル処理パイプラインのワーカースレッド数（抽出 / リスク+発注）
+    # 抽出ワーカーは LLM 応答待ちで止まるだけなので、バッチが埋まる程度に多めにする
+    pipeline_extract_workers: int = int(os.getenv("PIPELINE_EXTRACT_WORKERS", "16"))
+    pipeline_order_workers: int = int(os.getenv("PIPELINE_ORDER_WORKERS", "1"))
+
+    # POST /signals/batch で1回に受け付ける件数の上限
+    signal_batch_max: int = int(os.getenv("SIGNAL_BATCH_MAX", "100"))
+
+    # シグナル重複検知のプロセス内キャッシュ件数
+    dedup_cache_size: int = int(os.getenv("DEDUP_CACHE_SIZE", "10000"))
 
 
     broker: str = os.getenv("BROKER", "paper") # paper or alpaca
+    # 紙取引: 成行のスリッページ（bp）と、1バーで約定できる出来高の割合（0 で無制限）
+    paper_slippage_bps: float = float(os.getenv("PAPER_SLIPPAGE_BPS", "5"))
+    paper_participation: float = float(os.getenv("PAPER_PARTICIPATION", "0.1"))
+    # 複数注文（マルチレッグ）をまとめて出すときの同時送信数
+    broker_bulk_concurrency: int = int(os.getenv("BROKER_BULK_CONCURRENCY", "8"))
+    # ブローカーの建玉・口座キャッシュ（API ワーカー間・trade_updates ワーカーとファイルで共有）
+    broker_state_path: str = os.getenv("BROKER_STATE_PATH", "./data/broker_state.json")
+    broker_state_ttl_sec: float = float(os.getenv("BROKER_STATE_TTL_SEC", "30"))
     # Alpaca
     alpaca_api_key: str = os.getenv("ALPACA_API_KEY", "")
     alpaca_secret_key: str = os.getenv("ALPACA_SECRET_KEY", "")
     alpaca_paper: bool = os.getenv("ALPACA_PAPER", "true").lower() == "true"
+    # Alpaca の接続先の上書き（空なら paper/live の既定 URL）。非同期クライアントの接続プール、タイムアウト、再試行
+    alpaca_base_url: str = os.getenv("ALPACA_BASE_URL", "")
+    alpaca_max_connections: int = int(os.getenv("ALPACA_MAX_CONNECTIONS", "20"))
+    alpaca_timeout_sec: float = float(os.getenv("ALPACA_TIMEOUT_SEC", "10"))
+    alpaca_max_retries: int = int(os.getenv("ALPACA_MAX_RETRIES", "3"))
+    # trade_updates ストリーム: 接続先の上書き、1トランザクションにまとめる件数と待ち時間、
+    # まだ DB に無い注文のイベントを保留する秒数（過ぎたらブローカー側の注文として登録する）
+    trade_updates_url: str = os.getenv("TRADE_UPDATES_URL", "")
+    trade_updates_batch_max: int = int(os.getenv("TRADE_UPDATES_BATCH_MAX", "200"))
+    trade_updates_flush_ms: float = float(os.getenv("TRADE_UPDATES_FLUSH_MS", "20"))
+    trade_updates_orphan_sec: float = float(os.getenv("TRADE_UPDATES_ORPHAN_SEC", "10"))
 
 
     database_url: str = os.getenv("DATABASE_URL", "sqlite:///./trader.db")
 
+    # 列指向バーストア（銘柄×時間足ごとの列ファイル）。MarketBar テーブルは任意のミラー
+    bar_store_dir: str = os.getenv("BAR_STORE_DIR", "./data/bars")
+    bar_sql_mirror: bool = os.getenv("BAR_SQL_MIRROR", "true").lower() == "true"
+    ingest_batch_size: int = int(os.getenv("INGEST_BATCH_SIZE", "5000"))
+    # ヒストリカルバー取得: 並列数と1チャンクの日数（0 なら時間足から自動）
+    bar_download_workers: int = int(os.getenv("BAR_DOWNLOAD_WORKERS", "4"))
+    bar_download_window_days: int = int(os.getenv("BAR_DOWNLOAD_WINDOW_DAYS", "0"))
+    bar_download_max_retries: int = int(os.getenv("BAR_DOWNLOAD_MAX_RETRIES", "5"))
+    # 定期バー同期（workers.scheduler）: 対象銘柄・時間足と、未取得時にさかのぼる日数
+    bar_sync_symbols: list[str] = [
+    x.strip().upper() for x in os.getenv("BAR_SYNC_SYMBOLS", "").split(",") if x.strip()
+    ]
+    bar_sync_timeframes: list[str] = [
+    x.strip() for x in os.getenv("BAR_SYNC_TIMEFRAMES", "1Day").split(",") if x.strip()
+    ]
+    bar_sync_interval_min: int = int(os.getenv("BAR_SYNC_INTERVAL_MIN", "15"))
+    bar_sync_lookback_days: int = int(os.getenv("BAR_SYNC_LOOKBACK_DAYS", "30"))
+
 
 settings = Settings()
@@ -1,3 +1,4 @@
+from sqlalchemy import inspect, text
 from sqlmodel import SQLModel, create_engine, Session
 from .config import settings
 
@@ -5,9 +6,39 @@ from .config import settings
 engine = create_engine(settings.database_url, echo=False)
 
 
+def _add_missing_columns():
+    """既存テーブルに後から追加した NULL 可の列を ALTER TABLE で足す（簡易マイグレーション）"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {col_type}'))
+
+
 def init_db():
     SQLModel.metadata.create_all(engine)
+    _add_missing_columns()
+    # create_all は既存テーブルに後から追加したインデックスを作らないので個別に作成する
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
 
 
 def get_session():
-    return Session(engine)
\ No newline at end of file
+    return Session(engine)
+
+
+def insert_ignore(model):
+    """ユニーク制約に衝突した行を無視する INSERT 文を返す（SQLite / PostgreSQL）。"""
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model.__table__).on_conflict_do_nothing()
@@ -0,0 +1,129 @@
+"""
+シグナルの重複検知
+
+SignalKey テーブル（key にユニークインデックス）に message_id / URL（どちらも無ければ本文ハッシュ）を
+シグナル保存と同じトランザクションで INSERT ... ON CONFLICT DO NOTHING する。
+1件でも衝突すれば重複としてロールバックするので、判定はテーブルサイズに
+依存しないインデックス 1 回分で済み、並行リクエスト間でも原子的になる。
+
+手前に直近のキーを持つ LRU キャッシュを置き、バースト時の再送は DB に触れずに弾く。
+"""
+
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Tuple
+
+from sqlalchemy import delete, func, update
+from sqlmodel import select
+
+from .config import settings
+from .db import get_session, insert_ignore
+from .models import Signal, SignalKey
+
+log = logging.getLogger(__name__)
+
+# receive_signal が URL を本文末尾に付ける形式
+_SOURCE_URL_PATTERN = re.compile(r"\n\nSource: (?P<url>\S+)$")
+
+
+def text_key(source: str, text: str) -> str:
+    """本文ハッシュのキー（message_id が無い場合の message_id と同じ形式）"""
+    return f"{source}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+def message_keys(source: str, text: str, meta: Dict[str, Any]) -> Tuple[str, List[str]]:
+    """
+    meta の message_id / id / url から (保存する message_id, 重複判定キー一覧) を求める。
+    本文ハッシュは ID が1つも無いときだけ使う（同じ本文の別投稿を重複扱いしない）。
+    """
+    candidates = [str(k) for k in (meta.get("message_id"), meta.get("id"), meta.get("url")) if k]
+    if not candidates:
+        key = text_key(source, text)
+        return key, [key]
+    return candidates[0], list(dict.fromkeys(candidates))
+
+
+class DedupIndex:
+    def __init__(self, max_size: int = 10_000):
+        self.max_size = max_size
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cached(self, keys: Iterable[str]) -> str | None:
+        """LRU キャッシュに載っているキーがあれば返す（DB アクセスなし）"""
+        with self._lock:
+            for key in keys:
+                if key in self._recent:
+                    self._recent.move_to_end(key)
+                    return key
+        return None
+
+    def remember(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._recent[key] = None
+                self._recent.move_to_end(key)
+            while len(self._recent) > self.max_size:
+                self._recent.popitem(last=False)
+
+    def forget(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._recent.pop(key, None)
+
+    def claim(self, session, keys: List[str], signal_id: int | None) -> bool:
+        """
+        キーを一括 INSERT（衝突は無視）し、全件挿入できたら True。
+        False の場合は既存キーがあるので呼び出し側でロールバックする。
+        """
+        if not keys:
+            return True
+        rows = [{"key": k, "signal_id": signal_id} for k in keys]
+        result = session.execute(insert_ignore(SignalKey).values(rows))
+        return result.rowcount == len(keys)
+
+    def existing(self, session, keys: Iterable[str]) -> set[str]:
+        """DB に登録済みのキー（key のユニークインデックスに対する IN 検索1回）"""
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return set()
+        return set(session.exec(select(SignalKey.key).where(SignalKey.key.in_(keys))).all())
+
+    def attach(self, session, keys: List[str], signal_id: int) -> None:
+        """受付時に signal_id なしで確保したキーをシグナルに紐付ける"""
+        session.execute(
+            update(SignalKey).where(SignalKey.key.in_(keys)).values(signal_id=signal_id)
+        )
+
+    def release(self, session, keys: List[str]) -> None:
+        """シグナルにならなかったメッセージのキーを解放し、再送を受け付けられるようにする"""
+        session.execute(
+            delete(SignalKey).where(SignalKey.key.in_(keys), SignalKey.signal_id.is_(None))
+        )
+        self.forget(keys)
+
+
+dedup_index = DedupIndex(settings.dedup_cache_size)
+
+
+def backfill_signal_keys() -> None:
+    """SignalKey 導入前の Signal から message_id / Source URL のキーを作成する（初回のみ）"""
+    with get_session() as s:
+        if s.exec(select(SignalKey.id).limit(1)).first() is not None:
+            return
+        if not s.exec(select(func.count(Signal.id))).one():
+            return
+        rows = []
+        for signal_id, message_id, content in s.exec(
+            select(Signal.id, Signal.message_id, Signal.content)
+        ):
+            rows.append({"key": message_id, "signal_id": signal_id})
+            m = _SOURCE_URL_PATTERN.search(content or "")
+            if m:
+                rows.append({"key": m.group("url"), "signal_id": signal_id})
+        s.execute(insert_ignore(SignalKey), rows)
+        s.commit()
+    log.info("backfilled %d signal dedup keys", len(rows))
@@ -0,0 +1,155 @@
+"""
+段階的なシグナル抽出
+
+1. ルール層: コンパイル済みの正規表現で銘柄・売買方向を拾い、確からしさのスコアを付ける
+2. LLM 層: ルールのスコアが閾値未満、または銘柄/方向が複数あって矛盾する場合だけ呼ぶ
+
+"$AAPL BUY" のような明確なメッセージは LLM を待たずに、ルールのスコアを confidence として返る。
+閾値未満のルール結果を LLM の代わりに使う場合（rule_fallback）は confidence を付けず、自動発注しない。
+各層を通った件数とレイテンシを StageMetrics に記録する。
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from .config import settings
+from .metrics import StageMetrics, elapsed_ms
+from .schemas import ExtractedSignal
+from .utils import (
+    FALLBACK_PATTERN,
+    JP_CODE_PATTERN,
+    JP_SIDE_PATTERN,
+    SIDE_PATTERN,
+    TICKER_PATTERN,
+    fallback_ticker,
+)
+from .universe import symbol_universe
+
+log = logging.getLogger(__name__)
+
+_SIDES = {
+    "BUY": "BUY",
+    "LONG": "BUY",
+    "SELL": "SELL",
+    "SHORT": "SELL",
+    "買い": "BUY",
+    "ロング": "BUY",
+    "売り": "SELL",
+    "ショート": "SELL",
+}
+
+# ルールごとのスコア
+SCORE_CASHTAG = 0.9  # $TICKER + 売買方向
+SCORE_JP_CODE = 0.7  # 4桁コード + 買い/売り（数字の誤検出があるので閾値未満にして LLM に回す）
+SCORE_FALLBACK = 0.5  # $ なしの大文字語 + 売買方向
+CONFLICT_PENALTY = 0.4
+
+
+def _valid(candidates) -> list:
+    return [t for t in dict.fromkeys(c.upper() for c in candidates) if symbol_universe.is_valid(t)]
+
+
+@dataclass
+class RuleResult:
+    signal: Optional[ExtractedSignal]
+    score: float
+    conflict: bool
+
+
+class RuleExtractor:
+    def __init__(self, market: str | None = None):
+        # 4桁コードは日本株の市場設定のときだけ銘柄として扱う（"Target 1500" などを拾わない）
+        self.jp_codes = (market or settings.market).upper() == "JP"
+
+    def extract(self, text: str) -> RuleResult:
+        en_sides = {_SIDES[m.group("side").upper()] for m in SIDE_PATTERN.finditer(text)}
+        jp_sides = {_SIDES[m.group("side")] for m in JP_SIDE_PATTERN.finditer(text)}
+        sides = en_sides | jp_sides
+        side = next(iter(sides)) if len(sides) == 1 else None
+        side_conflict = len(sides) > 1
+
+        # ユニバースにない候補（"$USD" など）はここで落とす
+        tickers = _valid(m.group("ticker") for m in TICKER_PATTERN.finditer(text))
+        if tickers and sides:
+            return self._result(tickers, side, SCORE_CASHTAG, side_conflict)
+
+        # 4桁コードは日本語の 買い/売り とだけ組み合わせる
+        if self.jp_codes and jp_sides:
+            codes = _valid(m.group("code") for m in JP_CODE_PATTERN.finditer(text))
+            if codes:
+                jp_side = next(iter(jp_sides)) if len(jp_sides) == 1 else None
+                return self._result(codes, jp_side, SCORE_JP_CODE, side_conflict)
+
+        fb = FALLBACK_PATTERN.search(text)
+        if fb:
+            ticker = fallback_ticker(text, fb)
+            if ticker is None:
+                return RuleResult(signal=None, score=0.0, conflict=False)
+            fb_side = _SIDES[fb.group("side").upper()]
+            return self._result([ticker], fb_side, SCORE_FALLBACK, side_conflict)
+
+        return RuleResult(signal=None, score=0.0, conflict=False)
+
+    @staticmethod
+    def _result(tickers: list, side: Optional[str], score: float, side_conflict: bool) -> RuleResult:
+        conflict = side_conflict or len(tickers) > 1
+        if conflict:
+            score -= CONFLICT_PENALTY
+        # 売買方向が矛盾している場合はルール層ではシグナルを作らない
+        if side is None:
+            return RuleResult(signal=None, score=score, conflict=conflict)
+        # confidence は TieredExtractor が閾値を超えたときだけ付ける（フォールバックでは自動発注しない）
+        signal = ExtractedSignal(ticker=tickers[0], side=side)
+        return RuleResult(signal=signal, score=score, conflict=conflict)
+
+
+class TieredExtractor:
+    TIERS = ("rule", "llm", "rule_fallback", "none")
+
+    def __init__(self, llm: Any = None, threshold: float = 0.8):
+        self.rules = RuleExtractor()
+        self.llm = llm
+        self.threshold = threshold
+        self.metrics: Dict[str, StageMetrics] = {tier: StageMetrics() for tier in self.TIERS}
+
+    def extract(self, text: str) -> ExtractedSignal | None:
+        started = time.perf_counter()
+        rule = self.rules.extract(text)
+        if rule.signal is not None and rule.score >= self.threshold and not rule.conflict:
+            self.metrics["rule"].observe(elapsed_ms(started))
+            # 閾値を超えたルールのスコアを confidence として渡す（"$AAPL BUY" も自動発注の対象になる）
+            return rule.signal.model_copy(update={"confidence": rule.score})
+
+        if self.llm is not None:
+            try:
+                result = self.llm.extract(text)
+            except Exception as e:  # pragma: no cover - defensive logging
+                log.warning("LLM extraction failed: %s", e)
+                result = None
+            if result and symbol_universe.is_valid(result.ticker):
+                self.metrics["llm"].observe(elapsed_ms(started))
+                return result
+            if result:
+                log.info("LLM returned ticker outside the universe: %s", result.ticker)
+
+        if rule.signal is not None:
+            self.metrics["rule_fallback"].observe(elapsed_ms(started))
+            return rule.signal
+        self.metrics["none"].observe(elapsed_ms(started))
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        stages = {tier: m.snapshot() for tier, m in self.metrics.items()}
+        total = sum(s["count"] for s in stages.values())
+        return {
+            "threshold": self.threshold,
+            "total": total,
+            "tiers": {
+                tier: {**s, "fraction": s["count"] / total if total else None}
+                for tier, s in stages.items()
+            },
+        }
@@ -0,0 +1,91 @@
+"""
+バーの一括取り込み
+
+バーストアへの追記と、MarketBar ミラーへの
+INSERT ... ON CONFLICT (symbol, timeframe, ts) DO NOTHING をチャンク単位の
+executemany で行う。1チャンク1トランザクションで、行ごとの SELECT は行わない。
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+
+from .barstore import BarColumns, bar_store
+from .config import settings
+from .db import engine, insert_ignore
+from .models import MarketBar
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class IngestStats:
+    symbol: str
+    timeframe: str
+    rows: int
+    stored: int
+    mirrored: int
+    seconds: float
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else float("inf")
+
+
+def mirror_bars(symbol: str, timeframe: str, bars: BarColumns, batch_size: int | None = None) -> int:
+    """MarketBar に一括 INSERT（重複は無視）し、挿入できた行数を返す。"""
+    batch_size = batch_size or settings.ingest_batch_size
+    stmt = insert_ignore(MarketBar)
+    ts: list[datetime] = bars.ts.astype("datetime64[us]").tolist()
+    columns = {name: np.asarray(getattr(bars, name), dtype=np.float64).tolist() for name in ("open", "high", "low", "close", "volume")}
+    inserted = 0
+    for lo in range(0, len(ts), batch_size):
+        hi = min(lo + batch_size, len(ts))
+        rows = [
+            {
+                "symbol": symbol,
+                "timeframe": timeframe,
+                "ts": ts[i],
+                "open": columns["open"][i],
+                "high": columns["high"][i],
+                "low": columns["low"][i],
+                "close": columns["close"][i],
+                "volume": columns["volume"][i],
+            }
+            for i in range(lo, hi)
+        ]
+        with engine.begin() as conn:
+            result = conn.execute(stmt, rows)
+        if result.rowcount and result.rowcount > 0:
+            inserted += result.rowcount
+    return inserted
+
+
+def ingest_bars(symbol: str, timeframe: str, bars: BarColumns, batch_size: int | None = None) -> IngestStats:
+    """バーストアに追記し、BAR_SQL_MIRROR が有効なら MarketBar にもミラーする。"""
+    started = time.perf_counter()
+    stored = bar_store.append(symbol, timeframe, bars)
+    mirrored = mirror_bars(symbol, timeframe, bars, batch_size) if settings.bar_sql_mirror else 0
+    stats = IngestStats(
+        symbol=symbol,
+        timeframe=timeframe,
+        rows=len(bars),
+        stored=stored,
+        mirrored=mirrored,
+        seconds=time.perf_counter() - started,
+    )
+    log.info(
+        "ingested %s %s rows=%d stored=%d mirrored=%d %.0f rows/s",
+        symbol,
+        timeframe,
+        stats.rows,
+        stats.stored,
+        stats.mirrored,
+        stats.rows_per_sec,
+    )
+    return stats
@@ -0,0 +1,374 @@
+"""
+ヒストリカルバーの取得
+
+(銘柄, 期間ウィンドウ) 単位のチャンクに分割し、ThreadPoolExecutor で並列に取得して
+銘柄ごとに時刻順で ingest_bars へ流し込む。完了したチャンクは
+BarFetchCheckpoint に記録し、中断後に同じ範囲を再実行すると未完了分だけを取得する。
+レート制限（429）やサーバーエラー、接続エラーはジッター付き指数バックオフで再試行する。
+"""
+
+from __future__ import annotations
+
+import logging
+import random
+import re
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List
+
+import httpx
+import numpy as np
+from sqlalchemy import func
+from sqlmodel import select
+
+from .barstore import COLUMNS, BarColumns, bar_store, to_datetime64
+from .config import settings
+from .db import get_session, insert_ignore
+from .ingest import IngestStats, ingest_bars
+from .models import BarFetchCheckpoint, MarketBar
+
+log = logging.getLogger(__name__)
+
+try:  # alpaca-py は requests 経由で通信する
+    from requests.exceptions import ConnectionError as _RequestsConnectionError, Timeout as _RequestsTimeout
+except ImportError:  # pragma: no cover - requests 未インストール
+    _RequestsConnectionError = _RequestsTimeout = ConnectionError
+
+# ステータスを持たない例外のうち、再試行してよい通信系のエラー
+_TRANSPORT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    httpx.TransportError,
+    _RequestsConnectionError,
+    _RequestsTimeout,
+)
+
+
+class BarSource(ABC):
+    @abstractmethod
+    def fetch(self, symbol: str, timeframe: str, start: datetime, end: datetime) -> BarColumns:
+        """[start, end) のバーを返す。"""
+        raise NotImplementedError
+
+
+class AlpacaBarSource(BarSource):
+    def __init__(self, api_key: str, secret_key: str):
+        # import をここに置くと、alpaca-py 未インストールでも他の実装で進められる
+        from alpaca.data import StockHistoricalDataClient
+
+        self.client = StockHistoricalDataClient(api_key=api_key, secret_key=secret_key)
+
+    @staticmethod
+    def _parse_timeframe(tf: str):
+        from alpaca.data.timeframe import TimeFrame
+
+        tf = tf.lower()
+        if tf in {"1min", "1m"}:
+            return TimeFrame.Minute
+        if tf in {"5min", "5m"}:
+            return TimeFrame(5, "Min")
+        if tf in {"15min", "15m"}:
+            return TimeFrame(15, "Min")
+        if tf in {"1h", "1hour"}:
+            return TimeFrame.Hour
+        if tf in {"1d", "day", "1day"}:
+            return TimeFrame.Day
+        raise ValueError(f"Unsupported timeframe: {tf}")
+
+    def fetch(self, symbol: str, timeframe: str, start: datetime, end: datetime) -> BarColumns:
+        from alpaca.data.requests import StockBarsRequest
+
+        # Alpaca の end は「その時刻を含む」。[start, end) にするため 1µs 手前までを頼む
+        req = StockBarsRequest(
+            symbol_or_symbols=symbol,
+            timeframe=self._parse_timeframe(timeframe),
+            start=start,
+            end=end - timedelta(microseconds=1),
+        )
+        bars = self.client.get_stock_bars(req).data.get(symbol, [])
+        return BarColumns(
+            ts=np.array([to_datetime64(bar.timestamp) for bar in bars], dtype="datetime64[us]"),
+            open=np.array([bar.open for bar in bars], dtype=np.float64),
+            high=np.array([bar.high for bar in bars], dtype=np.float64),
+            low=np.array([bar.low for bar in bars], dtype=np.float64),
+            close=np.array([bar.close for bar in bars], dtype=np.float64),
+            volume=np.array([bar.volume for bar in bars], dtype=np.float64),
+        )
+
+
+@dataclass(frozen=True)
+class Chunk:
+    symbol: str
+    timeframe: str
+    start: datetime
+    end: datetime
+
+
+def default_window(timeframe: str) -> timedelta:
+    """1リクエストで取得する期間（分足は短く、日足は長く）。"""
+    if settings.bar_download_window_days > 0:
+        return timedelta(days=settings.bar_download_window_days)
+    tf = timeframe.lower()
+    if tf.endswith("min") or tf.endswith("m"):
+        return timedelta(days=7)
+    if tf.endswith("hour") or tf.endswith("h"):
+        return timedelta(days=90)
+    return timedelta(days=365)
+
+
+_TF_PATTERN = re.compile(r"^(?P<n>\d*)\s*(?P<unit>min|m|hour|h|day|d)$")
+_TF_UNITS = {"min": timedelta(minutes=1), "m": timedelta(minutes=1), "hour": timedelta(hours=1),
+             "h": timedelta(hours=1), "day": timedelta(days=1), "d": timedelta(days=1)}
+
+
+def timeframe_delta(timeframe: str) -> timedelta:
+    """"5Min" -> 5分、"1Day" -> 1日"""
+    m = _TF_PATTERN.match(timeframe.strip().lower())
+    if not m:
+        raise ValueError(f"Unsupported timeframe: {timeframe}")
+    return int(m.group("n") or 1) * _TF_UNITS[m.group("unit")]
+
+
+def completed_until(timeframe: str, now: datetime) -> datetime:
+    """now 時点で確定しているバーの終わり（これより前に始まるバーだけが完成している）"""
+    step = timeframe_delta(timeframe)
+    epoch = datetime(1970, 1, 1)
+    return epoch + ((now - epoch) // step) * step
+
+
+def plan_chunks(
+    symbols: Iterable[str],
+    timeframe: str,
+    start: datetime,
+    end: datetime,
+    window: timedelta,
+) -> List[Chunk]:
+    """
+    エポックから window 刻みの固定境界で区切る（start/end が変わっても内側のチャンクは同じ境界になる）。
+    両端のチャンクだけは [start, end) に切り詰める。
+    """
+    epoch = datetime(1970, 1, 1)
+    chunks: List[Chunk] = []
+    for symbol in dict.fromkeys(symbols):
+        lo = start
+        while lo < end:
+            boundary = epoch + ((lo - epoch) // window + 1) * window
+            hi = min(boundary, end)
+            chunks.append(Chunk(symbol, timeframe, lo, hi))
+            lo = hi
+    return chunks
+
+
+def _completed(chunks: List[Chunk]) -> set[Chunk]:
+    """チェックポイント済みの範囲に収まるチャンク（前回と start/end が違っても内側の窓は一致する）"""
+    if not chunks:
+        return set()
+    with get_session() as s:
+        rows = s.exec(
+            select(
+                BarFetchCheckpoint.symbol,
+                BarFetchCheckpoint.window_start,
+                BarFetchCheckpoint.window_end,
+            ).where(
+                BarFetchCheckpoint.timeframe == chunks[0].timeframe,
+                BarFetchCheckpoint.symbol.in_({c.symbol for c in chunks}),
+                BarFetchCheckpoint.window_end > min(c.start for c in chunks),
+                BarFetchCheckpoint.window_start < max(c.end for c in chunks),
+            )
+        ).all()
+    covered: dict[str, List[tuple[datetime, datetime]]] = {}
+    for symbol, lo, hi in rows:
+        covered.setdefault(symbol, []).append((lo, hi))
+    return {
+        c
+        for c in chunks
+        if any(lo <= c.start and c.end <= hi for lo, hi in covered.get(c.symbol, ()))
+    }
+
+
+def _mark_completed(chunk: Chunk, rows: int) -> None:
+    with get_session() as s:
+        s.execute(
+            insert_ignore(BarFetchCheckpoint).values(
+                symbol=chunk.symbol,
+                timeframe=chunk.timeframe,
+                window_start=chunk.start,
+                window_end=chunk.end,
+                rows=rows,
+                completed_at=datetime.utcnow(),
+            )
+        )
+        s.commit()
+
+
+def _is_retryable(exc: Exception) -> bool:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    if status is None:
+        # ステータスが無いものは接続・タイムアウト系だけ再試行する（引数ミスなどは即失敗）
+        return isinstance(exc, _TRANSPORT_ERRORS)
+    return status == 429 or status >= 500
+
+
+def _fetch_with_backoff(source: BarSource, chunk: Chunk, max_retries: int) -> BarColumns:
+    attempt = 0
+    while True:
+        try:
+            return source.fetch(chunk.symbol, chunk.timeframe, chunk.start, chunk.end)
+        except Exception as e:
+            attempt += 1
+            if attempt > max_retries or not _is_retryable(e):
+                raise
+            delay = min(60.0, 2 ** attempt) * random.uniform(0.5, 1.0)
+            log.warning(
+                "bar fetch failed %s %s %s-%s (attempt %d): %s; retry in %.1fs",
+                chunk.symbol,
+                chunk.timeframe,
+                chunk.start,
+                chunk.end,
+                attempt,
+                e,
+                delay,
+            )
+            time.sleep(delay)
+
+
+def _clip(bars: BarColumns, end: datetime) -> BarColumns:
+    """end 以降のバーを落とす（ソースが end を含めて返しても形成中のバーを保存しない）"""
+    keep = bars.ts < np.datetime64(end, "us")
+    if keep.all():
+        return bars
+    return BarColumns(**{name: getattr(bars, name)[keep] for name in COLUMNS})
+
+
+def _ingest_chunk(chunk: Chunk, bars: BarColumns, checkpoint: bool) -> IngestStats:
+    bars = _clip(bars, chunk.end)
+    stats = ingest_bars(chunk.symbol, chunk.timeframe, bars)
+    if checkpoint:
+        _mark_completed(chunk, stats.rows)
+    return stats
+
+
+def download_bars(
+    source: BarSource,
+    symbols: Iterable[str],
+    timeframe: str,
+    start: datetime,
+    end: datetime | None = None,
+    window: timedelta | None = None,
+    max_workers: int | None = None,
+    max_retries: int | None = None,
+    checkpoint: bool = True,
+) -> List[IngestStats]:
+    """
+    チャンクに分けて並列取得し、チャンクごとにストアへ書き込む。
+    チェックポイント済みのチャンクはスキップする。失敗したチャンクがあれば最後に例外を送出する
+    （完了したチャンクはチェックポイントに残るので、再実行で続きから再開できる）。
+    checkpoint=False ではチェックポイントを読み書きしない（差分同期など、最終バーが再開位置になる場合）。
+    """
+    end = end or datetime.now(timezone.utc).replace(tzinfo=None)
+    chunks = plan_chunks(symbols, timeframe, start, end, window or default_window(timeframe))
+    done = _completed(chunks) if checkpoint else set()
+    pending = [c for c in chunks if c not in done]
+    log.info(
+        "bar download %s %s..%s: %d chunks (%d already completed)",
+        timeframe,
+        start,
+        end,
+        len(chunks),
+        len(chunks) - len(pending),
+    )
+    if not pending:
+        return []
+
+    workers = max_workers or settings.bar_download_workers
+    retries = settings.bar_download_max_retries if max_retries is None else max_retries
+    results: List[IngestStats] = []
+    failures: List[tuple[Chunk, Exception]] = []
+    started = time.perf_counter()
+    # 取得は並列、書き込みは銘柄ごとに時刻順で行う。後ろのチャンクが先に届いて
+    # 前のチャンクが既存の末尾より前に入ると、バーストアが列全体をマージし直すため。
+    queues: dict[str, List[Chunk]] = {}
+    for c in pending:
+        queues.setdefault(c.symbol, []).append(c)
+    fetched: dict[Chunk, BarColumns | Exception] = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_fetch_with_backoff, source, c, retries): c for c in pending}
+        for fut in as_completed(futures):
+            chunk = futures[fut]
+            try:
+                fetched[chunk] = fut.result()
+            except Exception as e:
+                fetched[chunk] = e
+            waiting = queues[chunk.symbol]
+            while waiting and waiting[0] in fetched:
+                head = waiting.pop(0)
+                bars = fetched.pop(head)
+                try:
+                    if isinstance(bars, Exception):
+                        raise bars
+                    results.append(_ingest_chunk(head, bars, checkpoint))
+                except Exception as e:
+                    log.error("bar chunk failed %s %s-%s: %s", head.symbol, head.start, head.end, e)
+                    failures.append((head, e))
+
+    elapsed = time.perf_counter() - started
+    total = sum(r.rows for r in results)
+    log.info(
+        "bar download finished: %d chunks, %d rows in %.1fs (%.0f rows/s)",
+        len(results),
+        total,
+        elapsed,
+        total / elapsed if elapsed > 0 else 0.0,
+    )
+    if failures:
+        raise RuntimeError(f"{len(failures)} bar chunks failed; rerun to resume")
+    return results
+
+
+def latest_bar_ts(symbol: str, timeframe: str) -> datetime | None:
+    """保存済みの最終バー時刻。バーストアの末尾、無ければ (symbol, timeframe, ts) インデックスで MAX を引く。"""
+    ts = bar_store.last_ts(symbol, timeframe)
+    if ts is not None:
+        return ts
+    with get_session() as s:
+        return s.exec(
+            select(func.max(MarketBar.ts)).where(
+                MarketBar.symbol == symbol,
+                MarketBar.timeframe == timeframe,
+            )
+        ).one()
+
+
+def sync_missing_bars(
+    source: BarSource,
+    symbols: Iterable[str],
+    timeframes: Iterable[str],
+    lookback: timedelta,
+) -> List[IngestStats]:
+    """
+    各 (銘柄, 時間足) について最終バーの直後から現在までだけを取得する。
+    まだ1本も無いものは lookback 分さかのぼって取得する。
+    形成中のバーを保存すると次回以降は「最終バーの直後」から取るので確定値で上書きされない。
+    そのため取得範囲の終わりは確定済みのバーの境界までにする。
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    results: List[IngestStats] = []
+    for timeframe in timeframes:
+        end = completed_until(timeframe, now)
+        for symbol in symbols:
+            latest = latest_bar_ts(symbol, timeframe)
+            start = latest + timedelta(microseconds=1) if latest else end - lookback
+            if start >= end:
+                continue
+            try:
+                results.extend(
+                    download_bars(source, [symbol], timeframe, start=start, end=end, checkpoint=False)
+                )
+            except Exception as e:
+                log.warning("bar sync failed %s %s: %s", symbol, timeframe, e)
+    return results
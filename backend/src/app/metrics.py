@@ -0,0 +1,51 @@
+"""処理ステージごとの件数・レイテンシ計測"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict
+
+
+class StageMetrics:
+    """件数・エラー数・レイテンシ（直近 N 件からパーセンタイル）"""
+
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._recent: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, ms: float, error: bool = False) -> None:
+        with self._lock:
+            self.count += 1
+            if error:
+                self.errors += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+            self._recent.append(ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            recent = sorted(self._recent)
+            count, errors, total_ms, max_ms = self.count, self.errors, self.total_ms, self.max_ms
+
+        def pct(p: float) -> float | None:
+            if not recent:
+                return None
+            return recent[min(len(recent) - 1, int(p * len(recent)))]
+
+        return {
+            "count": count,
+            "errors": errors,
+            "avg_ms": total_ms / count if count else None,
+            "p50_ms": pct(0.5),
+            "p95_ms": pct(0.95),
+            "max_ms": max_ms,
+        }
+
+
+def elapsed_ms(started: float) -> float:
+    """time.perf_counter() の開始値からの経過ミリ秒"""
+    return (time.perf_counter() - started) * 1000.0
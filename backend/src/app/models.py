@@ -1,11 +1,12 @@
 from typing import Optional
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 from datetime import datetime
 
 
 class Signal(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    message_id: str
+    message_id: str = Field(index=True)
     author: str
     channel_id: int
     content: str
@@ -18,6 +19,31 @@ class Signal(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 
+class SignalKey(SQLModel, table=True):
+    """シグナル重複検知用のキー（message_id / URL / 本文ハッシュ）。key はユニーク。"""
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    key: str = Field(unique=True, index=True)
+    signal_id: int | None = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class SignalJob(SQLModel, table=True):
+    """POST /signals で受け付けた生メッセージと、抽出→リスク→発注の処理状況。"""
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    source: str
+    message_id: str
+    text: str
+    meta: str = "{}"  # JSON
+    # RECEIVED → EXTRACTED → STORED / ORDERED / RISK_REJECTED / FAILED、抽出失敗は REJECTED
+    status: str = Field(default="RECEIVED", index=True)
+    error: str | None = None
+    signal_id: int | None = None
+    received_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: datetime | None = None
+
+
 class Order(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     broker: str
@@ -28,12 +54,16 @@ class Order(SQLModel, table=True):
     status: str = "NEW" # NEW/FILLED/CANCELED/REJECTED
     reason: str | None = None
     signal_id: int | None = None
+    # ブローカー側の注文 ID（trade_updates の約定イベントとの突き合わせ用）
+    broker_order_id: str | None = Field(default=None, index=True)
+    # 発注側で付けた冪等キー（再送・再起動後の再投入で同じ注文を二重に出さないため）
+    client_order_id: str | None = Field(default=None, index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 
 class Position(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    ticker: str
+    ticker: str = Field(index=True)
     qty: float # + long / - short（紙取引用の簡易モデル）
     avg_price: float
 
@@ -58,6 +88,10 @@ class PnL(SQLModel, table=True):
 class MarketBar(SQLModel, table=True):
     """シンプルなOHLCVバー（銘柄×時間足×時刻）。"""
 
+    __table_args__ = (
+        Index("ix_marketbar_symbol_timeframe_ts", "symbol", "timeframe", "ts", unique=True),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     symbol: str
     timeframe: str  # e.g. 1Min, 5Min, 1Hour, 1Day
@@ -66,4 +100,28 @@ class MarketBar(SQLModel, table=True):
     high: float
     low: float
     close: float
-    volume: float
\ No newline at end of file
+    volume: float
+
+
+class BarFetchCheckpoint(SQLModel, table=True):
+    """ヒストリカルバー取得の完了済みチャンク（銘柄×時間足×期間）。中断後の再開に使う。"""
+
+    __table_args__ = (
+        Index(
+            "ix_barfetchcheckpoint_chunk",
+            "symbol",
+            "timeframe",
+            "window_start",
+            "window_end",
+            unique=True,
+        ),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    symbol: str
+    timeframe: str
+    window_start: datetime
+    window_end: datetime
+    rows: int = 0
+    completed_at: datetime = Field(default_factory=datetime.utcnow)
+
@@ -0,0 +1,422 @@
+"""
+シグナル処理パイプライン
+
+POST /signals は生メッセージを SignalJob として保存して job id を返すだけにし、
+抽出（LLM）→ リスクチェック → 発注はバックグラウンドのワーカースレッドで行う。
+ステージごとに内部キューとワーカーを持つので、遅い LLM がリクエスト処理や
+発注ステージを詰まらせない。ステージ別のレイテンシは StageMetrics に記録する。
+
+ブローカーへの送信は専用のイベントループ上の AsyncBroker で行い、発注ワーカーは
+応答を待たずに次の注文へ進む。複数レッグの注文（POST /orders/bulk）も同じループから
+まとめて送る。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from concurrent.futures import Future, wait as wait_futures
+from typing import Any, Callable, Dict, List
+
+from sqlmodel import select
+
+from broker import get_async_broker
+
+from .broker_state import broker_state
+from .config import settings
+from .db import get_session
+from .dedup import dedup_index, message_keys
+from .metrics import StageMetrics, elapsed_ms
+from .models import Order, Signal, SignalJob
+from .prices import price_cache
+from .risk import order_throttle, risk_guard
+from .schemas import ExtractedSignal
+from .universe import symbol_universe
+from .utils import ensure_int
+
+log = logging.getLogger(__name__)
+
+
+def build_signal(job: SignalJob, parsed: ExtractedSignal) -> Signal:
+    """SignalJob の meta から author / channel_id / content を組み立てて Signal にする"""
+    meta = json.loads(job.meta or "{}")
+    url = meta.get("url")
+    author = meta.get("username") or meta.get("author") or meta.get("user") or job.source
+    channel_id = ensure_int(meta.get("channel_id") or meta.get("chat_id") or meta.get("user_id"))
+    content = job.text
+    if url and url not in content:
+        content = f"{content}\n\nSource: {url}"
+    return Signal(
+        message_id=job.message_id,
+        author=str(author),
+        channel_id=channel_id,
+        content=content,
+        ticker=parsed.ticker,
+        side=parsed.side,
+        confidence=parsed.confidence,
+        timeframe=parsed.timeframe,
+        stop=parsed.stop,
+        take=parsed.take,
+    )
+
+
+def save_order(broker_name: str, order: Dict[str, Any], result: Dict[str, Any], signal_id: int | None = None) -> int:
+    """
+    発注結果を Order に保存して id を返す。
+    ブローカーが保存済みの行（paper の local_order_id）や、保存より先に trade_updates ワーカーが
+    外部注文として作った行（同じ broker_order_id）があればシグナルを紐付けるだけにする。
+    """
+    with get_session() as s:
+        local_id = result.get("local_order_id")
+        broker_order_id = result.get("order_id")
+        row = s.get(Order, local_id) if local_id else None
+        if row is None and broker_order_id:
+            row = s.exec(select(Order).where(Order.broker_order_id == str(broker_order_id))).first()
+        if row is None:
+            row = Order(
+                broker=broker_name,
+                ticker=order["ticker"],
+                side=order["side"],
+                qty=order["qty"],
+                price=result.get("price"),
+                status=result.get("status", "NEW"),
+                reason=result.get("reason"),
+                broker_order_id=broker_order_id,
+                client_order_id=result.get("client_order_id"),
+            )
+        if signal_id is not None:
+            row.signal_id = signal_id
+        s.add(row)
+        s.commit()
+        return row.id
+
+
+# 約定せずに終わった注文の状態（リスクの予約を解放する）
+DEAD_STATUSES = {"ERROR", "REJECTED", "CANCELED", "EXPIRED"}
+
+
+def release_if_dead(order: Dict[str, Any], result: Dict[str, Any]) -> None:
+    if order.get("client_order_id") and result.get("status") in DEAD_STATUSES:
+        risk_guard.release(order["client_order_id"])
+
+
+class SignalPipeline:
+    def __init__(
+        self,
+        extract: Callable[[str], ExtractedSignal | None],
+        extract_workers: int | None = None,
+        order_workers: int | None = None,
+    ):
+        self._extract = extract
+        self._extract_workers = extract_workers or settings.pipeline_extract_workers
+        self._order_workers = order_workers or settings.pipeline_order_workers
+        self._extract_queue: "queue.Queue[int | None]" = queue.Queue()
+        self._order_queue: "queue.Queue[tuple | None]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        # ブローカー送信用のイベントループ（start で専用スレッドに載せる）
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._inflight: set[Future] = set()
+        self.metrics: Dict[str, StageMetrics] = {
+            name: StageMetrics() for name in ("queue", "extract", "risk", "order", "total")
+        }
+
+    # ------------------------------------------------------------------ #
+    # lifecycle
+    # ------------------------------------------------------------------ #
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._loop = asyncio.new_event_loop()
+        t = threading.Thread(target=self._loop.run_forever, name="pipeline-broker", daemon=True)
+        t.start()
+        self._threads.append(t)
+        for i in range(self._extract_workers):
+            self._spawn(f"pipeline-extract-{i}", self._extract_queue, self._run_extract)
+        for i in range(self._order_workers):
+            self._spawn(f"pipeline-order-{i}", self._order_queue, self._run_order)
+        self._recover()
+
+    def stop(self) -> None:
+        for _ in range(self._extract_workers):
+            self._extract_queue.put(None)
+        for _ in range(self._order_workers):
+            self._order_queue.put(None)
+        # 送信中の注文を待ってからループを止める
+        if self._inflight:
+            wait_futures(list(self._inflight), timeout=10)
+        if self._loop is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(get_async_broker().aclose(), self._loop).result(timeout=5)
+            except Exception as e:  # pragma: no cover - defensive logging
+                log.warning("async broker close failed: %s", e)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        for t in self._threads:
+            t.join(timeout=5)
+        self._threads = []
+        self._loop = None
+
+    def _spawn(self, name: str, q: queue.Queue, handler: Callable) -> None:
+        def loop():
+            while True:
+                item = q.get()
+                if item is None:
+                    return
+                try:
+                    handler(item)
+                except Exception as e:  # pragma: no cover - defensive logging
+                    log.exception("pipeline worker %s failed: %s", name, e)
+
+        t = threading.Thread(target=loop, name=name, daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def _recover(self) -> None:
+        """前回プロセスで止まったジョブを再投入する（抽出前は抽出から、抽出済みは発注から）"""
+        with get_session() as s:
+            ids = s.exec(select(SignalJob.id).where(SignalJob.status == "RECEIVED")).all()
+            extracted = s.exec(
+                select(SignalJob, Signal).join(Signal, Signal.id == SignalJob.signal_id).where(
+                    SignalJob.status == "EXTRACTED"
+                )
+            ).all()
+            ordered = set(
+                s.exec(select(Order.signal_id).where(Order.signal_id.in_([sig.id for _, sig in extracted]))).all()
+            ) if extracted else set()
+            extracted = [(job.id, sig.id, self._signal_to_parsed(sig), sig.author) for job, sig in extracted]
+        for job_id in ids:
+            self._extract_queue.put(job_id)
+        for job_id, signal_id, parsed, author in extracted:
+            if signal_id in ordered:
+                # 発注済みで終了処理だけ落ちていた
+                self._finish(job_id, "ORDERED")
+            elif self._should_order(parsed):
+                self._order_queue.put((job_id, signal_id, parsed, author, time.monotonic()))
+            else:
+                self._finish(job_id, "STORED")
+        if ids or extracted:
+            log.info("pipeline recovered %d pending jobs, %d extracted jobs", len(ids), len(extracted))
+
+    @staticmethod
+    def _signal_to_parsed(signal: Signal) -> ExtractedSignal:
+        return ExtractedSignal(
+            ticker=signal.ticker,
+            side=signal.side,
+            confidence=signal.confidence,
+            timeframe=signal.timeframe,
+            stop=signal.stop,
+            take=signal.take,
+        )
+
+    @staticmethod
+    def _should_order(parsed: ExtractedSignal) -> bool:
+        return (
+            settings.auto_trade_enabled
+            and parsed.confidence is not None
+            and parsed.confidence >= settings.min_confidence
+        )
+
+    # ------------------------------------------------------------------ #
+    # public
+    # ------------------------------------------------------------------ #
+    def submit(self, job_id: int) -> None:
+        self._extract_queue.put(job_id)
+
+    def place_orders(self, orders: List[Dict[str, Any]]) -> Future:
+        """複数レッグの注文をブローカーループから同時に送る（結果は入力と同じ順）"""
+        return self._dispatch(self._place_many(orders))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "queues": {
+                "extract": self._extract_queue.qsize(),
+                "order": self._order_queue.qsize(),
+                "inflight_orders": len(self._inflight),
+            },
+            "stages": {name: m.snapshot() for name, m in self.metrics.items()},
+        }
+
+    # ------------------------------------------------------------------ #
+    # stages
+    # ------------------------------------------------------------------ #
+    def _finish(self, job_id: int, status: str, error: str | None = None, **fields: Any) -> None:
+        with get_session() as s:
+            job = s.get(SignalJob, job_id)
+            if job is None:
+                return
+            job.status = status
+            job.error = error
+            job.finished_at = datetime.utcnow()
+            for k, v in fields.items():
+                setattr(job, k, v)
+            s.add(job)
+            s.commit()
+            received_at = job.received_at
+        self.metrics["total"].observe((datetime.utcnow() - received_at).total_seconds() * 1000.0)
+
+    def _run_extract(self, job_id: int) -> None:
+        with get_session() as s:
+            job = s.get(SignalJob, job_id)
+            if job is None or job.status != "RECEIVED":
+                return
+            s.expunge(job)
+        self.metrics["queue"].observe((datetime.utcnow() - job.received_at).total_seconds() * 1000.0)
+
+        started = time.perf_counter()
+        try:
+            parsed = self._extract(job.text)
+        except Exception as e:  # pragma: no cover - defensive logging
+            log.warning("extraction raised for job=%s: %s", job_id, e)
+            parsed = None
+        self.metrics["extract"].observe(elapsed_ms(started), error=parsed is None)
+
+        _, keys = message_keys(job.source, job.text, json.loads(job.meta or "{}"))
+        error = None
+        if not parsed:
+            error = "Failed to extract signal from text"
+        elif not symbol_universe.is_valid(parsed.ticker):
+            # 取引できない銘柄は Signal を作らず、ブローカーにも送らない
+            error = f"Unknown ticker: {parsed.ticker}"
+        if error:
+            log.warning("signal rejected job=%s source=%s: %s", job_id, job.source, error)
+            with get_session() as s:
+                dedup_index.release(s, keys)
+                s.commit()
+            self._finish(job_id, "REJECTED", error)
+            return
+
+        with get_session() as s:
+            signal = build_signal(job, parsed)
+            s.add(signal)
+            s.flush()
+            dedup_index.attach(s, keys, signal.id)
+            stored = s.get(SignalJob, job_id)
+            stored.status = "EXTRACTED"
+            stored.signal_id = signal.id
+            s.add(stored)
+            s.commit()
+            s.refresh(signal)
+
+        log.info(
+            "signal stored id=%s job=%s source=%s ticker=%s side=%s parsed=%s",
+            signal.id,
+            job_id,
+            job.source,
+            parsed.ticker,
+            parsed.side,
+            parsed.model_dump(),
+        )
+
+        if self._should_order(parsed):
+            self._order_queue.put((job_id, signal.id, parsed, signal.author, time.monotonic()))
+        else:
+            self._finish(job_id, "STORED")
+
+    def _run_order(self, item: tuple) -> None:
+        job_id, signal_id, parsed, source, queued_at = item
+        # 注文数量を計算（default_order_usd / price、価格がなければ1株）
+        qty, price = price_cache.order_qty(parsed.ticker)
+        if qty <= 0:
+            reason = f"one share of {parsed.ticker} ({price:.2f} USD) exceeds MAX_ORDER_USD ({settings.max_order_usd:.2f})"
+            log.warning("order skipped: %s", reason)
+            self._finish(job_id, "SKIPPED", reason)
+            return
+
+        # 発注スロットル: 枠がなければ待ち時間後に積み直し、待ちきれない分は棄却する
+        notional = qty * price if price else None
+        reason = order_throttle.reject_reason(notional)
+        if reason:
+            log.warning("order rejected by throttle for %s: %s", parsed.ticker, reason)
+            self._finish(job_id, "THROTTLED", reason)
+            return
+        wait = order_throttle.acquire(parsed.ticker, source, notional)
+        if wait > 0:
+            waited = time.monotonic() - queued_at
+            if waited + wait > settings.throttle_max_delay_sec:
+                log.warning("order throttled for %s (source=%s), dropping", parsed.ticker, source)
+                self._finish(job_id, "THROTTLED", f"order rate limit exceeded (wait {wait:.1f}s)")
+                return
+            timer = threading.Timer(wait, self._order_queue.put, args=(item,))
+            timer.daemon = True
+            timer.start()
+            return
+
+        started = time.perf_counter()
+        # ジョブごとに固定なので、再試行や再起動後の再送でも二重発注にならない
+        client_order_id = f"job-{job_id}"
+        reason = risk_guard.check(
+            parsed.ticker, qty if parsed.side == "BUY" else -qty, price, reserve=client_order_id
+        )
+        self.metrics["risk"].observe(elapsed_ms(started))
+        if reason:
+            # 発注しない注文の分のスロットル枠は返す
+            order_throttle.refund(parsed.ticker, source, notional)
+            log.warning("risk check failed for %s, skipping order: %s", parsed.ticker, reason)
+            self._finish(job_id, "RISK_REJECTED", reason)
+            return
+
+        # 送信はブローカーループに任せ、このワーカーは次の注文へ進む
+        order = {
+            "ticker": parsed.ticker,
+            "side": parsed.side,
+            "qty": qty,
+            "price": None,  # 成行注文
+            "order_type": "MARKET",
+            "tif": "DAY",
+            "client_order_id": client_order_id,
+        }
+        self._dispatch(self._place_one(job_id, signal_id, order))
+
+    def _dispatch(self, coro) -> Future:
+        if self._loop is None:
+            coro.close()
+            raise RuntimeError("pipeline is not running")
+        fut = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        self._inflight.add(fut)
+        fut.add_done_callback(self._inflight.discard)
+        return fut
+
+    async def _place_one(self, job_id: int, signal_id: int, order: Dict[str, Any]) -> None:
+        started = time.perf_counter()
+        broker = get_async_broker()
+        try:
+            order_result = await broker.place_order(**order)
+            release_if_dead(order, order_result)
+            await asyncio.to_thread(save_order, broker.name, order, order_result, signal_id)
+        except Exception as e:
+            risk_guard.release(order["client_order_id"])
+            self.metrics["order"].observe(elapsed_ms(started), error=True)
+            log.error("auto order failed for signal_id=%s: %s", signal_id, e)
+            await asyncio.to_thread(self._finish, job_id, "FAILED", str(e))
+            return
+        self.metrics["order"].observe(elapsed_ms(started))
+        # 発注で買付余力が変わるので口座キャッシュを無効化する
+        broker_state.invalidate("account")
+
+        log.info(
+            "auto order placed signal_id=%s ticker=%s side=%s status=%s",
+            signal_id,
+            order["ticker"],
+            order["side"],
+            order_result.get("status"),
+        )
+        await asyncio.to_thread(self._finish, job_id, "ORDERED")
+
+    async def _place_many(self, orders: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        started = time.perf_counter()
+        broker = get_async_broker()
+        results = [
+            {"ticker": order["ticker"], "side": order["side"], **result}
+            for order, result in zip(orders, await broker.place_orders(orders))
+        ]
+        for order, result in zip(orders, results):
+            release_if_dead(order, result)
+            if result.get("status") != "ERROR":
+                result["local_order_id"] = await asyncio.to_thread(save_order, broker.name, order, result)
+        self.metrics["order"].observe(elapsed_ms(started), error=any(r.get("status") == "ERROR" for r in results))
+        broker_state.invalidate("account")
+        return results
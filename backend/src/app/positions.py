@@ -0,0 +1,31 @@
+"""
+Position テーブルへの約定反映
+
+紙取引の約定と、Alpaca の trade_updates ストリームから受け取った約定の両方で使う。
+同じ銘柄を同時に更新しないよう、排他は呼び出し側で行う。
+"""
+
+from sqlmodel import Session, select
+
+from .models import Position
+
+
+def apply_fill(s: Session, ticker: str, side: str, qty: float, px: float) -> None:
+    """約定1件を建玉に反映する（commit は呼び出し側）"""
+    pos = s.exec(select(Position).where(Position.ticker == ticker)).first()
+    signed_qty = qty if side == "BUY" else -qty
+    if pos is None:
+        s.add(Position(ticker=ticker, qty=signed_qty, avg_price=px))
+        return
+    new_qty = pos.qty + signed_qty
+    if abs(new_qty) < 1e-9:
+        s.delete(pos)
+        return
+    if (pos.qty > 0) == (signed_qty > 0):
+        # 買い増し / 売り増しは加重平均
+        pos.avg_price = (abs(pos.qty) * pos.avg_price + qty * px) / abs(new_qty)
+    elif (pos.qty > 0) != (new_qty > 0):
+        # ドテンした分は約定価格で建て直す（一部返済なら平均単価はそのまま）
+        pos.avg_price = px
+    pos.qty = new_qty
+    s.add(pos)
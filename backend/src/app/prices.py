@@ -0,0 +1,193 @@
+"""
+直近価格のキャッシュ
+
+発注数量（default_order_usd / price）と紙取引の約定価格に使う。
+バーストア（無い銘柄は MarketBar テーブル）の最終バー終値をバックグラウンドで
+定期的に読み込み、発注経路では dict を引くだけにする（DB アクセスなし）。
+ストリーミングの気配値フィードがあれば update() で同じキャッシュに流し込める。
+新しいバー / 気配が入るたびに subscribe() した関数（紙取引のマッチングエンジン）を呼ぶ。
+
+価格には元データの時刻を持たせ、PRICE_MAX_AGE_SEC より古いものは
+発注数量の計算に使わない（紙取引の約定には古くても使う）。
+"""
+
+import logging
+import math
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List
+
+from sqlalchemy import func
+from sqlmodel import select
+
+from .barstore import bar_store
+from .config import settings
+from .db import get_session
+from .models import MarketBar
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Quote:
+    price: float
+    ts: datetime  # 価格の元になったバー / 気配の時刻（UTC, naive）
+    source: str
+
+    def age_sec(self, now: datetime | None = None) -> float:
+        return ((now or datetime.utcnow()) - self.ts).total_seconds()
+
+
+@dataclass(frozen=True)
+class Bar:
+    ts: datetime
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float | None = None  # 不明（気配値）なら None
+
+
+class PriceCache:
+    def __init__(self, max_age_sec: float | None = None):
+        self.max_age_sec = settings.price_max_age_sec if max_age_sec is None else max_age_sec
+        self._quotes: Dict[str, Quote] = {}
+        self._listeners: List[Callable[[str, Bar], None]] = []
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    # ------------------------------------------------------------------ #
+    # 参照（O(1)）
+    # ------------------------------------------------------------------ #
+    def get(self, ticker: str) -> Quote | None:
+        return self._quotes.get(ticker.upper())
+
+    def last_price(self, ticker: str, allow_stale: bool = False) -> float | None:
+        quote = self._quotes.get(ticker.upper())
+        if quote is None:
+            return None
+        if not allow_stale and self.max_age_sec > 0 and quote.age_sec() > self.max_age_sec:
+            return None
+        return quote.price
+
+    def order_qty(self, ticker: str, notional: float | None = None) -> tuple[float, float | None]:
+        """
+        (数量, 使った価格)。notional / price を整数株に切り捨てる（最低1株）。
+        新しい価格がなければ 1 株。1株の価格が MAX_ORDER_USD を超えるときは 0 株。
+        """
+        notional = settings.default_order_usd if notional is None else notional
+        price = self.last_price(ticker)
+        if not price or price <= 0:
+            return 1.0, None
+        if settings.max_order_usd > 0 and price > settings.max_order_usd:
+            return 0.0, price
+        return float(max(1, math.floor(notional / price))), price
+
+    # ------------------------------------------------------------------ #
+    # 更新
+    # ------------------------------------------------------------------ #
+    def subscribe(self, listener: Callable[[str, Bar], None]) -> None:
+        """新しいバー / 気配が入ったときに listener(ticker, bar) を呼ぶ"""
+        self._listeners.append(listener)
+
+    def update(self, ticker: str, price: float, ts: datetime, source: str = "quote", bar: Bar | None = None) -> None:
+        ticker = ticker.upper()
+        current = self._quotes.get(ticker)
+        if current is not None and current.ts >= ts:
+            return
+        # dict への代入1回なので、参照側はロックなしで一貫した Quote を読める
+        self._quotes[ticker] = Quote(price=price, ts=ts, source=source)
+        bar = bar or Bar(ts=ts, open=price, high=price, low=price, close=price)
+        for listener in self._listeners:
+            try:
+                listener(ticker, bar)
+            except Exception as e:  # pragma: no cover - defensive logging
+                log.warning("price listener failed for %s: %s", ticker, e)
+
+    def refresh(self, timeframes: Iterable[str] | None = None) -> int:
+        """バーストアと MarketBar から各銘柄の最新バーを読み込み、読んだ件数を返す"""
+        timeframes = list(timeframes or settings.price_timeframes)
+        updated = 0
+        seen = set()
+        for tf in timeframes:
+            for symbol in bar_store.symbols(tf):
+                last = bar_store.last_bar(symbol, tf)
+                if last is not None:
+                    self.update(symbol, last["close"], last["ts"], source=f"bars:{tf}", bar=Bar(**last))
+                    seen.add(symbol)
+                    updated += 1
+        updated += self._refresh_from_sql(timeframes, seen)
+        return updated
+
+    def _refresh_from_sql(self, timeframes: list[str], skip: set) -> int:
+        latest = (
+            select(MarketBar.symbol, MarketBar.timeframe, func.max(MarketBar.ts).label("ts"))
+            .where(MarketBar.timeframe.in_(timeframes))
+            .group_by(MarketBar.symbol, MarketBar.timeframe)
+            .subquery()
+        )
+        query = select(MarketBar).join(
+            latest,
+            (MarketBar.symbol == latest.c.symbol)
+            & (MarketBar.timeframe == latest.c.timeframe)
+            & (MarketBar.ts == latest.c.ts),
+        )
+        with get_session() as s:
+            rows = s.exec(query).all()
+        count = 0
+        for row in rows:
+            if row.symbol.upper() in skip or row.close is None:
+                continue
+            bar = Bar(ts=row.ts, open=row.open, high=row.high, low=row.low, close=row.close, volume=row.volume)
+            self.update(row.symbol, float(row.close), row.ts, source=f"sql:{row.timeframe}", bar=bar)
+            count += 1
+        return count
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        return {
+            "max_age_sec": self.max_age_sec,
+            "prices": {
+                t: {
+                    "price": q.price,
+                    "ts": q.ts.isoformat(),
+                    "source": q.source,
+                    "age_sec": round(q.age_sec(now), 1),
+                    "stale": self.max_age_sec > 0 and q.age_sec(now) > self.max_age_sec,
+                }
+                for t, q in sorted(self._quotes.items())
+            },
+        }
+
+    # ------------------------------------------------------------------ #
+    # バックグラウンド更新
+    # ------------------------------------------------------------------ #
+    def start(self, interval_sec: float | None = None) -> None:
+        interval = settings.price_refresh_sec if interval_sec is None else interval_sec
+        try:
+            log.info("price cache loaded %d prices", self.refresh())
+        except Exception as e:  # pragma: no cover - defensive logging
+            log.warning("price refresh failed: %s", e)
+        if interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.refresh()
+                except Exception as e:  # pragma: no cover - defensive logging
+                    log.warning("price refresh failed: %s", e)
+
+        self._thread = threading.Thread(target=loop, name="price-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+price_cache = PriceCache()
@@ -1,20 +1,490 @@
-from .config import settings
-from .models import Position
+"""
+リスク管理
+
+発注前チェックは DB を引かず、プロセス内のポジションブック（銘柄ごとの建玉・平均単価、
+グロスエクスポージャー、当日の実現損益）だけで判定する。ブックは起動時に
+ブローカーの建玉から作り、ブローカーの約定通知（Broker.notify_fill）で更新する。
+チェックを通ってまだ約定していない注文の数量は予約として持ち、次のチェックで建玉に足して
+判定する（同じ銘柄のシグナルが一度に来ても、合計で上限を超えない）。予約は約定で消化し、
+発注失敗・取消で解放する。取りこぼした約定は突き合わせで建玉に入るので、その時点より前の予約は捨てる。
+取りこぼしに備えて、一定間隔でブローカー（paper は Position テーブル）と突き合わせる
+（建玉は broker_state のキャッシュ経由で読む）。
+
+OrderThrottle は同じアイデアが複数ソースから一斉に届いたときの連続発注を、
+銘柄別・ソース別・全体のトークンバケツで均す。
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
 from sqlmodel import select
+
+from .broker_state import broker_state
+from .config import settings
 from .db import get_session
+from .models import PnL
+
+log = logging.getLogger(__name__)
+
+
+def _today() -> str:
+    return datetime.utcnow().date().isoformat()
+
+
+class PositionBook:
+    """銘柄 -> [qty, avg_price]。グロスエクスポージャーは差分で更新する"""
+
+    def __init__(self):
+        self._positions: Dict[str, list] = {}
+        self.gross_exposure = 0.0
+        self.day = _today()
+        self._day_number = int(time.time() // 86400)
+        self.realized_today = 0.0
+        # 日付が変わったときの前日分 (day, realized)。RiskGuard がロックの外で保存する
+        self.closed_day: Tuple[str, float] | None = None
+        # 約定の通し番号（突き合わせ中に約定が入ったかの判定用）
+        self.fill_seq = 0
+
+    def qty(self, ticker: str) -> float:
+        pos = self._positions.get(ticker)
+        return pos[0] if pos else 0.0
+
+    def avg_price(self, ticker: str) -> float | None:
+        pos = self._positions.get(ticker)
+        return pos[1] if pos else None
+
+    def roll_day(self) -> None:
+        # UTC の日付が変わったら当日の実現損益をリセットする（日付文字列は変わったときだけ作る）
+        day_number = int(time.time() // 86400)
+        if day_number != self._day_number:
+            self.closed_day = (self.day, self.realized_today)
+            self._day_number = day_number
+            self.day = _today()
+            self.realized_today = 0.0
+
+    def apply_fill(self, ticker: str, side: str, qty: float, price: float) -> float:
+        """約定を反映し、この約定で確定した実現損益を返す"""
+        self.roll_day()
+        self.fill_seq += 1
+        signed = qty if side.upper() == "BUY" else -qty
+        cur, avg = self._positions.get(ticker, (0.0, 0.0))
+        new = cur + signed
+        realized = 0.0
+        if cur and (cur > 0) != (signed > 0):
+            # 反対売買で減った分の損益を確定（ドテンした分は新しい建玉として約定価格で持つ）
+            closed = min(abs(signed), abs(cur))
+            realized = (price - avg) * closed * (1 if cur > 0 else -1)
+            new_avg = avg if abs(signed) <= abs(cur) else price
+        elif new:
+            new_avg = (abs(cur) * avg + abs(signed) * price) / abs(new)
+        else:
+            new_avg = 0.0
+        self._set(ticker, new, new_avg)
+        self.realized_today += realized
+        return realized
+
+    def replace(self, positions: Dict[str, Dict[str, Any]]) -> list[str]:
+        """外部の建玉で置き換え、数量が食い違っていた銘柄を返す"""
+        drift = [
+            t for t in set(self._positions) | set(positions)
+            if abs(self.qty(t) - float((positions.get(t) or {}).get("qty", 0.0))) > 1e-9
+        ]
+        self._positions = {}
+        self.gross_exposure = 0.0
+        for ticker, p in positions.items():
+            self._set(ticker, float(p.get("qty", 0.0)), float(p.get("avg_price") or 0.0))
+        return drift
+
+    def _set(self, ticker: str, qty: float, avg: float) -> None:
+        old = self._positions.get(ticker)
+        if old:
+            self.gross_exposure -= abs(old[0]) * old[1]
+        if qty:
+            self._positions[ticker] = [qty, avg]
+            self.gross_exposure += abs(qty) * avg
+        else:
+            self._positions.pop(ticker, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "positions": {t: {"qty": p[0], "avg_price": p[1]} for t, p in self._positions.items()},
+            "gross_exposure": self.gross_exposure,
+            "day": self.day,
+            "realized_today": self.realized_today,
+        }
 
 
 class RiskGuard:
     def __init__(self):
         self.max_daily_loss = settings.max_daily_loss
         self.max_pos_per_ticker = settings.max_position_per_ticker
+        self.max_gross_exposure = settings.max_gross_exposure
+        self.max_position_usd = settings.max_position_usd or self.max_pos_per_ticker * settings.default_order_usd
+        self.book = PositionBook()
+        self.reservation_ttl_sec = settings.risk_reservation_ttl_sec
+        # key（client_order_id）-> [ticker, 未約定の数量（符号付き）, 価格, 予約した時刻]
+        self._reserved: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    # ------------------------------------------------------------------ #
+    # チェック（DB アクセスなし）
+    # ------------------------------------------------------------------ #
+    def check(
+        self,
+        ticker: str,
+        qty_delta: float,
+        price: Optional[float] = None,
+        reserve: str | None = None,
+    ) -> str | None:
+        """
+        発注できなければ理由を返す。
+        reserve（client_order_id）を渡すと、通った数量を約定するまで予約として持つ。
+        """
+        try:
+            with self._lock:
+                reason = self._check(ticker, qty_delta, price)
+                if reason is None and reserve is not None:
+                    self._reserved[reserve] = [ticker, qty_delta, price, time.monotonic()]
+            return reason
+        finally:
+            self._save_closed_day()
+
+    def release(self, key: str) -> None:
+        """発注しなかった・取り消された注文の予約を外す"""
+        with self._lock:
+            self._reserved.pop(key, None)
+
+    def _expire_reservations(self) -> None:
+        cutoff = time.monotonic() - self.reservation_ttl_sec
+        while self._reserved:
+            key, r = next(iter(self._reserved.items()))
+            if r[3] >= cutoff:
+                break
+            log.info("risk reservation %s expired (%s %s)", key, r[0], r[1])
+            self._reserved.popitem(last=False)
+
+    def _pending(self, ticker: str) -> float:
+        return sum(r[1] for r in self._reserved.values() if r[0] == ticker)
+
+    def _pending_exposure(self) -> float:
+        return sum(abs(r[1]) * (r[2] or self.book.avg_price(r[0]) or 0.0) for r in self._reserved.values())
+
+    def _consume(self, ticker: str, signed: float) -> None:
+        """約定した数量を同じ銘柄・同じ方向の予約から古い順に消化する"""
+        for key in list(self._reserved):
+            if abs(signed) <= 1e-9:
+                return
+            r = self._reserved[key]
+            if r[0] != ticker or r[1] * signed <= 0:
+                continue
+            take = min(abs(r[1]), abs(signed))
+            r[1] -= math.copysign(take, r[1])
+            signed -= math.copysign(take, signed)
+            if abs(r[1]) <= 1e-9:
+                del self._reserved[key]
+
+    def _check(self, ticker: str, qty_delta: float, price: Optional[float] = None) -> str | None:
+        # 呼び出し側でロックを持つ
+        book = self.book
+        book.roll_day()
+        self._expire_reservations()
+        cur = book.qty(ticker) + self._pending(ticker)
+        new = cur + qty_delta
+        if price:
+            # 価格が分かるときは建玉金額で判定。1株だけの建玉は金額に関係なく許可する
+            limit = self.max_position_usd
+            if abs(new) > abs(cur) and abs(new) > 1 and abs(new) * price > limit:
+                return f"position limit: {ticker} {abs(new) * price:.2f} USD (max {limit:.2f})"
+        elif abs(new) > self.max_pos_per_ticker:
+            return f"position limit: {ticker} {cur} -> {new} (max {self.max_pos_per_ticker})"
+        if abs(new) <= abs(cur):
+            # 建玉を減らす注文は損失上限・エクスポージャー上限に関係なく通す
+            return None
+        if self.max_daily_loss > 0 and book.realized_today <= -self.max_daily_loss:
+            return f"daily loss limit reached: {book.realized_today:.2f} (max {self.max_daily_loss})"
+        if self.max_gross_exposure > 0:
+            px = price or book.avg_price(ticker)
+            if px:
+                gross = book.gross_exposure + self._pending_exposure() + (abs(new) - abs(cur)) * px
+                if gross > self.max_gross_exposure:
+                    return f"gross exposure limit: {gross:.2f} (max {self.max_gross_exposure})"
+        return None
+
+    def can_open(self, ticker: str, qty_delta: float, price: Optional[float] = None) -> bool:
+        return self.check(ticker, qty_delta, price) is None
+
+    def on_fill(self, ticker: str, side: str, qty: float, price: float) -> None:
+        with self._lock:
+            realized = self.book.apply_fill(ticker, side, qty, price)
+            self._consume(ticker, qty if side.upper() == "BUY" else -qty)
+        self._save_closed_day()
+        if realized:
+            log.info("realized pnl %s %.2f (today %.2f)", ticker, realized, self.book.realized_today)
 
-    def can_open(self, ticker: str, qty_delta: float) -> bool:
-        # 簡易: ティッカー別の建玉上限のみチェック
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.book.snapshot(),
+                "reserved": {k: {"ticker": r[0], "qty": r[1]} for k, r in self._reserved.items()},
+                "limits": {
+                    "max_position_per_ticker": self.max_pos_per_ticker,
+                    "max_position_usd": self.max_position_usd,
+                    "max_daily_loss": self.max_daily_loss,
+                    "max_gross_exposure": self.max_gross_exposure,
+                },
+            }
+
+    # ------------------------------------------------------------------ #
+    # 起動時の読み込みと定期突き合わせ
+    # ------------------------------------------------------------------ #
+    def load(self) -> None:
+        """当日の実現損益を PnL テーブルから読み、建玉はブローカーから読み込む"""
+        with get_session() as s:
+            row = s.exec(select(PnL).where(PnL.date == _today())).first()
+        with self._lock:
+            self.book.day = _today()
+            self.book.realized_today = row.realized if row else 0.0
+        self.reconcile()
+
+    def reconcile(self) -> None:
+        # 突き合わせは取りこぼした約定を拾うためのもの。取りこぼしはキャッシュを無効化しないので、
+        # 反映が最大 TTL 遅れることがある（TTL は突き合わせ間隔より短くしておく）
+        # 取得はロックの外なので、取得中に約定が入っていたら置き換えずに次回に回す
+        # （取得した建玉にその約定が含まれているとは限らず、置き換えると約定が巻き戻る）
+        with self._lock:
+            seq = self.book.fill_seq
+        started = time.monotonic()
+        positions = broker_state.positions(allow_stale=False)["data"]
+        with self._lock:
+            self.book.roll_day()
+            if self.book.fill_seq == seq:
+                drift = self.book.replace(positions)
+                # 取得より前に出した注文の約定は取得した建玉に入っている（まだなら取消・失効済みとみなす）
+                for key in [k for k, r in self._reserved.items() if r[3] < started]:
+                    del self._reserved[key]
+            else:
+                drift = []
+                log.info("fills arrived during reconcile; skipping position replace")
+            day, realized = self.book.day, self.book.realized_today
+        if drift:
+            log.warning("position book drift corrected for %s", sorted(drift))
+        self._save_closed_day()
+        self._save_realized(day, realized)
+
+    def _save_closed_day(self) -> None:
+        """日付が変わっていたら前日の実現損益を保存する（リセット前の値が失われないように）"""
+        if self.book.closed_day is None:
+            return
+        with self._lock:
+            closed, self.book.closed_day = self.book.closed_day, None
+        if closed is not None:
+            self._save_realized(*closed)
+
+    @staticmethod
+    def _save_realized(day: str, realized: float) -> None:
         with get_session() as s:
-            pos = s.exec(select(Position).where(Position.ticker == ticker)).first()
-            current = 0.0 if not pos else pos.qty
-            return abs(current + qty_delta) <= self.max_pos_per_ticker
+            row = s.exec(select(PnL).where(PnL.date == day)).first()
+            if row is None:
+                if not realized:
+                    return
+                row = PnL(date=day)
+            row.realized = realized
+            s.add(row)
+            s.commit()
+
+    def start(self, interval_sec: float | None = None) -> None:
+        interval = interval_sec if interval_sec is not None else settings.risk_reconcile_interval_sec
+        self.load()
+        if interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.reconcile()
+                except Exception as e:  # pragma: no cover - defensive logging
+                    log.warning("position reconcile failed: %s", e)
+
+        self._thread = threading.Thread(target=loop, name="risk-reconcile", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+risk_guard = RiskGuard()
+
+
+class TokenBucket:
+    """rate/秒で補充され capacity で頭打ちになるバケツ（時刻を引数で受けて O(1) で更新）"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """amount を取り出せるまでの秒数（refill 済みであること）"""
+        if self.tokens >= amount:
+            return 0.0
+        if amount > self.capacity or self.rate <= 0:
+            return float("inf")
+        return (amount - self.tokens) / self.rate
+
+
+# 放置されたバケツを掃除する間隔
+SWEEP_INTERVAL_SEC = 60.0
+
+
+class OrderThrottle:
+    """
+    発注レートの制御。銘柄別・ソース別・全体のそれぞれに、件数と想定金額の
+    トークンバケツを持ち、すべてに余裕があるときだけ取り出す。
+    余裕がなければ何も消費せずに待ち時間を返すので、呼び出し側が遅延か棄却かを決める。
+    """
+
+    def __init__(self):
+        # 金額バケツは 1注文の上限金額を必ず入れられる容量にする
+        usd = max(settings.default_order_usd, settings.max_order_usd)
+        burst = settings.throttle_burst_sec
+        # scope -> (件数/分, 金額/分)
+        self.limits = {
+            "global": (settings.throttle_global_orders_per_min, settings.throttle_global_notional_per_min),
+            "ticker": (settings.throttle_ticker_orders_per_min, settings.throttle_ticker_notional_per_min),
+            "source": (settings.throttle_source_orders_per_min, settings.throttle_source_notional_per_min),
+        }
+        self._params = {
+            scope: (
+                (n / 60.0, max(1.0, n / 60.0 * burst)),
+                (v / 60.0, max(usd, v / 60.0 * burst)),
+            )
+            for scope, (n, v) in self.limits.items()
+        }
+        self._buckets: Dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+        self._swept = time.monotonic()
+        self.throttled = 0
+        self.evicted = 0
+
+    def _pair(self, scope: str, key: str, now: float) -> tuple | None:
+        if self.limits[scope][0] <= 0:
+            return None
+        pair = self._buckets.get((scope, key))
+        if pair is None:
+            (n_rate, n_cap), (v_rate, v_cap) = self._params[scope]
+            pair = (TokenBucket(n_rate, n_cap, now), TokenBucket(v_rate, v_cap, now))
+            self._buckets[(scope, key)] = pair
+        return pair
+
+    def _pairs(self, ticker: str, source: str, now: float) -> list:
+        return [
+            p for p in (
+                self._pair("global", "*", now),
+                self._pair("ticker", ticker, now),
+                self._pair("source", source, now),
+            ) if p is not None
+        ]
+
+    def _sweep(self, now: float) -> None:
+        """満タンのまま放置された銘柄・ソースのバケツを捨てる（次に来たら満タンで作り直すのと同じ）"""
+        if now - self._swept < SWEEP_INTERVAL_SEC:
+            return
+        self._swept = now
+        idle = []
+        for key, (count, value) in self._buckets.items():
+            count.refill(now)
+            value.refill(now)
+            if key[0] != "global" and count.tokens >= count.capacity and value.tokens >= value.capacity:
+                idle.append(key)
+        for key in idle:
+            del self._buckets[key]
+        self.evicted += len(idle)
+
+    def reject_reason(self, notional: float | None = None) -> str | None:
+        """バケツの容量を超える金額の注文は待っても通らないので理由を返す"""
+        notional = settings.default_order_usd if notional is None else notional
+        for scope, ((_, _), (v_rate, v_cap)) in self._params.items():
+            if self.limits[scope][0] > 0 and v_rate > 0 and notional > v_cap:
+                return f"order notional {notional:.2f} USD exceeds {scope} throttle capacity ({v_cap:.2f})"
+        return None
+
+    def acquire(self, ticker: str, source: str, notional: float | None = None) -> float:
+        """
+        発注枠を確保できれば消費して 0、できなければ待つべき秒数を返す（消費はしない）。
+        容量を超える金額は inf になるので、先に reject_reason で弾くこと。
+        """
+        notional = settings.default_order_usd if notional is None else notional
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            pairs = self._pairs(ticker, source, now)
+            wait = 0.0
+            for count, value in pairs:
+                count.refill(now)
+                value.refill(now)
+                wait = max(wait, count.wait_time(1.0), value.wait_time(notional) if value.rate > 0 else 0.0)
+            if wait > 0:
+                self.throttled += 1
+                return wait
+            for count, value in pairs:
+                count.tokens -= 1.0
+                if value.rate > 0:
+                    value.tokens -= notional
+            return 0.0
+
+    def refund(self, ticker: str, source: str, notional: float | None = None) -> None:
+        """acquire した枠を返す（リスクチェックで棄却した注文など）"""
+        notional = settings.default_order_usd if notional is None else notional
+        now = time.monotonic()
+        with self._lock:
+            for count, value in self._pairs(ticker, source, now):
+                count.refill(now)
+                value.refill(now)
+                count.tokens = min(count.capacity, count.tokens + 1.0)
+                if value.rate > 0:
+                    value.tokens = min(value.capacity, value.tokens + notional)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            buckets = {}
+            for (scope, key), (count, value) in self._buckets.items():
+                count.refill(now)
+                value.refill(now)
+                buckets.setdefault(scope, {})[key] = {
+                    "orders_available": round(count.tokens, 3),
+                    "orders_capacity": count.capacity,
+                    "notional_available": round(value.tokens, 2),
+                    "notional_capacity": value.capacity,
+                }
+            return {
+                "limits_per_min": {
+                    scope: {"orders": n, "notional": v} for scope, (n, v) in self.limits.items()
+                },
+                "burst_sec": settings.throttle_burst_sec,
+                "max_delay_sec": settings.throttle_max_delay_sec,
+                "throttled": self.throttled,
+                "evicted": self.evicted,
+                "buckets": buckets,
+            }
 
 
-risk_guard = RiskGuard()
\ No newline at end of file
+order_throttle = OrderThrottle()
@@ -1,4 +1,4 @@
-from typing import Any, Dict
+from typing import Any, Dict, List
 from pydantic import BaseModel, Field
 
 
@@ -22,3 +22,20 @@ class SignalIn(BaseModel):
     text: str
     source: str
     meta: Dict[str, Any] = Field(default_factory=dict)
+
+
+class SignalBatchIn(BaseModel):
+    items: List[SignalIn]
+
+
+class OrderLegIn(BaseModel):
+    ticker: str
+    side: str  # BUY/SELL
+    qty: float = Field(gt=0)
+    price: float | None = None
+    order_type: str = "MARKET"
+    tif: str = "DAY"
+
+
+class OrderBatchIn(BaseModel):
+    legs: List[OrderLegIn]
@@ -0,0 +1,188 @@
+"""
+SMA クロス戦略のパラメータスイープ
+
+銘柄ごとにバーを1回だけ読み込み、始値/終値を SharedMemory に置いて
+ProcessPoolExecutor の各ワーカーから読み取り専用で参照する。
+タスクに渡すのはブロック名と本数だけなので、配列はタスクごとに pickle されない。
+プロセスプールはモジュールで1つ持ち回し、リクエストごとの spawn 起動を避ける。
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from datetime import datetime
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from .backtest import load_bars, simulate_sma_crossover
+from .config import settings
+
+
+@dataclass
+class SweepResult:
+    symbol: str
+    short_window: int
+    long_window: int
+    final_equity: float
+    total_return_pct: float
+    max_drawdown_pct: float
+    num_trades: int
+
+
+# ワーカープロセス側でアタッチ済みのブロック（名前 → (SharedMemory, opens, closes)）。
+# ワーカーはリクエストをまたいで使い回すので、古いブロックから閉じてメモリを解放する
+_attached: "OrderedDict[str, Tuple[SharedMemory, np.ndarray, np.ndarray]]" = OrderedDict()
+MAX_ATTACHED = 16
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _attach(shm_name: str, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    cached = _attached.get(shm_name)
+    if cached is None:
+        shm = SharedMemory(name=shm_name)
+        block = np.ndarray((2, n), dtype=np.float64, buffer=shm.buf)
+        block.flags.writeable = False
+        cached = (shm, block[0], block[1])
+        del block
+        _attached[shm_name] = cached
+        while len(_attached) > MAX_ATTACHED:
+            _, (old, _, _) = _attached.popitem(last=False)
+            old.close()
+    else:
+        _attached.move_to_end(shm_name)
+    return cached[1], cached[2]
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = settings.sweep_max_workers or os.cpu_count() or 1
+            # uvicorn のスレッドを抱えたまま fork しないよう spawn で起動する
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pool() -> None:
+    """アプリ終了時にワーカープロセスを止める"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def grid_size(n_symbols: int, short_windows: Iterable[int], long_windows: Iterable[int]) -> int:
+    """評価する組み合わせ数（short < long のものだけ）"""
+    longs = sorted(set(long_windows))
+    pairs = sum(len(longs) - np.searchsorted(longs, sw, side="right") for sw in set(short_windows))
+    return n_symbols * int(pairs)
+
+
+def _run_task(
+    symbol: str,
+    shm_name: str,
+    n: int,
+    short_window: int,
+    long_windows: List[int],
+    initial_equity: float,
+) -> List[SweepResult]:
+    opens, closes = _attach(shm_name, n)
+    results: List[SweepResult] = []
+    for long_window in long_windows:
+        entries, _, _, final_equity, max_dd_pct = simulate_sma_crossover(
+            opens, closes, short_window, long_window, initial_equity
+        )
+        results.append(
+            SweepResult(
+                symbol=symbol,
+                short_window=short_window,
+                long_window=long_window,
+                final_equity=final_equity,
+                total_return_pct=(final_equity / initial_equity - 1.0) * 100.0,
+                max_drawdown_pct=max_dd_pct,
+                num_trades=len(entries),
+            )
+        )
+    return results
+
+
+def run_sma_sweep(
+    symbols: Iterable[str],
+    timeframe: str,
+    start: str,
+    end: str,
+    short_windows: Iterable[int],
+    long_windows: Iterable[int],
+    initial_equity: float = 100_000.0,
+) -> List[SweepResult]:
+    """
+    全銘柄 × (short, long) の組み合わせを評価し、total_return_pct の降順で返す。
+    short >= long の組み合わせは除外する。組み合わせが SWEEP_MAX_GRID を超えると ValueError。
+    """
+    start_dt = datetime.fromisoformat(start)
+    end_dt = datetime.fromisoformat(end)
+    symbols = list(dict.fromkeys(symbols))
+    shorts = sorted(set(short_windows))
+    longs = sorted(set(long_windows))
+    size = grid_size(len(symbols), shorts, longs)
+    if settings.sweep_max_grid > 0 and size > settings.sweep_max_grid:
+        raise ValueError(f"sweep grid too large: {size} combinations (max {settings.sweep_max_grid})")
+
+    blocks: Dict[str, Tuple[SharedMemory, int]] = {}
+    try:
+        for symbol in symbols:
+            bars = load_bars(symbol, timeframe, start_dt, end_dt)
+            n = len(bars)
+            if not n:
+                continue
+            shm = SharedMemory(create=True, size=2 * n * 8)
+            block = np.ndarray((2, n), dtype=np.float64, buffer=shm.buf)
+            block[0] = bars.open
+            block[1] = bars.close
+            del block
+            blocks[symbol] = (shm, n)
+
+        tasks = [
+            (symbol, shm.name, n, short_window, [lw for lw in longs if lw > short_window], initial_equity)
+            for symbol, (shm, n) in blocks.items()
+            for short_window in shorts
+            if any(lw > short_window for lw in longs)
+        ]
+        if not tasks:
+            return []
+
+        pool = _get_pool()
+        results: List[SweepResult] = []
+        try:
+            for chunk in pool.map(_run_task, *zip(*tasks)):
+                results.extend(chunk)
+        except BrokenProcessPool:
+            # ワーカーが落ちたプールは使えないので捨て、次のリクエストで作り直す
+            _discard_pool(pool)
+            raise
+    finally:
+        for shm, _ in blocks.values():
+            shm.close()
+            shm.unlink()
+
+    results.sort(key=lambda r: r.total_return_pct, reverse=True)
+    return results
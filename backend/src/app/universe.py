@@ -0,0 +1,85 @@
+"""
+取引可能な銘柄ユニバース
+
+FALLBACK_PATTERN は $ なしの大文字語も拾うため、"THE" や "CEO" がティッカーとして
+抽出され、ブローカーで初めて弾かれていた。起動時にスナップショットファイル
+（1行1銘柄）から frozenset を作り、抽出候補のトークンを O(1) で検証する。
+
+スナップショットは scripts/refresh_symbol_universe.py で Alpaca の assets から作る。
+ファイルがない場合は従来どおりすべての候補を通す。
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Iterable, Optional
+
+from .config import settings
+
+log = logging.getLogger(__name__)
+
+# 抽出候補になりうるトークン: 大文字の英字（BRK.B のようなクラス付き）と 4桁の銘柄コード
+CANDIDATE_PATTERN = re.compile(r"\$?\b(?P<token>[A-Z]{1,5}(?:\.[A-Z])?|\d{4})\b")
+
+
+class SymbolUniverse:
+    def __init__(self, path: str | os.PathLike | None = None):
+        self.path = Path(path or settings.symbol_universe_path)
+        self._symbols: frozenset[str] = frozenset()
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self._symbols)
+
+    def __len__(self) -> int:
+        return len(self._symbols)
+
+    def load(self) -> int:
+        """スナップショットを読み込んで件数を返す（ファイルがなければ 0 で全件許可）"""
+        if not self.path.exists():
+            log.info("symbol universe snapshot not found at %s; accepting all tickers", self.path)
+            self._symbols = frozenset()
+            return 0
+        with self.path.open(encoding="utf-8") as f:
+            symbols = {line.strip().upper() for line in f if line.strip() and not line.startswith("#")}
+        self._symbols = frozenset(symbols)
+        log.info("symbol universe loaded: %d symbols from %s", len(self._symbols), self.path)
+        return len(self._symbols)
+
+    def save(self, symbols: Iterable[str]) -> int:
+        """スナップショットを一時ファイル経由で置き換え、メモリ上のセットも更新する"""
+        symbols = sorted({s.strip().upper() for s in symbols if s and s.strip()})
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text("\n".join(symbols) + "\n", encoding="utf-8")
+        os.replace(tmp, self.path)
+        self._symbols = frozenset(symbols)
+        return len(symbols)
+
+    def is_valid(self, ticker: str | None) -> bool:
+        if not ticker:
+            return False
+        if not self._symbols:
+            return True
+        return ticker.upper() in self._symbols
+
+    def first_valid(self, candidates: Iterable[str]) -> Optional[str]:
+        for c in candidates:
+            if self.is_valid(c):
+                return c.upper()
+        return None
+
+    def scan(self, text: str) -> list[str]:
+        """メッセージ中の候補トークンのうちユニバースに含まれるものを出現順に返す"""
+        seen: dict[str, None] = {}
+        for m in CANDIDATE_PATTERN.finditer(text):
+            token = m.group("token")
+            if token not in seen and self._symbols and token in self._symbols:
+                seen[token] = None
+        return list(seen)
+
+
+symbol_universe = SymbolUniverse()
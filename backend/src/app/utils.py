@@ -1,5 +1,6 @@
 import re
 from .schemas import ExtractedSignal
+from .universe import symbol_universe
 
 
 # $AAPL のように $ 付きティッカーを優先マッチ
@@ -7,15 +8,19 @@ TICKER_PATTERN = re.compile(r"\$(?P<ticker>[A-Z]{1,6})")
 SIDE_PATTERN = re.compile(r"\b(?P<side>BUY|LONG|SELL|SHORT)\b", re.I)
 # フォールバック: $ なしでも BUY/SELL の近くにあるティッカーを拾う
 FALLBACK_PATTERN = re.compile(r"(?P<ticker>\b[A-Z]{2,5}\b).*?(?P<side>BUY|LONG|SELL|SHORT)", re.I)
+SIDE_WORDS = frozenset({"BUY", "LONG", "SELL", "SHORT"})
+# 日本株: 4桁の銘柄コードと 買い/売り（scripts/fetch_latest_tweet.py のルール）。
+# "7203買い" のように日本語が直後に続いても拾えるよう、境界は数字かどうかだけで見る
+JP_CODE_PATTERN = re.compile(r"(?<!\d)(?P<code>\d{4})(?!\d)")
+JP_SIDE_PATTERN = re.compile(r"(?P<side>買い|ロング|売り|ショート)")
 
 
 def naive_extract(text: str) -> ExtractedSignal | None:
-    # 1. $TICKER を探す
-    ticker_m = TICKER_PATTERN.search(text)
+    # 1. $TICKER を探す（ユニバースにない $ 付き語は飛ばす）
+    ticker = symbol_universe.first_valid(m.group("ticker") for m in TICKER_PATTERN.finditer(text))
     side_m = SIDE_PATTERN.search(text)
 
-    if ticker_m and side_m:
-        ticker = ticker_m.group("ticker").upper()
+    if ticker and side_m:
         side_raw = side_m.group("side").upper()
         side = "BUY" if side_raw in {"BUY", "LONG"} else "SELL"
         return ExtractedSignal(ticker=ticker, side=side)
@@ -23,9 +28,31 @@ def naive_extract(text: str) -> ExtractedSignal | None:
     # 2. フォールバック
     fb = FALLBACK_PATTERN.search(text)
     if fb:
-        ticker = fb.group("ticker").upper()
+        ticker = fallback_ticker(text, fb)
+        if ticker is None:
+            return None
         side_raw = fb.group("side").upper()
         side = "BUY" if side_raw in {"BUY", "LONG"} else "SELL"
         return ExtractedSignal(ticker=ticker, side=side)
 
-    return None
\ No newline at end of file
+    return None
+
+
+def fallback_ticker(text: str, fb: re.Match) -> str | None:
+    """
+    $ なしのティッカー候補を決める。ユニバースが読み込まれていれば、メッセージ中の
+    候補トークンから売買方向の単語を除いた最初の有効銘柄を使う。
+    """
+    if not symbol_universe.loaded:
+        return fb.group("ticker").upper()
+    candidates = [t for t in symbol_universe.scan(text) if t not in SIDE_WORDS]
+    return candidates[0] if candidates else None
+
+
+def ensure_int(value, default: int = 0) -> int:
+    try:
+        if value is None:
+            return default
+        return int(value)
+    except (TypeError, ValueError):
+        return default
@@ -3,9 +3,10 @@ from typing import cast
 
 from app.config import settings
 
-from .base import Broker
+from .base import AsyncBroker, Broker, ThreadedBroker
 from .paper import PaperBroker
 from .alpaca_client import AlpacaBroker
+from .alpaca_async import AsyncAlpacaBroker
 
 
 def _build_broker() -> Broker:
@@ -15,6 +16,7 @@ def _build_broker() -> Broker:
             api_key=settings.alpaca_api_key,
             secret_key=settings.alpaca_secret_key,
             paper=settings.alpaca_paper,
+            base_url=settings.alpaca_base_url,
         )
     if broker_name == "paper":
         return PaperBroker()
@@ -27,4 +29,28 @@ def get_broker() -> Broker:
     return cast(Broker, _build_broker())
 
 
-__all__ = ["get_broker", "Broker", "PaperBroker", "AlpacaBroker"]
+@lru_cache(maxsize=1)
+def get_async_broker() -> AsyncBroker:
+    """Return a singleton async broker. Alpaca talks HTTP directly; others run in threads."""
+    if settings.broker.lower() == "alpaca":
+        return AsyncAlpacaBroker(
+            api_key=settings.alpaca_api_key,
+            secret_key=settings.alpaca_secret_key,
+            paper=settings.alpaca_paper,
+            base_url=settings.alpaca_base_url,
+            max_connections=settings.alpaca_max_connections,
+            timeout=settings.alpaca_timeout_sec,
+            max_retries=settings.alpaca_max_retries,
+        )
+    return ThreadedBroker(get_broker())
+
+
+__all__ = [
+    "get_broker",
+    "get_async_broker",
+    "Broker",
+    "AsyncBroker",
+    "PaperBroker",
+    "AlpacaBroker",
+    "AsyncAlpacaBroker",
+]
@@ -0,0 +1,262 @@
+"""Async Alpaca Markets broker.
+
+Talks to the Alpaca trading REST API directly over a pooled ``httpx.AsyncClient``
+(keep-alive connections, per-request timeouts) so order submission never blocks
+a worker thread. Every order carries a ``client_order_id``; when a submit fails
+ambiguously (timeout, dropped connection, 5xx) the retry first looks the order
+up by that id, so a retried request can never create a second order. A
+duplicate-id rejection is resolved the same way, which also covers jobs that
+are resubmitted after a restart.
+"""
+
+import asyncio
+import logging
+import uuid
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .alpaca_client import _STATUS_MAP
+from .base import AsyncBroker
+
+log = logging.getLogger(__name__)
+
+PAPER_URL = "https://paper-api.alpaca.markets"
+LIVE_URL = "https://api.alpaca.markets"
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+_TIFS = {"DAY", "GTC", "IOC", "FOK"}
+
+
+class AlpacaAPIError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"Alpaca API error {status_code}: {message}")
+        self.status_code = status_code
+
+
+class AsyncAlpacaBroker(AsyncBroker):
+    """AsyncBroker backed by the Alpaca REST API."""
+
+    name = "alpaca"
+
+    def __init__(
+        self,
+        api_key: str,
+        secret_key: str,
+        paper: bool = True,
+        base_url: str = "",
+        max_connections: int = 20,
+        timeout: float = 10.0,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._client = httpx.AsyncClient(
+            base_url=base_url or (PAPER_URL if paper else LIVE_URL),
+            headers={"APCA-API-KEY-ID": api_key, "APCA-API-SECRET-KEY": secret_key},
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 5.0)),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            transport=transport,
+        )
+        log.info("Async Alpaca broker initialised (%s)", self._client.base_url)
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    # ------------------------------------------------------------------ #
+    # Helpers
+    # ------------------------------------------------------------------ #
+    @staticmethod
+    def _normalise_symbol(ticker: str) -> str:
+        """Strip market prefix (e.g. ``US.AAPL`` → ``AAPL``)."""
+        return ticker.split(".")[-1].upper()
+
+    @staticmethod
+    def _error(resp: httpx.Response) -> AlpacaAPIError:
+        try:
+            message = resp.json().get("message", resp.text)
+        except ValueError:
+            message = resp.text
+        return AlpacaAPIError(resp.status_code, message)
+
+    def _delay(self, attempt: int, resp: Optional[httpx.Response] = None) -> float:
+        if resp is not None and resp.headers.get("Retry-After"):
+            try:
+                return float(resp.headers["Retry-After"])
+            except ValueError:
+                pass
+        return self._backoff * (2 ** attempt)
+
+    async def _request(self, method: str, path: str, **kwargs: Any) -> httpx.Response:
+        """Send an idempotent request, retrying transport errors, 429 and 5xx."""
+        for attempt in range(self._max_retries + 1):
+            last = attempt == self._max_retries
+            try:
+                resp = await self._client.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                if last:
+                    raise
+                log.warning("Alpaca %s %s failed (%s), retrying", method, path, e)
+                await asyncio.sleep(self._delay(attempt))
+                continue
+            if resp.status_code in _RETRY_STATUSES and not last:
+                log.warning("Alpaca %s %s returned %d, retrying", method, path, resp.status_code)
+                await asyncio.sleep(self._delay(attempt, resp))
+                continue
+            return resp
+        raise AssertionError("unreachable")
+
+    async def _find_order(self, client_order_id: str) -> Optional[Dict[str, Any]]:
+        resp = await self._request(
+            "GET", "/v2/orders:by_client_order_id", params={"client_order_id": client_order_id}
+        )
+        if resp.status_code == 404:
+            return None
+        if resp.status_code >= 400:
+            raise self._error(resp)
+        return resp.json()
+
+    def _format_order(self, order: Dict[str, Any]) -> Dict[str, Any]:
+        status = str(order.get("status", ""))
+        return {
+            "broker": self.name,
+            "ticker": order.get("symbol"),
+            "side": str(order.get("side", "")).upper(),
+            "qty": float(order["qty"]) if order.get("qty") else None,
+            "price": float(order["limit_price"]) if order.get("limit_price") else None,
+            "status": _STATUS_MAP.get(status.lower(), status.upper()),
+            "reason": None,
+            "order_id": order.get("id"),
+            "client_order_id": order.get("client_order_id"),
+            "filled_qty": float(order["filled_qty"]) if order.get("filled_qty") else 0.0,
+            "filled_avg_price": float(order["filled_avg_price"]) if order.get("filled_avg_price") else None,
+        }
+
+    # ------------------------------------------------------------------ #
+    # AsyncBroker interface
+    # ------------------------------------------------------------------ #
+    async def place_order(
+        self,
+        ticker: str,
+        side: str,
+        qty: float,
+        price: Optional[float] = None,
+        order_type: str = "LIMIT",
+        tif: str = "DAY",
+        client_order_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        symbol = self._normalise_symbol(ticker)
+        if side.upper() not in ("BUY", "SELL"):
+            raise ValueError(f"Unsupported order side '{side}'. Expected BUY or SELL.")
+        if tif.upper() not in _TIFS:
+            raise ValueError(f"Unsupported time-in-force '{tif}'. Expected DAY, GTC, IOC, or FOK.")
+        ot = order_type.upper()
+        if ot not in ("MARKET", "LIMIT"):
+            raise ValueError(f"Unsupported order type '{order_type}'. Expected LIMIT or MARKET.")
+        if ot == "LIMIT" and price is None:
+            raise ValueError("Limit orders require a price.")
+
+        client_order_id = client_order_id or uuid.uuid4().hex
+        body: Dict[str, Any] = {
+            "symbol": symbol,
+            "qty": str(qty),
+            "side": side.lower(),
+            "type": ot.lower(),
+            "time_in_force": tif.lower(),
+            "client_order_id": client_order_id,
+        }
+        if ot == "LIMIT":
+            body["limit_price"] = str(price)
+
+        log.debug(
+            "Placing Alpaca order: %s %s qty=%s price=%s type=%s tif=%s coid=%s",
+            symbol, side, qty, price, order_type, tif, client_order_id,
+        )
+        order = None
+        ambiguous = False
+        resubmitted = False
+        for attempt in range(self._max_retries + 1):
+            last = attempt == self._max_retries
+            if ambiguous:
+                # The previous attempt may have reached Alpaca; never submit twice.
+                order = await self._find_order(client_order_id)
+                if order is not None:
+                    break
+            try:
+                resp = await self._client.post("/v2/orders", json=body)
+            except httpx.TransportError as e:
+                if last:
+                    raise
+                ambiguous = ambiguous or not isinstance(e, httpx.ConnectError)
+                log.warning("Alpaca order %s failed (%s), retrying", client_order_id, e)
+                await asyncio.sleep(self._delay(attempt))
+                continue
+            if resp.status_code in _RETRY_STATUSES and not last:
+                ambiguous = ambiguous or resp.status_code != 429
+                log.warning("Alpaca order %s returned %d, retrying", client_order_id, resp.status_code)
+                await asyncio.sleep(self._delay(attempt, resp))
+                continue
+            if resp.status_code == 422:
+                # Duplicate client_order_id: an earlier attempt went through, either
+                # in this call or before a restart (recovered pipeline jobs reuse the id).
+                order = await self._find_order(client_order_id)
+                if order is not None:
+                    # An order from a previous process is already in the broker positions
+                    # the risk book was loaded from, so don't count its fills twice.
+                    resubmitted = not ambiguous
+                    break
+            if resp.status_code >= 400:
+                raise self._error(resp)
+            order = resp.json()
+            break
+
+        result = self._format_order(order)
+        log.info("Alpaca order submitted: id=%s status=%s", result["order_id"], result["status"])
+        # 送信時点で約定済みの分だけ反映する（残りは定期の突き合わせで取り込む）
+        if result["filled_qty"] and result["filled_avg_price"] and not resubmitted:
+            self.notify_fill(symbol, side.upper(), result["filled_qty"], result["filled_avg_price"])
+        return result
+
+    async def positions(self) -> Dict[str, Dict[str, Any]]:
+        resp = await self._request("GET", "/v2/positions")
+        if resp.status_code >= 400:
+            raise self._error(resp)
+        positions: Dict[str, Dict[str, Any]] = {}
+        for pos in resp.json():
+            positions[pos["symbol"]] = {
+                "qty": float(pos["qty"]),
+                "avg_price": float(pos["avg_entry_price"]),
+            }
+        log.debug("Fetched %d positions from Alpaca", len(positions))
+        return positions
+
+    async def account(self) -> Dict[str, Any]:
+        """Return account summary (balance, buying power, etc.)."""
+        resp = await self._request("GET", "/v2/account")
+        if resp.status_code >= 400:
+            raise self._error(resp)
+        acct = resp.json()
+        return {
+            "id": acct.get("id"),
+            "status": acct.get("status"),
+            "currency": acct.get("currency"),
+            "cash": float(acct.get("cash") or 0.0),
+            "portfolio_value": float(acct.get("portfolio_value") or 0.0),
+            "buying_power": float(acct.get("buying_power") or 0.0),
+            "equity": float(acct.get("equity") or 0.0),
+            "pattern_day_trader": acct.get("pattern_day_trader"),
+            "trading_blocked": acct.get("trading_blocked"),
+            "account_blocked": acct.get("account_blocked"),
+        }
+
+    async def cancel_all(self) -> None:
+        resp = await self._request("DELETE", "/v2/orders")
+        if resp.status_code >= 400:
+            raise self._error(resp)
+        statuses: List[Any] = resp.json() if resp.content else []
+        log.info("Alpaca cancel_all: %d cancel requests sent", len(statuses))
@@ -61,12 +61,14 @@ class AlpacaBroker(Broker):
         api_key: str,
         secret_key: str,
         paper: bool = True,
+        base_url: str = "",
     ):
         self._paper = paper
         self._client = TradingClient(
             api_key=api_key,
             secret_key=secret_key,
             paper=paper,
+            url_override=base_url or None,
         )
         mode = "paper" if paper else "live"
         log.info("Alpaca broker initialised (%s mode)", mode)
@@ -93,6 +95,9 @@ class AlpacaBroker(Broker):
             "status": self._normalise_status(str(order.status)),
             "reason": None,
             "order_id": str(order.id),
+            "client_order_id": order.client_order_id,
+            "filled_qty": float(order.filled_qty) if order.filled_qty else 0.0,
+            "filled_avg_price": float(order.filled_avg_price) if order.filled_avg_price else None,
         }
 
     # ------------------------------------------------------------------ #
@@ -106,6 +111,7 @@ class AlpacaBroker(Broker):
         price: Optional[float] = None,
         order_type: str = "LIMIT",
         tif: str = "DAY",
+        client_order_id: Optional[str] = None,
     ) -> Dict[str, Any]:
         symbol = self._normalise_symbol(ticker)
         alpaca_side = _SIDE_MAP.get(side.upper())
@@ -122,6 +128,7 @@ class AlpacaBroker(Broker):
                 qty=qty,
                 side=alpaca_side,
                 time_in_force=alpaca_tif,
+                client_order_id=client_order_id,
             )
         elif ot == "LIMIT":
             if price is None:
@@ -132,6 +139,7 @@ class AlpacaBroker(Broker):
                 side=alpaca_side,
                 time_in_force=alpaca_tif,
                 limit_price=price,
+                client_order_id=client_order_id,
             )
         else:
             raise ValueError(f"Unsupported order type '{order_type}'. Expected LIMIT or MARKET.")
@@ -143,6 +151,9 @@ class AlpacaBroker(Broker):
         order = self._client.submit_order(req)
         result = self._format_order(order)
         log.info("Alpaca order submitted: id=%s status=%s", result["order_id"], result["status"])
+        # 送信時点で約定済みの分だけ反映する（残りは定期の突き合わせで取り込む）
+        if result["filled_qty"] and result["filled_avg_price"]:
+            self.notify_fill(symbol, side.upper(), result["filled_qty"], result["filled_avg_price"])
         return result
 
     def positions(self) -> Dict[str, Dict[str, Any]]:
@@ -1,5 +1,10 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import List, Optional
+
+from app.broker_state import broker_state
+from app.config import settings
+from app.risk import risk_guard
 
 
 class Broker(ABC):
@@ -15,6 +20,7 @@ class Broker(ABC):
         price: Optional[float] = None,
         order_type: str = "LIMIT",
         tif: str = "DAY",
+        client_order_id: Optional[str] = None,
     ) -> dict:
         ...
 
@@ -27,3 +33,98 @@ class Broker(ABC):
     @abstractmethod
     def cancel_all(self) -> None:
         ...
+
+
+    def account(self) -> dict:
+        raise NotImplementedError(f"{self.name} broker does not provide account information")
+
+
+    def notify_fill(self, ticker: str, side: str, qty: float, price: float) -> None:
+        """約定をリスク管理のポジションブックに反映し、建玉・口座キャッシュを無効化する"""
+        if qty and price:
+            risk_guard.on_fill(ticker, side, qty, price)
+            broker_state.invalidate()
+
+
+class AsyncBroker(ABC):
+    """Broker と同じ操作を asyncio から呼ぶためのインターフェース"""
+    name: str
+
+
+    @abstractmethod
+    async def place_order(
+        self,
+        ticker: str,
+        side: str,
+        qty: float,
+        price: Optional[float] = None,
+        order_type: str = "LIMIT",
+        tif: str = "DAY",
+        client_order_id: Optional[str] = None,
+    ) -> dict:
+        ...
+
+
+    @abstractmethod
+    async def positions(self) -> dict[str, dict]:
+        ...
+
+
+    @abstractmethod
+    async def cancel_all(self) -> None:
+        ...
+
+
+    async def place_orders(self, orders: List[dict], concurrency: Optional[int] = None) -> List[dict]:
+        """複数の注文（place_order の引数の dict）を同時に送る。
+
+        結果は入力と同じ順で返し、失敗した注文は status=ERROR と reason を入れる。
+        """
+        sem = asyncio.Semaphore(max(1, concurrency or settings.broker_bulk_concurrency))
+
+        async def one(order: dict) -> dict:
+            async with sem:
+                try:
+                    return await self.place_order(**order)
+                except Exception as e:
+                    return {"broker": self.name, "ticker": order.get("ticker"), "status": "ERROR", "reason": str(e)}
+
+        return list(await asyncio.gather(*(one(o) for o in orders)))
+
+
+    async def aclose(self) -> None:
+        pass
+
+
+    notify_fill = Broker.notify_fill
+
+
+class ThreadedBroker(AsyncBroker):
+    """同期 Broker をスレッドプールで動かして AsyncBroker として見せる"""
+
+    def __init__(self, broker: Broker):
+        self._broker = broker
+        self.name = broker.name
+
+
+    async def place_order(
+        self,
+        ticker: str,
+        side: str,
+        qty: float,
+        price: Optional[float] = None,
+        order_type: str = "LIMIT",
+        tif: str = "DAY",
+        client_order_id: Optional[str] = None,
+    ) -> dict:
+        return await asyncio.to_thread(
+            self._broker.place_order, ticker, side, qty, price, order_type, tif, client_order_id
+        )
+
+
+    async def positions(self) -> dict[str, dict]:
+        return await asyncio.to_thread(self._broker.positions)
+
+
+    async def cancel_all(self) -> None:
+        await asyncio.to_thread(self._broker.cancel_all)
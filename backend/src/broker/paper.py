@@ -1,14 +1,44 @@
-from .base import Broker
-from typing import Optional
+import logging
+import threading
+import zlib
+from typing import Iterable, List, Optional
+
 from sqlmodel import select
+
+from app.config import settings
 from app.db import get_session
 from app.models import Order, Position, Execution
+from app.positions import apply_fill
+from app.prices import Bar, price_cache
+from .base import Broker
+from .paper_engine import Fill, MatchingEngine, PaperOrder
+
+log = logging.getLogger(__name__)
+
+# 同じ銘柄の約定反映（建玉の読み書き）を直列化するロック。銘柄をハッシュで振り分けるので
+# 別銘柄の注文は並行して処理できる
+_STRIPES = [threading.Lock() for _ in range(64)]
+
+
+def _stripe(ticker: str) -> threading.Lock:
+    return _STRIPES[zlib.crc32(ticker.encode()) % len(_STRIPES)]
 
 
 class PaperBroker(Broker):
     name = "paper"
 
 
+    def __init__(self):
+        # 注文は MatchingEngine に置き、直近価格キャッシュに新しいバーが入るたびに突き合わせる。
+        # まだバーが無い銘柄は直近価格（古くても可）で到着時に約定させる
+        self.engine = MatchingEngine(
+            slippage_bps=settings.paper_slippage_bps,
+            participation=settings.paper_participation,
+            fallback_price=lambda t: price_cache.last_price(t, allow_stale=True),
+        )
+        price_cache.subscribe(self._on_bar)
+
+
     def place_order(
         self,
         ticker: str,
@@ -17,28 +47,109 @@ class PaperBroker(Broker):
         price: Optional[float] = None,
         order_type: str = "LIMIT",
         tif: str = "DAY",
+        client_order_id: Optional[str] = None,
     ) -> dict:
-        # 約定=即時、価格は直近値の代わりに指定/ダミー（1.0）
-        px = price or 1.0
+        limit_price = price if order_type.upper() == "LIMIT" else None
+        with _stripe(ticker):
+            # Alpaca と同じく client_order_id が同じ注文は出し直さず、既存の注文を返す
+            existing = self._find_order(client_order_id) if client_order_id else None
+            if existing is not None:
+                log.info("paper order %s already exists (client_order_id=%s)", existing["order_id"], client_order_id)
+                return existing
+            paper_order, fills = self.engine.submit(self.engine.new_id(), ticker, side, qty, limit_price, tif)
+            # 注文・約定・建玉を1トランザクションで保存する
+            try:
+                with get_session() as s:
+                    row = Order(
+                        broker=self.name,
+                        ticker=ticker,
+                        side=side,
+                        qty=qty,
+                        price=paper_order.avg_price or limit_price,
+                        status=paper_order.status,
+                        client_order_id=client_order_id,
+                    )
+                    s.add(row)
+                    s.flush()
+                    order_ref = row.id
+                    self._apply_fills(s, fills, ref=order_ref)
+                    s.commit()
+            except Exception:
+                # DB に残らなかった注文はエンジンからも取り消す（板に残すと後の約定が宙に浮く）
+                self.engine.cancel(paper_order.id)
+                raise
+            paper_order.ref = order_ref
+        self._notify(fills)
+        return {
+            "status": paper_order.status,
+            "price": paper_order.avg_price or limit_price,
+            "order_id": paper_order.ref,
+            # Order 行は保存済みなので、呼び出し側は新しく作らずこの行を使う
+            "local_order_id": paper_order.ref,
+            "client_order_id": client_order_id,
+            "filled_qty": paper_order.filled_qty,
+            "filled_avg_price": paper_order.avg_price,
+        }
+
+
+    def _find_order(self, client_order_id: str) -> Optional[dict]:
         with get_session() as s:
-            order = Order(broker=self.name, ticker=ticker, side=side, qty=qty, price=px, status="FILLED")
-            s.add(order)
-            # ポジション更新
-            pos = s.exec(select(Position).where(Position.ticker == ticker)).first()
-            signed_qty = qty if side == "BUY" else -qty
-            if pos:
-                new_qty = pos.qty + signed_qty
-                if new_qty == 0:
-                    s.delete(pos)
-                else:
-                    # 単純平均
-                    pos.avg_price = (abs(pos.qty)*pos.avg_price + qty*px)/max(abs(new_qty),1)
-                    pos.qty = new_qty
-            else:
-                s.add(Position(ticker=ticker, qty=signed_qty, avg_price=px))
-            s.add(Execution(order_id=0, ticker=ticker, side=side, qty=qty, price=px))
-            s.commit()
-            return {"status": "filled", "price": px}
+            row = s.exec(
+                select(Order).where(Order.broker == self.name, Order.client_order_id == client_order_id)
+            ).first()
+            if row is None:
+                return None
+            filled = sum(e.qty for e in s.exec(select(Execution).where(Execution.order_id == row.id)).all())
+            return {
+                "status": row.status,
+                "price": row.price,
+                "order_id": row.id,
+                "local_order_id": row.id,
+                "client_order_id": client_order_id,
+                "filled_qty": filled,
+                "filled_avg_price": row.price if filled else None,
+            }
+
+
+    def _on_bar(self, ticker: str, bar: Bar) -> None:
+        with _stripe(ticker):
+            fills, expired = self.engine.on_bar(ticker, bar)
+            if not fills and not expired:
+                return
+            with get_session() as s:
+                self._apply_fills(s, fills)
+                self._update_orders(s, [*(f.order for f in fills), *expired])
+                s.commit()
+        self._notify(fills)
+
+
+    def _apply_fills(self, s, fills: List[Fill], ref: Optional[int] = None) -> None:
+        for fill in fills:
+            order = fill.order
+            order_id = ref if ref is not None else order.ref
+            if order_id is None:
+                log.warning("dropping paper fill for unsaved order %s %s", order.id, order.ticker)
+                continue
+            # 同じ銘柄は _stripe で直列化済み
+            apply_fill(s, order.ticker, order.side, fill.qty, fill.price)
+            s.add(Execution(order_id=order_id, ticker=order.ticker, side=order.side, qty=fill.qty, price=fill.price))
+
+
+    @staticmethod
+    def _update_orders(s, orders: Iterable[PaperOrder]) -> None:
+        for paper_order in {o.ref: o for o in orders if o.ref is not None}.values():
+            row = s.get(Order, paper_order.ref)
+            if row is None:
+                continue
+            row.status = paper_order.status
+            if paper_order.avg_price is not None:
+                row.price = paper_order.avg_price
+            s.add(row)
+
+
+    def _notify(self, fills: List[Fill]) -> None:
+        for fill in fills:
+            self.notify_fill(fill.order.ticker, fill.order.side, fill.qty, fill.price)
 
 
     def positions(self) -> dict[str, dict]:
@@ -47,5 +158,20 @@ class PaperBroker(Broker):
             return {r.ticker: {"qty": r.qty, "avg_price": r.avg_price} for r in rows}
 
 
+    def account(self) -> dict:
+        """建玉の簿価から組み立てる簡易の口座サマリー（紙取引は現金残高を持たない）"""
+        positions = self.positions()
+        return {
+            "status": "ACTIVE",
+            "currency": "USD",
+            "positions": len(positions),
+            "long_cost_basis": sum(p["qty"] * p["avg_price"] for p in positions.values() if p["qty"] > 0),
+            "short_cost_basis": sum(-p["qty"] * p["avg_price"] for p in positions.values() if p["qty"] < 0),
+        }
+
+
     def cancel_all(self) -> None:
-        return None
+        cancelled = self.engine.cancel_all()
+        with get_session() as s:
+            self._update_orders(s, cancelled)
+            s.commit()
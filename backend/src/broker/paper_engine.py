@@ -0,0 +1,296 @@
+"""Paper-trading matching engine.
+
+Working orders are kept per symbol in price-indexed heaps (best bid / best ask on
+top) and matched against incoming bars or quotes:
+
+* MARKET orders fill at the bar open (or the quote) plus slippage.
+* BUY LIMIT orders fill once the bar low trades through the limit; SELL LIMIT
+  orders once the bar high does. The fill price is the limit, or the open if
+  the bar gapped through it.
+* Each bar offers at most ``participation × volume`` shares, so large orders are
+  filled partially across several bars. Orders arriving between bars draw on
+  whatever the last bar has left after the resting orders matched against it.
+* TIF: DAY orders expire when the UTC date rolls over, GTC orders rest until
+  cancelled, IOC cancels whatever is not filled on arrival, and FOK fills
+  completely on arrival or not at all.
+
+Insert and best-price access are O(log n). Cancelled and filled orders are
+removed lazily when they reach the top of a heap.
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import math
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from app.prices import Bar
+
+TIFS = ("DAY", "GTC", "IOC", "FOK")
+OPEN_STATUSES = ("NEW", "PARTIALLY_FILLED")
+
+
+@dataclass
+class PaperOrder:
+    id: int
+    ticker: str
+    side: str  # BUY / SELL
+    qty: float
+    limit_price: Optional[float]  # None = MARKET
+    tif: str
+    day: date
+    filled_qty: float = 0.0
+    notional: float = 0.0
+    status: str = "NEW"
+    ref: Optional[int] = None  # caller's id for this order (e.g. the Order row id)
+
+    @property
+    def remaining(self) -> float:
+        return self.qty - self.filled_qty
+
+    @property
+    def avg_price(self) -> Optional[float]:
+        return self.notional / self.filled_qty if self.filled_qty else None
+
+    @property
+    def is_open(self) -> bool:
+        return self.status in OPEN_STATUSES
+
+
+@dataclass(frozen=True)
+class Fill:
+    order: PaperOrder
+    qty: float
+    price: float
+
+
+@dataclass
+class _Book:
+    bids: List[Tuple[float, int, PaperOrder]] = field(default_factory=list)  # (-limit, seq, order)
+    asks: List[Tuple[float, int, PaperOrder]] = field(default_factory=list)  # (limit, seq, order)
+    market: Deque[PaperOrder] = field(default_factory=deque)
+    last: Optional[Bar] = None
+    available: float = math.inf  # liquidity of ``last`` not yet consumed
+
+
+class MatchingEngine:
+    def __init__(
+        self,
+        slippage_bps: float = 0.0,
+        participation: float = 0.0,
+        fallback_price: Optional[Callable[[str], Optional[float]]] = None,
+    ):
+        """
+        :param slippage_bps: adverse slippage applied to MARKET fills, in basis points
+        :param participation: share of bar volume available per bar (0 = unlimited)
+        :param fallback_price: last-price lookup used when no bar has been seen yet
+        """
+        self.slippage_bps = slippage_bps
+        self.participation = participation
+        self.fallback_price = fallback_price
+        self._books: Dict[str, _Book] = {}
+        self._orders: Dict[int, PaperOrder] = {}
+        self._day_orders: Dict[date, List[PaperOrder]] = {}
+        self._seq = itertools.count()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------ #
+    # Public API
+    # ------------------------------------------------------------------ #
+    def new_id(self) -> int:
+        return next(self._ids)
+
+    def submit(
+        self,
+        order_id: int,
+        ticker: str,
+        side: str,
+        qty: float,
+        limit_price: Optional[float] = None,
+        tif: str = "DAY",
+        now: Optional[datetime] = None,
+    ) -> Tuple[PaperOrder, List[Fill]]:
+        side, tif = side.upper(), tif.upper()
+        if side not in ("BUY", "SELL"):
+            raise ValueError(f"Unsupported order side '{side}'. Expected BUY or SELL.")
+        if tif not in TIFS:
+            raise ValueError(f"Unsupported time-in-force '{tif}'. Expected DAY, GTC, IOC, or FOK.")
+        if qty <= 0:
+            raise ValueError("Order quantity must be positive.")
+
+        order = PaperOrder(
+            id=order_id,
+            ticker=ticker,
+            side=side,
+            qty=qty,
+            limit_price=limit_price,
+            tif=tif,
+            day=(now or datetime.utcnow()).date(),
+        )
+        with self._lock:
+            book = self._books.setdefault(ticker, _Book())
+            fills = self._match_on_arrival(book, order)
+            if order.is_open:
+                if tif in ("IOC", "FOK"):
+                    order.status = "CANCELED"
+                else:
+                    self._rest(book, order)
+        return order, fills
+
+    def on_bar(self, ticker: str, bar: Bar) -> Tuple[List[Fill], List[PaperOrder]]:
+        """
+        Match resting orders for ``ticker`` against a new bar or quote.
+        Returns the fills and any DAY orders that expired because the date rolled over.
+        """
+        with self._lock:
+            fills: List[Fill] = []
+            expired = self._expire_before(bar.ts.date())
+            book = self._books.get(ticker)
+            if book is None:
+                self._books[ticker] = _Book(last=bar, available=self._liquidity(bar))
+                return fills, expired
+            book.last = bar
+            liquidity = self._liquidity(bar)
+
+            # Market orders first, at the open
+            while book.market and liquidity > 0:
+                order = book.market[0]
+                if not order.is_open:
+                    book.market.popleft()
+                    continue
+                liquidity -= self._fill(order, min(order.remaining, liquidity), self._slipped(order.side, bar.open), fills)
+                if not order.is_open:
+                    book.market.popleft()
+
+            # Best bid downwards while the bar traded at or below it
+            while book.bids and liquidity > 0:
+                neg_limit, _, order = book.bids[0]
+                if not order.is_open:
+                    heapq.heappop(book.bids)
+                    continue
+                limit = -neg_limit
+                if bar.low > limit:
+                    break
+                liquidity -= self._fill(order, min(order.remaining, liquidity), min(limit, bar.open), fills)
+                if not order.is_open:
+                    heapq.heappop(book.bids)
+
+            # Best ask upwards while the bar traded at or above it
+            while book.asks and liquidity > 0:
+                limit, _, order = book.asks[0]
+                if not order.is_open:
+                    heapq.heappop(book.asks)
+                    continue
+                if bar.high < limit:
+                    break
+                liquidity -= self._fill(order, min(order.remaining, liquidity), max(limit, bar.open), fills)
+                if not order.is_open:
+                    heapq.heappop(book.asks)
+            book.available = liquidity
+            return fills, expired
+
+    def cancel(self, order_id: int) -> Optional[PaperOrder]:
+        with self._lock:
+            order = self._orders.pop(order_id, None)
+            if order is not None and order.is_open:
+                order.status = "CANCELED"
+            return order
+
+    def cancel_all(self) -> List[PaperOrder]:
+        with self._lock:
+            cancelled = [o for o in self._orders.values() if o.is_open]
+            for order in cancelled:
+                order.status = "CANCELED"
+            self._orders.clear()
+            self._day_orders.clear()
+            self._books = {t: _Book(last=b.last, available=b.available) for t, b in self._books.items()}
+            return cancelled
+
+    def expire(self, today: Optional[date] = None) -> List[PaperOrder]:
+        """Expire DAY orders from days before ``today``."""
+        with self._lock:
+            return self._expire_before(today or datetime.utcnow().date())
+
+    def open_orders(self) -> List[PaperOrder]:
+        with self._lock:
+            return [o for o in self._orders.values() if o.is_open]
+
+    # ------------------------------------------------------------------ #
+    # Internals (caller holds the lock)
+    # ------------------------------------------------------------------ #
+    def _match_on_arrival(self, book: _Book, order: PaperOrder) -> List[Fill]:
+        fills: List[Fill] = []
+        if book.last is not None:
+            price, liquidity = book.last.close, book.available
+        else:
+            price = self.fallback_price(order.ticker) if self.fallback_price else None
+            liquidity = math.inf
+        if price is None:
+            return fills
+
+        if order.limit_price is None:
+            exec_price = self._slipped(order.side, price)
+        elif (order.side == "BUY" and price <= order.limit_price) or (
+            order.side == "SELL" and price >= order.limit_price
+        ):
+            exec_price = price
+        else:
+            return fills
+
+        qty = min(order.remaining, liquidity)
+        if order.tif == "FOK" and qty < order.qty:
+            return fills
+        if qty > 0:
+            filled = self._fill(order, qty, exec_price, fills)
+            if book.last is not None:
+                book.available -= filled
+        return fills
+
+    def _rest(self, book: _Book, order: PaperOrder) -> None:
+        self._orders[order.id] = order
+        if order.tif == "DAY":
+            self._day_orders.setdefault(order.day, []).append(order)
+        if order.limit_price is None:
+            book.market.append(order)
+        elif order.side == "BUY":
+            heapq.heappush(book.bids, (-order.limit_price, next(self._seq), order))
+        else:
+            heapq.heappush(book.asks, (order.limit_price, next(self._seq), order))
+
+    def _expire_before(self, today: date) -> List[PaperOrder]:
+        expired: List[PaperOrder] = []
+        for day in [d for d in self._day_orders if d < today]:
+            for order in self._day_orders.pop(day):
+                if order.is_open:
+                    order.status = "EXPIRED"
+                    expired.append(order)
+                self._orders.pop(order.id, None)
+        return expired
+
+    def _liquidity(self, bar: Bar) -> float:
+        if self.participation <= 0 or bar.volume is None:
+            return math.inf
+        return math.floor(bar.volume * self.participation)
+
+    def _slipped(self, side: str, price: float) -> float:
+        adj = price * self.slippage_bps / 10_000.0
+        return price + adj if side == "BUY" else price - adj
+
+    def _fill(self, order: PaperOrder, qty: float, price: float, fills: List[Fill]) -> float:
+        if qty <= 0:
+            return 0.0
+        order.filled_qty += qty
+        order.notional += qty * price
+        if order.remaining <= 1e-9:
+            order.status = "FILLED"
+            self._orders.pop(order.id, None)
+        else:
+            order.status = "PARTIALLY_FILLED"
+        fills.append(Fill(order=order, qty=qty, price=price))
+        return qty
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import List, Optional
 from app.schemas import ExtractedSignal
 
 class LLM(ABC):
@@ -7,3 +7,7 @@ class LLM(ABC):
     def extract(self, text: str) -> Optional[ExtractedSignal]:
         """Return structured trading signal or None."""
         raise NotImplementedError
+
+    def extract_batch(self, texts: List[str]) -> List[Optional[ExtractedSignal]]:
+        """Extract several texts at once; results are in input order."""
+        return [self.extract(text) for text in texts]
@@ -0,0 +1,73 @@
+"""
+マイクロバッチで LLM 抽出をまとめるラッパー
+
+extract() は呼び出しスレッドをブロックしたまま内部キューに積み、
+collector スレッドが window_ms 待つか max_batch 件たまった時点で
+inner.extract_batch() を1回呼ぶ。バッチは max_concurrency 本まで並行に実行する。
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from app.schemas import ExtractedSignal
+from .base import LLM
+
+log = logging.getLogger(__name__)
+
+
+class BatchingLLM(LLM):
+    def __init__(
+        self,
+        inner: LLM,
+        max_batch: int = 16,
+        window_ms: int = 50,
+        max_concurrency: int = 4,
+        timeout_sec: float = 60.0,
+    ):
+        self.inner = inner
+        self.max_batch = max_batch
+        self.window = window_ms / 1000.0
+        self.timeout_sec = timeout_sec
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm-batch")
+        self._collector = threading.Thread(target=self._collect, name="llm-batch-collector", daemon=True)
+        self._collector.start()
+
+    def extract(self, text: str) -> Optional[ExtractedSignal]:
+        fut: Future = Future()
+        self._queue.put((text, fut))
+        return fut.result(timeout=self.timeout_sec)
+
+    def extract_batch(self, texts: List[str]) -> List[Optional[ExtractedSignal]]:
+        return self.inner.extract_batch(texts)
+
+    def _collect(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._pool.submit(self._run, batch)
+
+    def _run(self, batch: List[Tuple[str, Future]]) -> None:
+        texts = [text for text, _ in batch]
+        try:
+            results = self.inner.extract_batch(texts)
+        except Exception as e:
+            log.warning("LLM batch of %d failed: %s", len(batch), e)
+            for _, fut in batch:
+                fut.set_exception(e)
+            return
+        log.debug("LLM batch of %d extracted", len(batch))
+        for (_, fut), result in zip(batch, results):
+            fut.set_result(result)
@@ -0,0 +1,173 @@
+"""
+LLM 抽出結果のキャッシュ
+
+キーは 正規化した本文の sha256 + モデル名 + プロンプトバージョン。
+同じアラートが Twitter / Discord / 再送から届いても LLM 呼び出しは1回で済む。
+メモリの LRU を一次、SQLite ファイルを二次（プロセス間・再起動後も共有）とし、
+TTL と件数上限で古いものから捨てる。抽出できなかった結果（None）はキャッシュしない。
+"""
+
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.schemas import ExtractedSignal
+from .base import LLM
+
+log = logging.getLogger(__name__)
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    return _WS.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class CachedLLM(LLM):
+    def __init__(
+        self,
+        inner: LLM,
+        model: str,
+        prompt_version: str,
+        path: str,
+        ttl_sec: int = 86400,
+        memory_size: int = 2048,
+        max_rows: int = 100_000,
+    ):
+        self.inner = inner
+        self.model = model
+        self.prompt_version = prompt_version
+        self.ttl_sec = ttl_sec
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+        self._memory: "OrderedDict[str, Tuple[float, ExtractedSignal]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        self.counters: Dict[str, int] = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS extraction_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS ix_extraction_cache_created_at ON extraction_cache (created_at)"
+        )
+
+    def key(self, text: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{digest}:{self.model}:{self.prompt_version}"
+
+    # ------------------------------------------------------------------ #
+    # tiers
+    # ------------------------------------------------------------------ #
+    def _get(self, key: str) -> Optional[ExtractedSignal]:
+        now = time.time()
+        with self._lock:
+            hit = self._memory.get(key)
+            if hit is not None:
+                created_at, value = hit
+                if now - created_at <= self.ttl_sec:
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+
+            row = self._db.execute(
+                "SELECT value, created_at FROM extraction_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] <= self.ttl_sec:
+                value = ExtractedSignal.model_validate_json(row[0])
+                self._remember(key, row[1], value)
+                self.counters["disk_hits"] += 1
+                return value
+            self.counters["misses"] += 1
+            return None
+
+    def _put(self, key: str, value: ExtractedSignal) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            self._db.execute(
+                "INSERT OR REPLACE INTO extraction_cache (key, value, created_at) VALUES (?, ?, ?)",
+                (key, value.model_dump_json(), now),
+            )
+            self.counters["stores"] += 1
+            self._writes_since_prune += 1
+            if self._writes_since_prune >= 100:
+                self._prune(now)
+
+    def _remember(self, key: str, created_at: float, value: ExtractedSignal) -> None:
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _prune(self, now: float) -> None:
+        """TTL 切れと件数上限超過分を古い順に削除する（呼び出し側でロック済み）"""
+        self._writes_since_prune = 0
+        expired = self._db.execute(
+            "DELETE FROM extraction_cache WHERE created_at < ?", (now - self.ttl_sec,)
+        ).rowcount
+        overflow = self._db.execute(
+            "DELETE FROM extraction_cache WHERE key IN ("
+            " SELECT key FROM extraction_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,),
+        ).rowcount
+        self.counters["evictions"] += max(expired, 0) + max(overflow, 0)
+
+    # ------------------------------------------------------------------ #
+    # LLM interface
+    # ------------------------------------------------------------------ #
+    def extract(self, text: str) -> Optional[ExtractedSignal]:
+        key = self.key(text)
+        cached = self._get(key)
+        if cached is not None:
+            return cached
+        result = self.inner.extract(text)
+        if result is not None:
+            self._put(key, result)
+        return result
+
+    def extract_batch(self, texts: List[str]) -> List[Optional[ExtractedSignal]]:
+        keys = [self.key(t) for t in texts]
+        results: List[Optional[ExtractedSignal]] = [self._get(k) for k in keys]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            fetched = self.inner.extract_batch([texts[i] for i in missing])
+            for i, value in zip(missing, fetched):
+                results[i] = value
+                if value is not None:
+                    self._put(keys[i], value)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+            memory_entries = len(self._memory)
+            disk_entries = self._db.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()[0]
+        lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        return {
+            **counters,
+            "hit_rate": hits / lookups if lookups else None,
+            "memory_entries": memory_entries,
+            "disk_entries": disk_entries,
+            "model": self.model,
+            "prompt_version": self.prompt_version,
+        }
@@ -1,14 +1,28 @@
-from typing import Optional
+from typing import List, Optional
 import json
+import logging
 from app.schemas import ExtractedSignal
 from .base import LLM
 
+# プロンプトを変えたら上げる（抽出キャッシュのキーに含まれる）
+PROMPT_VERSION = "1"
+
 PROMPT = """
 あなたは株式トレード用の情報抽出器です。以下の投稿から、銘柄コード（US株ティッカー）、売買方向（BUY/SELL）、信頼度0-1、timeframe（任意）、stop（任意, 数値）、take（任意, 数値）をJSONで返してください。
 出力のみ：{"ticker":"", "side":"BUY|SELL", "confidence":0.0, "timeframe":"", "stop":null, "take":null}
 投稿: <<<{text}>>>
 """
 
+BATCH_PROMPT = """
+あなたは株式トレード用の情報抽出器です。以下の各投稿について、銘柄コード（US株ティッカー）、売買方向（BUY/SELL）、信頼度0-1、timeframe（任意）、stop（任意, 数値）、take（任意, 数値）を抽出してください。
+シグナルが無い投稿は ticker を null にしてください。
+出力は入力と同じ id を持つ JSON 配列のみ：[{"id":0, "ticker":"", "side":"BUY|SELL", "confidence":0.0, "timeframe":"", "stop":null, "take":null}]
+投稿: <<<{items}>>>
+"""
+
+log = logging.getLogger(__name__)
+
+
 class OpenAILLM(LLM):
     def __init__(self, model: str, api_key: str, base_url: str | None = None):
         # importをここに置くと、OpenAI未インストールでも他の実装で進められる
@@ -23,7 +37,7 @@ class OpenAILLM(LLM):
         try:
             rsp = self.client.chat.completions.create(
                 model=self.model,
-                messages=[{"role": "user", "content": PROMPT.format(text=text)}],
+                messages=[{"role": "user", "content": PROMPT.replace("{text}", text)}],
                 temperature=0,
             )
             content = rsp.choices[0].message.content.strip()
@@ -32,3 +46,29 @@ class OpenAILLM(LLM):
         except Exception:
             # 失敗時は None（上位で naive_extract にフォールバック可能）
             return None
+
+    def extract_batch(self, texts: List[str]) -> List[Optional[ExtractedSignal]]:
+        """1回のリクエストで複数投稿を抽出する。応答が壊れていれば1件ずつにフォールバック"""
+        if len(texts) <= 1:
+            return [self.extract(t) for t in texts]
+        items = json.dumps([{"id": i, "text": t} for i, t in enumerate(texts)], ensure_ascii=False)
+        try:
+            rsp = self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": BATCH_PROMPT.replace("{items}", items)}],
+                temperature=0,
+            )
+            data = json.loads(rsp.choices[0].message.content.strip())
+        except Exception as e:
+            log.warning("batch extraction failed (%d items), falling back: %s", len(texts), e)
+            return [self.extract(t) for t in texts]
+
+        results: List[Optional[ExtractedSignal]] = [None] * len(texts)
+        for row in data if isinstance(data, list) else []:
+            try:
+                idx = int(row.pop("id"))
+                if 0 <= idx < len(texts) and row.get("ticker"):
+                    results[idx] = ExtractedSignal(**row)
+            except Exception:
+                continue
+        return results
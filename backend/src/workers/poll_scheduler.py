@@ -0,0 +1,171 @@
+"""
+アカウントごとの適応的なポーリング間隔
+
+- 投稿頻度: 新着ツイート数 / 経過秒 の指数移動平均（EWMA）から、1回のポーリングで
+  およそ TARGET_NEW_PER_POLL 件拾える間隔にする（MIN_SEC〜MAX_SEC に丸める）
+- 市場時間: 米国株の通常取引時間外は間隔を OFF_HOURS_FACTOR 倍にする
+- 全体の予算: 全アカウントのリクエストをトークンバケット（BUDGET_PER_MIN）で絞る
+- バックオフ: 429 / 5xx / 通信エラーでは指数バックオフ（full jitter）
+- ラグ: ツイート作成から /signals への送信完了までの時間をアカウント別に記録する
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import datetime, time as dtime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict
+from zoneinfo import ZoneInfo
+
+import httpx
+
+from app.metrics import StageMetrics
+
+log = logging.getLogger(__name__)
+
+MIN_SEC = float(os.getenv("TWITTER_POLL_MIN_SEC", "10"))
+MAX_SEC = float(os.getenv("TWITTER_POLL_MAX_SEC", "300"))
+TARGET_NEW_PER_POLL = float(os.getenv("TWITTER_TARGET_NEW_PER_POLL", "1"))
+RATE_ALPHA = float(os.getenv("TWITTER_RATE_ALPHA", "0.3"))
+OFF_HOURS_FACTOR = float(os.getenv("TWITTER_OFF_HOURS_FACTOR", "3"))
+BUDGET_PER_MIN = float(os.getenv("TWITTER_REQUEST_BUDGET_PER_MIN", "60"))
+BACKOFF_BASE_SEC = float(os.getenv("TWITTER_BACKOFF_BASE_SEC", "15"))
+BACKOFF_MAX_SEC = float(os.getenv("TWITTER_BACKOFF_MAX_SEC", "900"))
+
+_NY = ZoneInfo("America/New_York")
+_SESSION_OPEN = dtime(9, 30)
+_SESSION_CLOSE = dtime(16, 0)
+
+
+def is_us_market_hours(now: datetime | None = None) -> bool:
+    """米国株の通常取引時間（平日 9:30-16:00 ET）か。祝日は考慮しない"""
+    ny = (now or datetime.now(timezone.utc)).astimezone(_NY)
+    return ny.weekday() < 5 and _SESSION_OPEN <= ny.time() < _SESSION_CLOSE
+
+
+def parse_created_at(value: Any) -> datetime | None:
+    """Twitter の created_at（"Wed Oct 10 20:19:24 +0000 2018"）を datetime にする"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%a %b %d %H:%M:%S %z %Y")
+    except (TypeError, ValueError):
+        pass
+    try:
+        return parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """レート制限・サーバーエラー・通信エラーならバックオフ対象"""
+    if isinstance(exc, httpx.TransportError):
+        return True
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    return status == 429 or (status is not None and status >= 500)
+
+
+class TokenBucket:
+    """全アカウント共通のリクエスト予算"""
+
+    def __init__(self, rate_per_sec: float, burst: float):
+        self.rate = rate_per_sec
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+
+class AccountSchedule:
+    def __init__(self, name: str, initial_sec: float):
+        self.name = name
+        self.interval = initial_sec
+        self.rate: float | None = None  # tweets / sec
+        self.failures = 0
+        self.polls = 0
+        self.new_tweets = 0
+        self.last_poll: float | None = None
+        self.lag = StageMetrics()
+
+    def on_success(self, new_count: int) -> None:
+        now = time.monotonic()
+        if self.last_poll is not None:
+            elapsed = max(now - self.last_poll, 1e-3)
+            sample = new_count / elapsed
+            self.rate = sample if self.rate is None else RATE_ALPHA * sample + (1 - RATE_ALPHA) * self.rate
+        self.last_poll = now
+        self.failures = 0
+        self.polls += 1
+        self.new_tweets += new_count
+
+    def on_error(self, exc: BaseException) -> None:
+        if is_retryable(exc):
+            self.failures += 1
+
+    def next_delay(self, now: datetime | None = None) -> float:
+        if self.failures:
+            cap = min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * 2 ** (self.failures - 1))
+            return random.uniform(BACKOFF_BASE_SEC / 2, max(cap, BACKOFF_BASE_SEC / 2))
+        if self.rate is not None:
+            base = TARGET_NEW_PER_POLL / self.rate if self.rate > 0 else MAX_SEC
+            self.interval = min(MAX_SEC, max(MIN_SEC, base))
+        delay = self.interval
+        if not is_us_market_hours(now):
+            delay = min(MAX_SEC, delay * OFF_HOURS_FACTOR)
+        # 同じ間隔のアカウントが同時に取得しないよう ±10% ずらす
+        return delay * random.uniform(0.9, 1.1)
+
+    def record_lag(self, created_at: Any) -> None:
+        created = parse_created_at(created_at)
+        if created is None:
+            return
+        self.lag.observe((datetime.now(timezone.utc) - created).total_seconds() * 1000.0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        lag = self.lag.snapshot()
+        return {
+            "interval_sec": round(self.interval, 1),
+            "rate_per_hour": round(self.rate * 3600, 2) if self.rate is not None else None,
+            "failures": self.failures,
+            "polls": self.polls,
+            "new_tweets": self.new_tweets,
+            "lag_p50_sec": lag["p50_ms"] / 1000.0 if lag["p50_ms"] is not None else None,
+            "lag_p95_sec": lag["p95_ms"] / 1000.0 if lag["p95_ms"] is not None else None,
+        }
+
+
+class PollScheduler:
+    def __init__(self, initial_sec: float, budget_per_min: float = BUDGET_PER_MIN, burst: float = 8):
+        self.initial_sec = initial_sec
+        self.bucket = TokenBucket(budget_per_min / 60.0, burst)
+        self.accounts: Dict[str, AccountSchedule] = {}
+
+    def account(self, name: str) -> AccountSchedule:
+        acc = self.accounts.get(name)
+        if acc is None:
+            acc = self.accounts[name] = AccountSchedule(name, self.initial_sec)
+        return acc
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {name: acc.snapshot() for name, acc in self.accounts.items()}
+
+    def log_summary(self) -> None:
+        for name, s in self.snapshot().items():
+            log.info(
+                f"[schedule] {name}: interval={s['interval_sec']}s rate={s['rate_per_hour']}/h "
+                f"failures={s['failures']} lag_p50={s['lag_p50_sec']}s lag_p95={s['lag_p95_sec']}s"
+            )
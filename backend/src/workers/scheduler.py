@@ -1,9 +1,27 @@
+import logging
+from datetime import timedelta
+
 from apscheduler.schedulers.background import BackgroundScheduler
-from app.db import get_session
+from app.config import settings
+from app.db import get_session, init_db
+from app.market_data import AlpacaBarSource, BarSource, sync_missing_bars
 
+log = logging.getLogger(__name__)
 
 scheduler = BackgroundScheduler()
 
+_bar_source: BarSource | None = None
+
+
+def _get_bar_source() -> BarSource | None:
+    global _bar_source
+    if _bar_source is None and settings.alpaca_api_key and settings.alpaca_secret_key:
+        _bar_source = AlpacaBarSource(
+            api_key=settings.alpaca_api_key,
+            secret_key=settings.alpaca_secret_key,
+        )
+    return _bar_source
+
 
 @scheduler.scheduled_job("interval", minutes=5)
 def manage_positions():
@@ -11,8 +29,28 @@ def manage_positions():
     pass
 
 
+@scheduler.scheduled_job("interval", minutes=settings.bar_sync_interval_min)
+def sync_bars():
+    """BAR_SYNC_SYMBOLS × BAR_SYNC_TIMEFRAMES の最終バー以降だけを取得する。"""
+    if not settings.bar_sync_symbols:
+        return
+    source = _get_bar_source()
+    if source is None:
+        log.warning("bar sync skipped: Alpaca API キーが設定されていません")
+        return
+    results = sync_missing_bars(
+        source,
+        settings.bar_sync_symbols,
+        settings.bar_sync_timeframes,
+        lookback=timedelta(days=settings.bar_sync_lookback_days),
+    )
+    log.info("bar sync: %d chunks, %d new bars", len(results), sum(r.stored for r in results))
+
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    init_db()
     scheduler.start()
     import time
     while True:
-        time.sleep(10)
\ No newline at end of file
+        time.sleep(10)
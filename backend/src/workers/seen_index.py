@@ -0,0 +1,108 @@
+"""
+処理済みツイートのインデックス
+
+ツイート ID（snowflake）は時系列に単調増加するので、投稿者ごとに処理済みの最大 ID
+（high-water mark）を持てば、それ以下の ID は見ずに捨てられる。ID が数値でない場合や
+検索結果のように順序が崩れる場合に備えて、直近の ID を固定長の LRU にも入れておく。
+
+どちらもサイズが投稿者数 + LRU 容量で頭打ちになり、JSON ファイルに一時ファイル経由で
+書き出すので、再起動後も同じツイートを /signals に送り直さない。
+"""
+
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict
+
+log = logging.getLogger(__name__)
+
+SEEN_INDEX_PATH = os.getenv("TWITTER_SEEN_INDEX_PATH", "./data/twitter_seen.json")
+SEEN_INDEX_CAPACITY = int(os.getenv("TWITTER_SEEN_INDEX_CAPACITY", "5000"))
+
+
+class SeenIndex:
+    def __init__(self, path: str | os.PathLike = SEEN_INDEX_PATH, capacity: int = SEEN_INDEX_CAPACITY):
+        self.path = Path(path)
+        self.capacity = capacity
+        self._high_water: Dict[str, int] = {}
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._recent)
+
+    def high_water(self, key: str) -> int | None:
+        return self._high_water.get(key)
+
+    def seen(self, key: str, tweet_id: str) -> bool:
+        """処理済みなら True（記録はしない）"""
+        tweet_id = str(tweet_id)
+        with self._lock:
+            if tweet_id in self._recent:
+                self._recent.move_to_end(tweet_id)
+                return True
+            mark = self._high_water.get(key)
+            return tweet_id.isdigit() and mark is not None and int(tweet_id) <= mark
+
+    def add(self, key: str, tweet_id: str, advance: bool = True) -> None:
+        """
+        処理済みとして記録する。advance=False なら high-water mark は進めない
+        （それより古い ID に未送信のツイートが残っているとき、再起動後に捨てないため）。
+        """
+        tweet_id = str(tweet_id)
+        with self._lock:
+            self._recent[tweet_id] = None
+            self._recent.move_to_end(tweet_id)
+            while len(self._recent) > self.capacity:
+                self._recent.popitem(last=False)
+            mark = self._high_water.get(key)
+            if advance and tweet_id.isdigit() and (mark is None or int(tweet_id) > mark):
+                self._high_water[key] = int(tweet_id)
+            self._dirty = True
+
+    def check_and_add(self, key: str, tweet_id: str) -> bool:
+        """未処理なら記録して True、処理済みなら False を返す"""
+        with self._lock:
+            if self.seen(key, tweet_id):
+                return False
+            self.add(key, tweet_id)
+            return True
+
+    # ------------------------------------------------------------------ #
+    # 永続化
+    # ------------------------------------------------------------------ #
+    def load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text())
+        except Exception as e:
+            log.warning(f"seen index 読み込み失敗: {e}")
+            return
+        with self._lock:
+            self._high_water = {str(k): int(v) for k, v in data.get("high_water", {}).items()}
+            recent = data.get("recent", [])[-self.capacity:]
+            self._recent = OrderedDict((str(t), None) for t in recent)
+            self._dirty = False
+        log.info(f"seen index loaded: {len(self._high_water)} users, {len(self._recent)} recent ids")
+
+    def flush(self) -> None:
+        """変更があればファイルを置き換える"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {"high_water": dict(self._high_water), "recent": list(self._recent)}
+            self._dirty = False
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+            tmp.write_text(json.dumps(data))
+            os.replace(tmp, self.path)
+        except Exception as e:
+            log.warning(f"seen index 書き込み失敗: {e}")
+            with self._lock:
+                self._dirty = True
@@ -0,0 +1,146 @@
+"""
+Twitter GraphQL タイムラインのパーサー
+
+UserTweets / SearchTimeline のレスポンスから、使うフィールド（id, full_text,
+ユーザー, created_at）だけを1回の走査で取り出す。
+
+- デコード済みの dict/list はキーを .get でたどるだけにし、カーソル等の
+  ツイート以外のエントリで KeyError を投げて拾うことをしない
+- 生の bytes/str も受け付ける。prune=True なら object_pairs_hook で必要なキー以外を
+  捨てながらデコードし、entities や views などの大きな部分木を保持しない
+  （ピークメモリは約 1/3 になるが、フックの呼び出し分 CPU は増える。
+  scripts/bench_timeline_parser.py で比較できる）
+
+workers.twitter_poll と scripts/fetch_latest_tweet.py の両方から使う。
+"""
+
+import json
+from typing import Any, Dict, Iterator, List
+
+# タイムラインをたどるのに必要なキーだけ残す
+_KEEP_KEYS = frozenset(
+    {
+        "data",
+        "user",
+        "result",
+        "timeline_v2",
+        "timeline",
+        "search_by_raw_query",
+        "search_timeline",
+        "instructions",
+        "entries",
+        "entry",
+        "content",
+        "itemContent",
+        "items",
+        "item",
+        "tweet_results",
+        "tweet",
+        "__typename",
+        "rest_id",
+        "legacy",
+        "core",
+        "user_results",
+        "full_text",
+        "id_str",
+        "user_id_str",
+        "screen_name",
+        "created_at",
+    }
+)
+_EMPTY: Dict[str, Any] = {}
+
+
+def _prune(pairs: List[tuple]) -> Dict[str, Any]:
+    return {k: v for k, v in pairs if k in _KEEP_KEYS}
+
+
+def loads(raw: bytes | str, prune: bool = False) -> Any:
+    """JSON をデコードする。prune=True なら必要なキーだけを残す"""
+    if prune:
+        return json.loads(raw, object_pairs_hook=_prune)
+    return json.loads(raw)
+
+
+def _instructions(page: Dict[str, Any]) -> List[Dict[str, Any]] | None:
+    data = page.get("data")
+    if not isinstance(data, dict):
+        return None
+    user = data.get("user")
+    if user:
+        timeline = ((user.get("result") or _EMPTY).get("timeline_v2") or _EMPTY).get("timeline") or _EMPTY
+        return timeline.get("instructions")
+    search = data.get("search_by_raw_query")
+    if search:
+        timeline = (search.get("search_timeline") or _EMPTY).get("timeline") or _EMPTY
+        return timeline.get("instructions")
+    return None
+
+
+def _tweet(result: Dict[str, Any], user_legacy: Dict[str, Any] | None = None) -> Dict[str, Any] | None:
+    if result.get("__typename") == "TweetWithVisibilityResults":
+        result = result.get("tweet") or _EMPTY
+    legacy = result.get("legacy") or _EMPTY
+    full_text = legacy.get("full_text")
+    if not full_text:
+        return None
+    rest_id = result.get("rest_id") or legacy.get("id_str") or ""
+    if user_legacy is None:
+        user_legacy = (
+            (((result.get("core") or _EMPTY).get("user_results") or _EMPTY).get("result") or _EMPTY).get("legacy")
+            or _EMPTY
+        )
+    return {
+        "id": rest_id,
+        "text": full_text,
+        "user_id": int(legacy.get("user_id_str") or 0),
+        "username": user_legacy.get("screen_name") or legacy.get("screen_name", ""),
+        "created_at": legacy.get("created_at"),
+        "url": f"https://twitter.com/i/web/status/{rest_id}",
+    }
+
+
+def _entry_results(content: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    item_content = content.get("itemContent")
+    if item_content:
+        result = (item_content.get("tweet_results") or _EMPTY).get("result")
+        if result:
+            yield result
+        return
+    # TimelineTimelineModule（会話スレッドなど）
+    for sub in content.get("items") or ():
+        item_content = (sub.get("item") or _EMPTY).get("itemContent") or _EMPTY
+        result = (item_content.get("tweet_results") or _EMPTY).get("result")
+        if result:
+            yield result
+
+
+def iter_tweets(payload: Any, prune: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    タイムラインのレスポンス（ページのリスト / 単一ページ / 生 JSON）からツイートを順に返す。
+    ツイート単体の結果（legacy を直接持つ dict）が混ざっていてもそのまま拾う。
+    """
+    if isinstance(payload, (bytes, bytearray, str)):
+        payload = loads(payload, prune)
+    pages = payload if isinstance(payload, list) else (payload,)
+    for page in pages:
+        if not isinstance(page, dict):
+            continue
+        instructions = _instructions(page)
+        if instructions is None:
+            result = page.get("result") if "legacy" not in page else page
+            if isinstance(result, dict):
+                tw = _tweet(result, _EMPTY)
+                if tw is not None:
+                    yield tw
+            continue
+        for instr in instructions:
+            entries = instr.get("entries")
+            if entries is None:
+                entry = instr.get("entry")
+                entries = (entry,) if entry else ()
+            for entry in entries:
+                for result in _entry_results(entry.get("content") or _EMPTY):
+                    tw = _tweet(result)
+                    if tw is not None:
+                        yield tw
@@ -0,0 +1,259 @@
+"""
+Alpaca trade_updates ストリームのコンシューマ
+
+WebSocket で約定・一部約定・取消などのイベントを受け取り、Order / Execution / Position に
+逐次反映する。受信とDB書き込みはキューで切り離し、書き込み側は短い間隔で溜まった
+イベントを1トランザクションでまとめて反映する。REST での注文状態のポーリングは不要になる。
+
+注文は Order.broker_order_id で突き合わせる。発注直後はパイプラインが Order を保存する前に
+イベントが届くことがあるので、見つからないイベントはしばらく保留して再試行し、
+それでも無ければ、約定イベントに限りアプリ外で出された注文として Order を作る
+（受付・取消などの約定以外のイベントは建玉に影響しないので捨てる）。
+
+TRADE_UPDATES_URL を指定するとその WebSocket サーバーに接続する
+（scripts/fake_trade_updates_server.py での動作確認用）。
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+import websockets
+from sqlmodel import select
+
+from app.broker_state import broker_state
+from app.config import settings
+from app.db import get_session, init_db
+from app.models import Execution, Order
+from app.positions import apply_fill
+from broker.alpaca_client import _STATUS_MAP
+
+logging.basicConfig(level=logging.INFO, format='[trade_updates] %(message)s')
+log = logging.getLogger(__name__)
+
+PAPER_STREAM_URL = "wss://paper-api.alpaca.markets/stream"
+LIVE_STREAM_URL = "wss://api.alpaca.markets/stream"
+
+FILL_EVENTS = {"fill", "partial_fill"}
+# 二重適用を防ぐために覚えておく execution_id の件数（再接続時の重複配信対策）
+SEEN_EXECUTIONS = 10000
+
+
+def _parse_ts(value: Any) -> datetime:
+    if not value:
+        return datetime.utcnow()
+    try:
+        ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return datetime.utcnow()
+    if ts.tzinfo is not None:
+        ts = datetime.utcfromtimestamp(ts.timestamp())
+    return ts
+
+
+class TradeUpdateApplier:
+    """trade_updates のイベントをまとめて DB に反映する"""
+
+    def __init__(self, orphan_sec: float):
+        self.orphan_sec = orphan_sec
+        self._pending: List[Tuple[float, Dict[str, Any]]] = []
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self.applied = 0
+        self.created = 0
+        self.dropped = 0
+
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    def _remember(self, exec_ids: List[str]) -> None:
+        for exec_id in exec_ids:
+            self._seen[exec_id] = None
+        while len(self._seen) > SEEN_EXECUTIONS:
+            self._seen.popitem(last=False)
+
+    def apply(self, events: List[Dict[str, Any]]) -> int:
+        """保留中のものも含めて1トランザクションで反映し、反映した件数を返す"""
+        now = time.monotonic()
+        batch = self._pending + [(now, e) for e in events]
+        self._pending = []
+        ids = {str(e["order"]["id"]) for _, e in batch}
+        applied = 0
+        exec_ids: List[str] = []
+        try:
+            with get_session() as s:
+                orders = {
+                    o.broker_order_id: o
+                    for o in s.exec(select(Order).where(Order.broker_order_id.in_(ids))).all()
+                }
+                for received, event in batch:
+                    data = event["order"]
+                    order = orders.get(str(data["id"]))
+                    if order is None:
+                        if now - received < self.orphan_sec:
+                            self._pending.append((received, event))
+                            continue
+                        if event.get("event") not in FILL_EVENTS or not data.get("symbol"):
+                            log.info("dropping %s event for unknown order %s", event.get("event"), data["id"])
+                            self.dropped += 1
+                            continue
+                        order = self._create_order(s, data)
+                        orders[order.broker_order_id] = order
+                    self._apply_event(s, order, event, exec_ids)
+                    applied += 1
+                s.commit()
+        except Exception:
+            # 失敗したバッチは丸ごと次回に持ち越す
+            self._pending = batch
+            raise
+        self._remember(exec_ids)
+        self.applied += applied
+        return applied
+
+    def _create_order(self, s, data: Dict[str, Any]) -> Order:
+        log.info("order %s not found locally, recording it as an external order", data["id"])
+        order = Order(
+            broker="alpaca",
+            ticker=data["symbol"],
+            side=str(data["side"]).upper(),
+            qty=float(data.get("qty") or 0.0),
+            price=float(data["limit_price"]) if data.get("limit_price") else None,
+            broker_order_id=str(data["id"]),
+        )
+        s.add(order)
+        s.flush()
+        self.created += 1
+        return order
+
+    def _apply_event(self, s, order: Order, event: Dict[str, Any], exec_ids: List[str]) -> None:
+        data = event["order"]
+        status = str(data.get("status") or event.get("event", ""))
+        order.status = _STATUS_MAP.get(status.lower(), status.upper())
+        if data.get("filled_avg_price"):
+            order.price = float(data["filled_avg_price"])
+        if event.get("event") in ("rejected", "canceled", "expired") and data.get("reject_reason"):
+            order.reason = data["reject_reason"]
+        s.add(order)
+        exec_id = event.get("execution_id")
+        if event.get("event") not in FILL_EVENTS or exec_id in self._seen or exec_id in exec_ids:
+            return
+        if exec_id:
+            exec_ids.append(exec_id)
+        qty = float(event.get("qty") or 0.0)
+        price = float(event.get("price") or 0.0)
+        if qty <= 0 or price <= 0:
+            return
+        s.add(Execution(
+            order_id=order.id,
+            ticker=order.ticker,
+            side=order.side,
+            qty=qty,
+            price=price,
+            executed_at=_parse_ts(event.get("timestamp")),
+        ))
+        apply_fill(s, order.ticker, order.side, qty, price)
+
+
+class TradeUpdatesConsumer:
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        secret: str,
+        batch_max: int = 200,
+        flush_ms: float = 20.0,
+        orphan_sec: float = 10.0,
+    ):
+        self.url = url
+        self.key = key
+        self.secret = secret
+        self.batch_max = batch_max
+        self.flush_sec = flush_ms / 1000.0
+        self.applier = TradeUpdateApplier(orphan_sec)
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+
+    async def run(self) -> None:
+        writer = asyncio.create_task(self._write_loop())
+        try:
+            await self._read_loop()
+        finally:
+            writer.cancel()
+
+    async def _read_loop(self) -> None:
+        backoff = 1.0
+        while True:
+            try:
+                async with websockets.connect(self.url, ping_interval=20) as ws:
+                    await self._authenticate(ws)
+                    log.info("listening for trade updates on %s", self.url)
+                    backoff = 1.0
+                    async for raw in ws:
+                        msg = json.loads(raw)
+                        if msg.get("stream") == "trade_updates":
+                            self._queue.put_nowait(msg["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("trade updates stream disconnected: %s (retry in %.0fs)", e, backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+
+    async def _authenticate(self, ws) -> None:
+        await ws.send(json.dumps({"action": "auth", "key": self.key, "secret": self.secret}))
+        reply = json.loads(await ws.recv())
+        status = reply.get("data", {}).get("status")
+        if status != "authorized":
+            raise RuntimeError(f"trade updates authentication failed: {reply}")
+        await ws.send(json.dumps({"action": "listen", "data": {"streams": ["trade_updates"]}}))
+
+    async def _write_loop(self) -> None:
+        while True:
+            try:
+                first = await asyncio.wait_for(self._queue.get(), timeout=1.0)
+                events = [first]
+            except asyncio.TimeoutError:
+                events = []
+            if events:
+                # 少しだけ待って同時に届いたイベントを同じトランザクションにまとめる
+                deadline = time.monotonic() + self.flush_sec
+                while len(events) < self.batch_max:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        events.append(await asyncio.wait_for(self._queue.get(), timeout=timeout))
+                    except asyncio.TimeoutError:
+                        break
+            if not events and not self.applier.has_pending:
+                continue
+            try:
+                applied = await asyncio.to_thread(self.applier.apply, events)
+            except Exception as e:  # pragma: no cover - defensive logging
+                log.exception("failed to apply %d trade updates: %s", len(events), e)
+                continue
+            if applied:
+                # API 側の建玉・口座キャッシュを共有ファイル経由で無効化する
+                broker_state.invalidate()
+                log.info("applied %d trade updates", applied)
+
+
+def run() -> None:
+    init_db()
+    url = settings.trade_updates_url or (PAPER_STREAM_URL if settings.alpaca_paper else LIVE_STREAM_URL)
+    consumer = TradeUpdatesConsumer(
+        url,
+        settings.alpaca_api_key,
+        settings.alpaca_secret_key,
+        batch_max=settings.trade_updates_batch_max,
+        flush_ms=settings.trade_updates_flush_ms,
+        orphan_sec=settings.trade_updates_orphan_sec,
+    )
+    asyncio.run(consumer.run())
+
+
+if __name__ == "__main__":
+    run()
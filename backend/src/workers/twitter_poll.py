@@ -1,17 +1,34 @@
+"""
+Twitter タイムラインのポーリングワーカー
+
+asyncio 上でユーザーごとに独立したポーリングタスクを動かし、タイムライン取得
+（同期の Scraper はスレッドに逃がす）と API への送信をキューで切り離す。
+API が遅くても取得側は止まらず、送信は keep-alive 付きの httpx.AsyncClient で行う。
+
+TWITTER_TIMELINE_URL を指定すると Scraper の代わりにその HTTP サーバーから
+タイムラインを取得する（ローカルのフェイクサーバーでの動作確認用）。
+"""
+
+import asyncio
 import os
-import time
+import random
 import logging
-from typing import Iterable, Dict, Any, List, Set
+from typing import Iterable, Dict, Any, List
 
-import requests
+import httpx
 from twitter.scraper import Scraper  # pip: twitter-api-client
 
 from app.utils import naive_extract
+from app.universe import symbol_universe
 from app.cookie_store import load_cookies, get_version, save_cookies
+from workers.poll_scheduler import BACKOFF_BASE_SEC, BACKOFF_MAX_SEC, PollScheduler
+from workers.seen_index import SeenIndex
+from workers.timeline_parser import iter_tweets
 from workers.twitter_auth_helper import get_twitter_cookies, refresh_cookies, validate_cookies
 
 logging.basicConfig(level=logging.INFO, format='[twitter_worker] %(message)s')
 log = logging.getLogger(__name__)
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 # cookie_store 経由で読み込み（API / ファイル / 環境変数）
 X_AUTH_TOKEN, X_CT0 = load_cookies()
@@ -23,6 +40,17 @@ if not X_AUTH_TOKEN or not X_CT0:
 
 POLL_SEC = int(os.getenv("POLL_INTERVAL_SEC", "30"))
 API_BASE = os.getenv("API_BASE_URL", "http://api:8000")
+# 同時に実行するタイムライン取得数と、API への同時送信数（= keep-alive 接続数）
+FETCH_CONCURRENCY = int(os.getenv("TWITTER_FETCH_CONCURRENCY", "8"))
+POST_CONCURRENCY = int(os.getenv("TWITTER_POST_CONCURRENCY", "4"))
+POST_QUEUE_SIZE = int(os.getenv("TWITTER_POST_QUEUE_SIZE", "1000"))
+POST_BATCH_MAX = int(os.getenv("TWITTER_POST_BATCH_MAX", "20"))
+TIMELINE_URL = os.getenv("TWITTER_TIMELINE_URL", "").rstrip("/")
+# 処理済みインデックスをファイルに書き出す間隔
+SEEN_FLUSH_SEC = float(os.getenv("TWITTER_SEEN_FLUSH_SEC", "5"))
+# アカウント別の間隔・ラグをログに出す間隔
+STATS_LOG_SEC = float(os.getenv("TWITTER_STATS_LOG_SEC", "300"))
+MAX_ERRORS_BEFORE_REFRESH = 3
 
 USERS = [u.strip() for u in os.getenv("TWITTER_USERS", "").split(",") if u.strip()]
 QUERY = os.getenv("TWITTER_QUERY", "").strip()
@@ -53,95 +81,14 @@ def resolve_user_ids(usernames: List[str]) -> Dict[str, int]:
     return mapping
 
 
-def _parse_tweet_result(tweet_result: Dict) -> Iterable[Dict[str, Any]]:
-    if not tweet_result:
-        return
-    if tweet_result.get("__typename") == "TweetWithVisibilityResults":
-        tweet_result = tweet_result.get("tweet", tweet_result)
-    legacy = tweet_result.get("legacy", {})
-    full_text = legacy.get("full_text", "")
-    if not full_text:
-        return
-    rest_id = tweet_result.get("rest_id", "")
-    core = tweet_result.get("core", {})
-    user_legacy = core.get("user_results", {}).get("result", {}).get("legacy", {})
-    yield {
-        "id": rest_id,
-        "text": full_text,
-        "user_id": int(legacy.get("user_id_str", 0)),
-        "username": user_legacy.get("screen_name", legacy.get("screen_name", "")),
-        "created_at": legacy.get("created_at"),
-        "url": f"https://twitter.com/i/web/status/{rest_id}",
-    }
-
-
-def _extract_tweets_from_timeline(raw: List[Dict]) -> Iterable[Dict[str, Any]]:
-    for item in raw:
-        instructions = []
-        try:
-            instructions = item["data"]["user"]["result"]["timeline_v2"]["timeline"]["instructions"]
-        except (KeyError, TypeError):
-            pass
-        if not instructions:
-            try:
-                instructions = item["data"]["search_by_raw_query"]["search_timeline"]["timeline"]["instructions"]
-            except (KeyError, TypeError):
-                pass
-        if not instructions:
-            legacy = item.get("legacy") or item.get("result", {}).get("legacy", {})
-            if legacy and legacy.get("full_text"):
-                rest_id = item.get("rest_id") or item.get("result", {}).get("rest_id", "")
-                yield {
-                    "id": rest_id,
-                    "text": legacy.get("full_text", ""),
-                    "user_id": int(legacy.get("user_id_str", 0)),
-                    "username": legacy.get("screen_name", ""),
-                    "created_at": legacy.get("created_at"),
-                    "url": f"https://twitter.com/i/web/status/{rest_id}",
-                }
-            continue
-
-        for instr in instructions:
-            entries = instr.get("entries") or []
-            for entry in entries:
-                content = entry.get("content", {})
-                tweet_result = None
-                try:
-                    tweet_result = content["itemContent"]["tweet_results"]["result"]
-                except (KeyError, TypeError):
-                    pass
-                if tweet_result is not None:
-                    yield from _parse_tweet_result(tweet_result)
-                    continue
-                for sub_item in content.get("items", []):
-                    try:
-                        tweet_result = sub_item["item"]["itemContent"]["tweet_results"]["result"]
-                    except (KeyError, TypeError):
-                        continue
-                    yield from _parse_tweet_result(tweet_result)
-
-
 def fetch_user_tweets(user_ids: Iterable[int]) -> Iterable[Dict[str, Any]]:
     raw = scraper.tweets(list(user_ids))
-    yield from _extract_tweets_from_timeline(raw)
+    yield from iter_tweets(raw)
 
 
 def fetch_search(query: str) -> Iterable[Dict[str, Any]]:
     raw = scraper.search(query)
-    yield from _extract_tweets_from_timeline(raw)
-
-
-def post_signal(text: str, meta: Dict[str, Any]) -> None:
-    try:
-        r = requests.post(
-            f"{API_BASE}/signals",
-            json={"text": text, "source": "twitter", "meta": meta},
-            timeout=5,
-        )
-        r.raise_for_status()
-        log.info(f"-> posted to API: {meta.get('url')}")
-    except Exception as e:
-        log.warning(f"API post failed: {e}")
+    yield from iter_tweets(raw)
 
 
 def _reload_scraper_if_needed() -> bool:
@@ -158,74 +105,307 @@ def _reload_scraper_if_needed() -> bool:
     return True
 
 
-def main() -> None:
+def _refresh_cookies_after_errors() -> bool:
+    """エラーが続いたときに Cookie を再取得して scraper を作り直す"""
     global scraper, X_AUTH_TOKEN, X_CT0
+    log.info("エラーが続いています。Cookie を再チェック...")
+    if _reload_scraper_if_needed():
+        return True
+    if refresh_cookies():
+        X_AUTH_TOKEN, X_CT0 = get_twitter_cookies(auto_refresh=False)
+        if X_AUTH_TOKEN and X_CT0:
+            save_cookies(X_AUTH_TOKEN, X_CT0)
+            scraper = Scraper(cookies={"auth_token": X_AUTH_TOKEN, "ct0": X_CT0})
+            log.info("Cookie を更新しました")
+            return True
+        log.error("Cookie の更新に失敗")
+    return False
+
+
+# ---------------------------------------------------------------------- #
+# タイムラインソース
+# ---------------------------------------------------------------------- #
+class ScraperTimelineSource:
+    """twitter-api-client の Scraper（同期）をスレッドで呼ぶ"""
+
+    uses_cookies = True
+
+    def ready(self) -> bool:
+        return scraper is not None
+
+    async def users(self, usernames: List[str]) -> Dict[str, int]:
+        return await asyncio.to_thread(resolve_user_ids, usernames)
+
+    async def user_tweets(self, user_id: int) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(lambda: list(fetch_user_tweets([user_id])))
+
+    async def search(self, query: str) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(lambda: list(fetch_search(query)))
 
-    if not USERS and not QUERY:
-        raise SystemExit("TWITTER_USERS or TWITTER_QUERY must be set in .env")
 
-    seen: Set[str] = set()
-    user_ids: Dict[str, int] = {}
-    consecutive_errors = 0
-    max_errors_before_refresh = 3
+class HttpTimelineSource:
+    """
+    Scraper と同じ形の JSON を返す HTTP サーバーから取得する。
 
-    while True:
-        # ダッシュボードから Cookie が更新されたかチェック
-        if _reload_scraper_if_needed():
-            user_ids = resolve_user_ids(USERS) if USERS else {}
-            consecutive_errors = 0
+    GET /users?names=a,b       -> scraper.users と同じ形のリスト
+    GET /timeline/{user_id}    -> scraper.tweets と同じ形のリスト
+    GET /search?q=...          -> scraper.search と同じ形のリスト
+    """
 
-        if scraper is None:
-            log.info("Cookie 未設定。ダッシュボード /dashboard から設定してください。%ds 後にリトライ...", POLL_SEC)
-            time.sleep(POLL_SEC)
-            continue
+    uses_cookies = False
 
-        if not user_ids and USERS:
-            user_ids = resolve_user_ids(USERS)
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
 
+    def ready(self) -> bool:
+        return True
+
+    async def users(self, usernames: List[str]) -> Dict[str, int]:
+        r = await self.client.get("/users", params={"names": ",".join(usernames)})
+        r.raise_for_status()
+        mapping: Dict[str, int] = {}
+        for item in r.json():
+            result = item["data"]["user"]["result"]
+            mapping[result["legacy"]["screen_name"]] = int(result["rest_id"])
+        return mapping
+
+    async def user_tweets(self, user_id: int) -> List[Dict[str, Any]]:
+        r = await self.client.get(f"/timeline/{user_id}")
+        r.raise_for_status()
+        return list(iter_tweets(r.content))
+
+    async def search(self, query: str) -> List[Dict[str, Any]]:
+        r = await self.client.get("/search", params={"q": query})
+        r.raise_for_status()
+        return list(iter_tweets(r.content))
+
+
+# ---------------------------------------------------------------------- #
+# ポーリング
+# ---------------------------------------------------------------------- #
+def _id_order(tw: Dict[str, Any]) -> int:
+    """snowflake ID の昇順に並べるためのキー（数値でない ID は先頭に寄せる）"""
+    tweet_id = str(tw.get("id", ""))
+    return int(tweet_id) if tweet_id.isdigit() else -1
+
+
+class TwitterPoller:
+    def __init__(
+        self,
+        source: Any,
+        api: httpx.AsyncClient,
+        poll_sec: float = POLL_SEC,
+        fetch_concurrency: int = FETCH_CONCURRENCY,
+        post_concurrency: int = POST_CONCURRENCY,
+        seen: SeenIndex | None = None,
+        scheduler: PollScheduler | None = None,
+    ):
+        self.source = source
+        self.api = api
+        self.poll_sec = poll_sec
+        self.post_concurrency = post_concurrency
+        self.user_ids: Dict[str, int] = {}
+        self.seen = seen if seen is not None else SeenIndex()
+        self.scheduler = scheduler if scheduler is not None else PollScheduler(poll_sec, burst=fetch_concurrency)
+        self.consecutive_errors = 0
+        self._fetch_sem = asyncio.Semaphore(fetch_concurrency)
+        # (アカウント名, 投稿者, ツイート)
+        self._posts: "asyncio.Queue[tuple[str, str, Dict[str, Any]]]" = asyncio.Queue(maxsize=POST_QUEUE_SIZE)
+        # 投稿者 -> {未送信のツイート ID: キュー・送信中なら True / 送信失敗で次のポーリング待ちなら False}。
+        # 送信が成功するまで seen には入れず、これより新しい ID でも high-water mark を進めない
+        self._unsent: Dict[str, Dict[str, bool]] = {}
+
+    async def run(self, usernames: List[str], query: str = "") -> None:
+        while not self.source.ready():
+            log.info("Cookie 未設定。ダッシュボード /dashboard から設定してください。%ds 後にリトライ...", self.poll_sec)
+            await asyncio.sleep(self.poll_sec)
+            await asyncio.to_thread(_reload_scraper_if_needed)
+
+        tasks = [asyncio.create_task(self._post_loop(), name=f"post-{i}") for i in range(self.post_concurrency)]
+        tasks.append(asyncio.create_task(self._flush_loop(), name="seen-flush"))
+        tasks.append(asyncio.create_task(self._stats_loop(), name="stats"))
+        if self.source.uses_cookies:
+            tasks.append(asyncio.create_task(self._maintain_loop(usernames), name="maintain"))
+        if usernames:
+            await self._resolve(usernames)
+            for name in usernames:
+                tasks.append(asyncio.create_task(self._user_loop(name), name=f"user-{name}"))
+        else:
+            tasks.append(asyncio.create_task(self._search_loop(query), name="search"))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for t in tasks:
+                t.cancel()
+            self.seen.flush()
+
+    async def _resolve(self, usernames: List[str]) -> None:
+        try:
+            self.user_ids.update(await self.source.users(usernames))
+        except Exception as e:
+            log.warning(f"resolve users failed: {e}")
+
+    # -- 取得 ---------------------------------------------------------- #
+    async def _user_loop(self, name: str) -> None:
+        # 開始時刻をずらして、全ユーザーの取得が同じ瞬間に集中しないようにする
+        await asyncio.sleep(random.uniform(0, self.poll_sec))
+        account = self.scheduler.account(name)
+        failures = 0
+        while True:
+            user_id = self.user_ids.get(name)
+            if user_id is None:
+                # 起動時に解決できなかったユーザーはバックオフしながら解決し直す
+                await self._resolve([name])
+                user_id = self.user_ids.get(name)
+            if user_id is None:
+                failures += 1
+                delay = min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * 2 ** (failures - 1))
+                log.warning(f"user {name} not resolved, retrying in {delay:.1f}s")
+                await asyncio.sleep(random.uniform(delay / 2, delay))
+                continue
+            failures = 0
+            await self._poll(account, self.source.user_tweets, user_id)
+            await asyncio.sleep(account.next_delay())
+
+    async def _search_loop(self, query: str) -> None:
+        account = self.scheduler.account("search")
+        while True:
+            await self._poll(account, self.source.search, query)
+            await asyncio.sleep(account.next_delay())
+
+    async def _poll(self, account, fetch, arg) -> None:
+        await self.scheduler.bucket.acquire()
         try:
-            items: Iterable[Dict[str, Any]]
-            if user_ids:
-                items = fetch_user_tweets(user_ids.values())
-            else:
-                items = fetch_search(QUERY)
-
-            for tw in items:
-                tid = str(tw["id"])
-                if tid in seen:
-                    continue
-                seen.add(tid)
-
-                text = tw["text"]
-                parsed = naive_extract(text)
-                log.info(f"[tweet] {tw['username']}: {text}")
-                if parsed:
-                    log.info(f"  parsed: {parsed}")
-                    post_signal(text, tw)
-
-            consecutive_errors = 0
+            async with self._fetch_sem:
+                items = await fetch(arg)
+        except Exception as e:
+            log.warning(f"poll error ({account.name}): {e}")
+            account.on_error(e)
+            self.consecutive_errors += 1
+            return
+        self.consecutive_errors = 0
+        # タイムラインは新しい順（固定ツイートが先頭）なので、ID の古い順に並べてから
+        # high-water mark に通す。そうしないと最新の1件で mark が進み残りを捨ててしまう
+        items = sorted(items, key=_id_order)
+        new_count = sum(self._handle(account.name, tw) for tw in items)
+        account.on_success(new_count)
+
+    def _handle(self, account: str, tw: Dict[str, Any]) -> bool:
+        """未処理のツイートなら True（シグナルでなくても新着として数える）"""
+        # 投稿者ごとの high-water mark で、前回までに処理したツイートを捨てる
+        author = str(tw.get("user_id") or tw.get("username") or "")
+        tweet_id = str(tw["id"])
+        unsent = self._unsent.setdefault(author, {})
+        if unsent.get(tweet_id) or self.seen.seen(author, tweet_id):
+            return False
+
+        text = tw["text"]
+        parsed = naive_extract(text)
+        log.info(f"[tweet] {tw['username']}: {text}")
+        if not parsed:
+            self.seen.add(author, tweet_id, advance=self._can_advance(author, tweet_id))
+            return True
+        log.info(f"  parsed: {parsed}")
+        try:
+            self._posts.put_nowait((account, author, tw))
+        except asyncio.QueueFull:
+            # seen に入れていないので次のポーリングで拾い直す
+            log.warning(f"post queue full, retrying on next poll: {tw.get('url')}")
+            unsent[tweet_id] = False
+            return True
+        unsent[tweet_id] = True
+        return True
+
+    def _can_advance(self, author: str, tweet_id: str) -> bool:
+        """これより古い未送信のツイートが無ければ high-water mark を進めてよい"""
+        if not tweet_id.isdigit():
+            return False
+        return not any(
+            other.isdigit() and int(other) < int(tweet_id)
+            for other in self._unsent.get(author, {})
+            if other != tweet_id
+        )
 
+    # -- 送信 ---------------------------------------------------------- #
+    async def _post_loop(self) -> None:
+        while True:
+            # 1回のポーリングで入った分はまとめて /signals/batch に送る
+            batch = [await self._posts.get()]
+            while len(batch) < POST_BATCH_MAX and not self._posts.empty():
+                batch.append(self._posts.get_nowait())
+            try:
+                posted = await self.post_signals([tw for _, _, tw in batch])
+                for account, author, tw in batch:
+                    tweet_id = str(tw["id"])
+                    unsent = self._unsent.setdefault(author, {})
+                    if not posted:
+                        # 次のポーリングで同じツイートを拾って送り直す
+                        unsent[tweet_id] = False
+                        continue
+                    unsent.pop(tweet_id, None)
+                    self.seen.add(author, tweet_id, advance=self._can_advance(author, tweet_id))
+                    self.scheduler.account(account).record_lag(tw.get("created_at"))
+            finally:
+                for _ in batch:
+                    self._posts.task_done()
+
+    async def post_signals(self, tweets: List[Dict[str, Any]]) -> bool:
+        items = [{"text": tw["text"], "source": "twitter", "meta": tw} for tw in tweets]
+        try:
+            r = await self.api.post("/signals/batch", json={"items": items})
+            r.raise_for_status()
+            for tw, result in zip(tweets, r.json().get("results", [])):
+                log.info(f"-> posted to API ({result.get('status')}): {tw.get('url')}")
+            return True
         except Exception as e:
-            log.warning(f"loop error: {e}")
-            consecutive_errors += 1
-
-            if consecutive_errors >= max_errors_before_refresh:
-                log.info("エラーが続いています。Cookie を再チェック...")
-                if _reload_scraper_if_needed():
-                    user_ids = resolve_user_ids(USERS) if USERS else {}
-                    consecutive_errors = 0
-                elif refresh_cookies():
-                    X_AUTH_TOKEN, X_CT0 = get_twitter_cookies(auto_refresh=False)
-                    if X_AUTH_TOKEN and X_CT0:
-                        save_cookies(X_AUTH_TOKEN, X_CT0)
-                        scraper = Scraper(cookies={"auth_token": X_AUTH_TOKEN, "ct0": X_CT0})
-                        user_ids = resolve_user_ids(USERS) if USERS else {}
-                        consecutive_errors = 0
-                        log.info("Cookie を更新しました")
-                    else:
-                        log.error("Cookie の更新に失敗")
-
-        time.sleep(POLL_SEC)
+            log.warning(f"API post failed ({len(tweets)} tweets): {e}")
+            return False
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(SEEN_FLUSH_SEC)
+            await asyncio.to_thread(self.seen.flush)
+
+    async def _stats_loop(self) -> None:
+        while True:
+            await asyncio.sleep(STATS_LOG_SEC)
+            self.scheduler.log_summary()
+
+    # -- Cookie 監視 ---------------------------------------------------- #
+    async def _maintain_loop(self, usernames: List[str]) -> None:
+        while True:
+            await asyncio.sleep(self.poll_sec)
+            # ダッシュボードから Cookie が更新されたかチェック
+            reloaded = await asyncio.to_thread(_reload_scraper_if_needed)
+            if not reloaded and self.consecutive_errors >= MAX_ERRORS_BEFORE_REFRESH:
+                reloaded = await asyncio.to_thread(_refresh_cookies_after_errors)
+            if reloaded:
+                self.consecutive_errors = 0
+                if usernames:
+                    await self._resolve(usernames)
+
+
+def _api_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(max_connections=POST_CONCURRENCY, max_keepalive_connections=POST_CONCURRENCY)
+    return httpx.AsyncClient(base_url=API_BASE, timeout=5, limits=limits)
+
+
+async def run() -> None:
+    symbol_universe.load()
+    seen = SeenIndex()
+    seen.load()
+    async with _api_client() as api:
+        if TIMELINE_URL:
+            async with httpx.AsyncClient(base_url=TIMELINE_URL, timeout=10) as tl:
+                await TwitterPoller(HttpTimelineSource(tl), api, seen=seen).run(USERS, QUERY)
+        else:
+            await TwitterPoller(ScraperTimelineSource(), api, seen=seen).run(USERS, QUERY)
+
+
+def main() -> None:
+    if not USERS and not QUERY:
+        raise SystemExit("TWITTER_USERS or TWITTER_QUERY must be set in .env")
+    asyncio.run(run())
 
 
 if __name__ == "__main__":
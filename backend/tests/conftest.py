@@ -0,0 +1,65 @@
+"""
+テスト共通の設定
+
+app.config は import 時に環境変数を読むので、app を import する前に
+DB・バーストア・共有ファイルの置き場所を一時ディレクトリに向ける。
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+BACKEND = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(BACKEND / "src"), str(BACKEND / "scripts")]
+
+_TMP = Path(tempfile.mkdtemp(prefix="trader-tests-"))
+os.environ.update(
+    {
+        "DATABASE_URL": f"sqlite:///{_TMP / 'trader.db'}",
+        "BAR_STORE_DIR": str(_TMP / "bars"),
+        "BROKER_STATE_PATH": str(_TMP / "broker_state.json"),
+        "COOKIE_STORE_PATH": str(_TMP / "cookies.json"),
+        "SYMBOL_UNIVERSE_PATH": str(_TMP / "no-symbols.txt"),
+        "LLM_CACHE_ENABLED": "false",
+        "RISK_RECONCILE_INTERVAL_SEC": "0",
+        "AUTO_TRADE_ENABLED": "false",
+    }
+)
+
+
+@pytest.fixture
+def db():
+    """空のテーブルを用意する（テストごとに作り直す）"""
+    import app.models  # noqa: F401 - テーブル定義を登録する
+    from app.db import engine, init_db
+    from sqlmodel import SQLModel
+
+    from app.dedup import dedup_index
+
+    SQLModel.metadata.drop_all(engine)
+    init_db()
+    dedup_index.forget(list(dedup_index._recent))
+    yield engine
+
+
+@pytest.fixture
+def serve():
+    """scripts/fake_*_server.py のハンドラを空きポートで起動し、ベース URL を返す"""
+    import threading
+    from http.server import ThreadingHTTPServer
+
+    servers = []
+
+    def start(handler) -> str:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,53 @@
+"""AsyncAlpacaBroker を scripts/fake_alpaca_server.py に向けて、再送で二重発注・二重計上しないことを見る"""
+
+import asyncio
+
+import pytest
+
+import fake_alpaca_server
+from broker.alpaca_async import AsyncAlpacaBroker
+
+
+@pytest.fixture
+def alpaca(serve):
+    def start(lost_reply_rate: float = 0.0):
+        fake = fake_alpaca_server.FakeAlpaca(price=10.0)
+        url = serve(fake_alpaca_server.make_handler(fake, 0.0, 0.0, lost_reply_rate))
+        broker = AsyncAlpacaBroker("key", "secret", base_url=url, backoff=0.0)
+        fills = []
+        broker.notify_fill = lambda *args: fills.append(args)
+        return fake, broker, fills
+
+    return start
+
+
+def place(broker, client_order_id: str):
+    async def run():
+        try:
+            return await broker.place_order("AAPL", "BUY", 2, order_type="market", client_order_id=client_order_id)
+        finally:
+            await broker.aclose()
+
+    return asyncio.run(run())
+
+
+def test_lost_reply_is_resolved_without_a_second_order(alpaca):
+    fake, broker, fills = alpaca(lost_reply_rate=1.0)
+    result = place(broker, "job-1")
+    assert result["status"] == "FILLED"
+    assert result["client_order_id"] == "job-1"
+    assert len(fake.orders) == 1
+    assert fake.positions["AAPL"]["qty"] == 2
+    assert fills == [("AAPL", "BUY", 2.0, 10.0)]
+
+
+def test_duplicate_from_previous_process_is_adopted(alpaca):
+    fake, broker, fills = alpaca()
+    # 再起動前に送信済み（リスク台帳はその後のポジションから読み込まれている）
+    status, existing = fake.submit({"symbol": "AAPL", "side": "buy", "type": "market", "qty": "2", "client_order_id": "job-2"})
+    assert status == 200
+
+    result = place(broker, "job-2")
+    assert result["order_id"] == existing["id"]
+    assert len(fake.orders) == 1
+    assert fills == []
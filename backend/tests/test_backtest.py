@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from app.backtest import _sma, simulate_sma_crossover
+
+
+def _loop_sma(values, window):
+    out, acc = [], 0.0
+    for i, v in enumerate(values):
+        acc += v
+        if i >= window:
+            acc -= values[i - window]
+        out.append(None if i + 1 < window else acc / window)
+    return out
+
+
+def _loop_backtest(opens, closes, short_window, long_window, initial_equity):
+    """ベクトル化前の run_sma_crossover のループ（比較用にバーの配列で受ける）"""
+    short_sma = _loop_sma(closes, short_window)
+    long_sma = _loop_sma(closes, long_window)
+    in_position, entry_price = False, 0.0
+    equity = peak = initial_equity
+    max_dd_pct = 0.0
+    trades = []
+    for i in range(1, len(closes)):
+        vals = (short_sma[i - 1], long_sma[i - 1], short_sma[i], long_sma[i])
+        if any(v is None for v in vals):
+            continue
+        prev_diff = vals[0] - vals[1]
+        cur_diff = vals[2] - vals[3]
+        price = opens[i]
+        if not in_position and prev_diff <= 0 < cur_diff:
+            in_position, entry_price, entry_i = True, price, i
+            continue
+        if in_position and prev_diff >= 0 > cur_diff:
+            in_position = False
+            trade_pnl = (price - entry_price) * (equity / entry_price)
+            equity += trade_pnl
+            trades.append((entry_i, i, trade_pnl))
+        peak = max(peak, equity)
+        if peak > 0:
+            max_dd_pct = min(max_dd_pct, (equity - peak) / peak * 100.0)
+    return trades, equity, max_dd_pct
+
+
+def _series(kind, n, seed):
+    rng = np.random.default_rng(seed)
+    if kind == "flat":
+        return np.full(n, 123.45)
+    if kind == "tick":
+        # 0.01 刻みに丸めた値動き（横ばいが続き SMA 差がちょうど 0 になりやすい）
+        return np.round(100 + np.cumsum(rng.choice([-0.01, 0.0, 0.0, 0.01], n)), 2)
+    return 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+
+
+@pytest.mark.parametrize("window", [1, 3, 20])
+def test_sma_matches_loop_bitwise(window):
+    closes = _series("tick", 5000, 1)
+    expected = np.array([np.nan if v is None else v for v in _loop_sma(closes.tolist(), window)])
+    np.testing.assert_array_equal(_sma(closes, window), expected)
+
+
+@pytest.mark.parametrize("kind,seed", [("flat", 0), ("tick", 1), ("tick", 2), ("tick", 3), ("walk", 4)])
+@pytest.mark.parametrize("short_window,long_window", [(5, 20), (3, 7)])
+def test_crossover_matches_loop(kind, seed, short_window, long_window):
+    closes = _series(kind, 50_000, seed)
+    opens = np.roll(closes, 1)
+    opens[0] = closes[0]
+    trades, equity, max_dd = _loop_backtest(opens.tolist(), closes.tolist(), short_window, long_window, 100_000.0)
+
+    entries, exits, pnls, final_equity, max_dd_pct = simulate_sma_crossover(
+        opens, closes, short_window, long_window, 100_000.0
+    )
+    assert list(zip(entries.tolist(), exits.tolist(), pnls.tolist())) == trades
+    assert final_equity == equity
+    assert max_dd_pct == max_dd
+    if kind == "flat":
+        assert not trades
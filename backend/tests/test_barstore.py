@@ -0,0 +1,43 @@
+import multiprocessing
+
+import numpy as np
+
+from app.barstore import BarColumns, BarStore
+
+DAY = np.timedelta64(1, "D")
+START = np.datetime64("2024-01-01", "us")
+
+
+def _bars(days):
+    ts = START + np.asarray(days) * DAY
+    values = np.asarray(days, dtype=np.float64)
+    return BarColumns(ts=ts, open=values, high=values, low=values, close=values, volume=values)
+
+
+def _write(root, worker, rounds):
+    store = BarStore(root)
+    for r in range(rounds):
+        # 既存の末尾より前の日付を差し込むので毎回マージ（新しいバージョン）になる
+        store.append("AAA", "1Day", _bars([1000 - (r * 8 + worker)]))
+
+
+def test_merge_keeps_existing_bars(tmp_path):
+    store = BarStore(tmp_path)
+    store.append("AAA", "1Day", _bars(range(10, 20)))
+    assert store.append("AAA", "1Day", _bars([5, 12, 25])) == 2
+    cols = store.read("AAA", "1Day")
+    assert cols.close.tolist() == [5.0, *range(10, 20), 25.0]
+
+
+def test_concurrent_process_merges_do_not_lose_bars(tmp_path):
+    BarStore(tmp_path).append("AAA", "1Day", _bars([2000]))
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_write, args=(str(tmp_path), w, 15)) for w in range(8)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(30)
+        assert p.exitcode == 0
+    cols = BarStore(tmp_path).read("AAA", "1Day")
+    expected = sorted([2000] + [1000 - (r * 8 + w) for w in range(8) for r in range(15)])
+    assert cols.close.tolist() == [float(d) for d in expected]
@@ -0,0 +1,22 @@
+from fastapi.testclient import TestClient
+
+from app.dedup import message_keys, text_key
+
+
+def test_text_hash_only_without_ids():
+    assert message_keys("twitter", "BUY $AAPL", {}) == (text_key("twitter", "BUY $AAPL"), [text_key("twitter", "BUY $AAPL")])
+    message_id, keys = message_keys("twitter", "BUY $AAPL", {"id": "1", "url": "https://x.com/a/status/1"})
+    assert message_id == "1"
+    assert keys == ["1", "https://x.com/a/status/1"]
+
+
+def test_same_text_with_new_message_id_is_accepted(db):
+    from api.main import app
+
+    client = TestClient(app)  # startup を走らせない（パイプラインのワーカーは起動しない）
+    first = client.post("/signals", json={"text": "BUY $AAPL", "source": "twitter", "meta": {"id": "100"}})
+    again = client.post("/signals", json={"text": "BUY $AAPL", "source": "twitter", "meta": {"id": "100"}})
+    repeat = client.post("/signals", json={"text": "BUY $AAPL", "source": "twitter", "meta": {"id": "101"}})
+    assert first.json()["status"] == "accepted"
+    assert again.json()["status"] == "duplicate"
+    assert repeat.json()["status"] == "accepted"
@@ -0,0 +1,30 @@
+from app.config import settings
+from app.extraction import SCORE_CASHTAG, TieredExtractor
+from app.pipeline import SignalPipeline
+
+
+class _NoLLM:
+    def extract(self, text):
+        raise AssertionError("LLM should not be called for a clear cashtag")
+
+
+def test_cashtag_rule_carries_score_as_confidence():
+    extractor = TieredExtractor(_NoLLM(), threshold=settings.rule_confidence_threshold)
+    signal = extractor.extract("$AAPL BUY")
+    assert (signal.ticker, signal.side) == ("AAPL", "BUY")
+    assert signal.confidence == SCORE_CASHTAG
+    assert extractor.metrics["rule"].snapshot()["count"] == 1
+
+
+def test_cashtag_buy_is_auto_traded(monkeypatch):
+    monkeypatch.setattr(settings, "auto_trade_enabled", True)
+    signal = TieredExtractor(None, threshold=settings.rule_confidence_threshold).extract("$AAPL BUY")
+    assert SignalPipeline._should_order(signal)
+
+
+def test_rule_fallback_is_not_auto_traded(monkeypatch):
+    monkeypatch.setattr(settings, "auto_trade_enabled", True)
+    # $ なしの大文字語はスコアが閾値未満。LLM が無ければルールの結果をそのまま使うが発注はしない
+    signal = TieredExtractor(None, threshold=settings.rule_confidence_threshold).extract("AAPL BUY")
+    assert signal is not None and signal.confidence is None
+    assert not SignalPipeline._should_order(signal)
@@ -0,0 +1,86 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from app import market_data as md
+from app.barstore import BarColumns, bar_store
+
+
+class InclusiveSource(md.BarSource):
+    """Alpaca と同じく end ちょうどのバーも返すソース"""
+
+    def __init__(self, step: timedelta):
+        self.step = step
+        self.calls = []
+
+    def fetch(self, symbol, timeframe, start, end):
+        self.calls.append((symbol, start, end))
+        grid = np.arange(
+            np.datetime64(md.completed_until(timeframe, start), "us"),
+            np.datetime64(end, "us") + 1,
+            np.timedelta64(self.step),
+        )
+        ts = grid[grid >= np.datetime64(start, "us")]
+        ones = np.ones(len(ts))
+        return BarColumns(ts=ts, open=ones, high=ones, low=ones, close=ones, volume=ones)
+
+
+def test_sync_does_not_store_the_forming_bar(db):
+    source = InclusiveSource(timedelta(minutes=1))
+    md.sync_missing_bars(source, ["SYNC"], ["1Min"], lookback=timedelta(minutes=10))
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    assert bar_store.last_ts("SYNC", "1Min") < md.completed_until("1Min", now)
+
+
+class FlakySource(md.BarSource):
+    """1分足を返す。fail に入っている開始時刻のチャンクは失敗し、先頭のチャンクほど遅く返る"""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.calls = []
+
+    def fetch(self, symbol, timeframe, start, end):
+        self.calls.append(start)
+        if start in self.fail:
+            raise ValueError("injected failure")
+        time.sleep(max(0.0, 0.2 - 0.05 * (start - START).days))
+        ts = np.arange(np.datetime64(start, "us"), np.datetime64(end, "us"), np.timedelta64(1, "h"))
+        ones = np.ones(len(ts))
+        return BarColumns(ts=ts, open=ones, high=ones, low=ones, close=ones, volume=ones)
+
+
+START = datetime(2024, 1, 1)
+END = START + timedelta(days=4)
+
+
+def test_download_resumes_from_checkpoint(db):
+    failing = START + timedelta(days=2)
+    source = FlakySource(fail=[failing])
+    with pytest.raises(RuntimeError):
+        md.download_bars(source, ["CKPT"], "1Min", START, END, window=timedelta(days=1), max_workers=4)
+
+    # 2回目は失敗したチャンクだけを取り直す
+    source = FlakySource()
+    md.download_bars(source, ["CKPT"], "1Min", START, END, window=timedelta(days=1), max_workers=4)
+    assert source.calls == [failing]
+    assert md.download_bars(source, ["CKPT"], "1Min", START, END, window=timedelta(days=1)) == []
+    bars = bar_store.read("CKPT", "1Min")
+    assert len(bars.ts) == 4 * 24
+    assert (np.diff(bars.ts) > np.timedelta64(0)).all()
+
+
+def test_chunks_are_ingested_in_time_order(db, monkeypatch):
+    # 後ろのチャンクが先に届いても、書き込みは銘柄ごとに時刻順
+    ingested = []
+    ingest = md.ingest_bars
+
+    def record(symbol, timeframe, bars):
+        ingested.append(bars.ts[0])
+        return ingest(symbol, timeframe, bars)
+
+    monkeypatch.setattr(md, "ingest_bars", record)
+    md.download_bars(FlakySource(), ["ORDR"], "1Min", START, END, window=timedelta(days=1), max_workers=4)
+    assert len(ingested) == 4
+    assert ingested == sorted(ingested)
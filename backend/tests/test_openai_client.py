@@ -0,0 +1,36 @@
+"""OpenAILLM を scripts/fake_llm_server.py に向けて、バッチ抽出の振り分けとフォールバックを見る"""
+
+import httpx
+import pytest
+
+import fake_llm_server
+from llm.openai_client import OpenAILLM
+
+TEXTS = ["$AAPL buy the dip", "nothing to see here", "short $TSLA"]
+
+
+@pytest.fixture
+def llm(serve):
+    url = serve(fake_llm_server.make_handler(0.0, 0.0, 0.0, None))
+    client = OpenAILLM(model="fake", api_key="dummy", base_url=f"{url}/v1")
+    client.stats = lambda: httpx.get(f"{url}/stats").json()
+    return client
+
+
+def test_batch_results_are_matched_by_id(llm):
+    results = llm.extract_batch(TEXTS)
+    assert [(r.ticker, r.side) if r else None for r in results] == [("AAPL", "BUY"), None, ("TSLA", "SELL")]
+    assert llm.stats()["requests"] == 1
+
+
+def test_broken_batch_falls_back_to_single_calls(llm, monkeypatch):
+    answer = fake_llm_server.answer
+
+    def broken_batch(prompt):
+        content, items = answer(prompt)
+        return ("not json" if content.startswith("[") else content), items
+
+    monkeypatch.setattr(fake_llm_server, "answer", broken_batch)
+    results = llm.extract_batch(TEXTS)
+    assert [r.ticker if r else None for r in results] == ["AAPL", None, "TSLA"]
+    assert llm.stats()["requests"] == 1 + len(TEXTS)
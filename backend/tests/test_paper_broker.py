@@ -0,0 +1,28 @@
+from datetime import datetime
+
+from sqlmodel import select
+
+from app.db import get_session
+from app.models import Execution, Order, Position
+from app.prices import price_cache
+from broker.paper import PaperBroker
+
+
+def test_same_client_order_id_is_not_filled_twice(db):
+    price_cache.update("PAPR", 10.0, datetime.utcnow())
+    broker = PaperBroker()
+    fills = []
+    broker.notify_fill = lambda *args: fills.append(args)
+
+    first = broker.place_order("PAPR", "BUY", 3, order_type="MARKET", client_order_id="job-1")
+    again = broker.place_order("PAPR", "BUY", 3, order_type="MARKET", client_order_id="job-1")
+    other = broker.place_order("PAPR", "BUY", 1, order_type="MARKET", client_order_id="job-2")
+
+    assert again["local_order_id"] == first["local_order_id"]
+    assert again["filled_qty"] == first["filled_qty"] == 3
+    assert other["local_order_id"] != first["local_order_id"]
+    assert len(fills) == 2
+    with get_session() as s:
+        assert len(s.exec(select(Order)).all()) == 2
+        assert sum(e.qty for e in s.exec(select(Execution)).all()) == 4
+        assert s.exec(select(Position).where(Position.ticker == "PAPR")).one().qty == 4
@@ -0,0 +1,46 @@
+import pytest
+
+from app.risk import RiskGuard
+
+
+@pytest.fixture
+def guard(monkeypatch):
+    g = RiskGuard()
+    monkeypatch.setattr(g, "_save_realized", lambda day, realized: None)
+    g.max_position_usd = 1000.0
+    g.max_gross_exposure = 0.0
+    return g
+
+
+def test_in_flight_orders_count_towards_the_position_limit(guard):
+    # 1件 400 USD。約定前の注文が積み上がっても合計 1000 USD を超えない
+    assert guard.check("AAA", 4, 100.0, reserve="job-1") is None
+    assert guard.check("AAA", 4, 100.0, reserve="job-2") is None
+    assert guard.check("AAA", 4, 100.0, reserve="job-3") is not None
+    assert set(guard.snapshot()["reserved"]) == {"job-1", "job-2"}
+
+
+def test_release_and_fills_free_the_reservation(guard):
+    guard.check("AAA", 4, 100.0, reserve="job-1")
+    guard.check("AAA", 4, 100.0, reserve="job-2")
+    guard.release("job-2")
+    assert guard.check("AAA", 4, 100.0, reserve="job-3") is None
+    # 約定は予約を消化するだけで、建玉と予約の合計は変わらない
+    guard.on_fill("AAA", "BUY", 4, 100.0)
+    assert set(guard.snapshot()["reserved"]) == {"job-3"}
+    assert guard.check("AAA", 4, 100.0) is not None
+
+
+def test_reconcile_drops_reservations_placed_before_the_fetch(guard, monkeypatch):
+    from app import risk
+
+    guard.check("AAA", 4, 100.0, reserve="job-1")
+
+    class State:
+        def positions(self, allow_stale=True):
+            return {"data": {"AAA": {"qty": 4, "avg_price": 100.0}}}
+
+    monkeypatch.setattr(risk, "broker_state", State())
+    guard.reconcile()
+    assert guard.snapshot()["reserved"] == {}
+    assert guard.book.qty("AAA") == 4
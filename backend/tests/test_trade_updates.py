@@ -0,0 +1,54 @@
+"""TradeUpdateApplier: Order 保存前に届いたイベントの保留と、未知の注文の扱い"""
+
+from sqlmodel import select
+
+from app.db import get_session
+from app.models import Execution, Order, Position
+from workers.trade_updates import TradeUpdateApplier
+
+
+def event(kind: str, order_id: str, qty: float = 0.0, exec_id: str | None = None) -> dict:
+    status = {"fill": "filled", "partial_fill": "partially_filled"}.get(kind, kind)
+    return {
+        "event": kind,
+        "execution_id": exec_id,
+        "qty": str(qty),
+        "price": "10.0",
+        "order": {"id": order_id, "symbol": "TUPD", "side": "buy", "qty": "5", "status": status},
+    }
+
+
+def test_orphan_event_waits_for_the_order(db):
+    applier = TradeUpdateApplier(orphan_sec=60)
+    assert applier.apply([event("fill", "ord-1", 5, "ex-1")]) == 0
+    assert applier.has_pending
+
+    # パイプラインが後から Order を保存すれば、保留していたイベントがその注文に付く
+    with get_session() as s:
+        s.add(Order(broker="alpaca", ticker="TUPD", side="BUY", qty=5, broker_order_id="ord-1"))
+        s.commit()
+    assert applier.apply([]) == 1
+    assert not applier.has_pending
+    assert applier.created == 0
+    with get_session() as s:
+        order = s.exec(select(Order)).one()
+        assert order.status == "FILLED"
+        assert [e.order_id for e in s.exec(select(Execution)).all()] == [order.id]
+
+
+def test_unknown_order_keeps_fills_and_drops_the_rest(db):
+    applier = TradeUpdateApplier(orphan_sec=0)
+    applied = applier.apply([
+        event("new", "ext-1"),
+        event("canceled", "ext-2"),
+        event("partial_fill", "ext-3", 2, "ex-3a"),
+        event("fill", "ext-3", 3, "ex-3b"),
+        event("fill", "ext-3", 3, "ex-3b"),  # 再接続時の重複配信
+    ])
+    assert applied == 3
+    assert applier.dropped == 2
+    assert applier.created == 1
+    with get_session() as s:
+        assert [o.broker_order_id for o in s.exec(select(Order)).all()] == ["ext-3"]
+        assert sum(e.qty for e in s.exec(select(Execution)).all()) == 5
+        assert s.exec(select(Position).where(Position.ticker == "TUPD")).one().qty == 5
@@ -0,0 +1,121 @@
+"""TwitterPoller: 送信に失敗・キューが満杯でもツイートを取りこぼさない"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import fake_timeline_server
+from workers import twitter_poll
+from workers.seen_index import SeenIndex
+from workers.twitter_poll import HttpTimelineSource, TwitterPoller
+
+
+def tweet(tweet_id: int, text: str = "BUY $AAPL now") -> dict:
+    return {
+        "id": str(tweet_id),
+        "text": text,
+        "user_id": "42",
+        "username": "trader",
+        "url": f"https://x.com/trader/status/{tweet_id}",
+        "created_at": None,
+    }
+
+
+class FakeApi:
+    """/signals/batch を受ける。fail が True の間は 503 を返す"""
+
+    def __init__(self):
+        self.fail = False
+        self.posted: list[str] = []
+        self.authors: dict[str, str] = {}
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        if self.fail:
+            return httpx.Response(503)
+        items = json.loads(request.content)["items"]
+        self.posted += [item["meta"]["id"] for item in items]
+        self.authors.update((item["meta"]["id"], item["meta"]["username"]) for item in items)
+        return httpx.Response(200, json={"results": [{"status": "queued"} for _ in items]})
+
+
+async def drain(poller: TwitterPoller) -> None:
+    task = asyncio.create_task(poller._post_loop())
+    await poller._posts.join()
+    task.cancel()
+
+
+@pytest.fixture
+def poller(tmp_path):
+    api = FakeApi()
+    client = httpx.AsyncClient(transport=httpx.MockTransport(api.handler), base_url="http://api")
+    p = TwitterPoller(source=None, api=client, seen=SeenIndex(tmp_path / "seen.json"))
+    p.fake_api = api
+    return p
+
+
+def test_failed_post_is_retried_on_next_poll(poller):
+    async def run():
+        poller.fake_api.fail = True
+        assert poller._handle("trader", tweet(100))
+        await drain(poller)
+        assert not poller.seen.seen("42", "100")
+
+        # 新しいツイート（シグナルでない）が先に処理されても、古い未送信分は捨てない
+        assert poller._handle("trader", tweet(101, "hello"))
+        assert poller.seen.high_water("42") is None
+
+        poller.fake_api.fail = False
+        assert poller._handle("trader", tweet(100))
+        assert not poller._handle("trader", tweet(101, "hello"))
+        await drain(poller)
+
+    asyncio.run(run())
+    assert poller.fake_api.posted == ["100"]
+    assert poller.seen.seen("42", "100")
+    assert poller.seen.high_water("42") == 100
+
+
+def test_queue_full_does_not_drop_tweet(poller):
+    async def run():
+        poller._posts = asyncio.Queue(maxsize=1)
+        assert poller._handle("trader", tweet(200))
+        assert poller._handle("trader", tweet(201))
+        assert not poller._handle("trader", tweet(200))  # キュー済みは二重に積まない
+        await drain(poller)
+
+        assert poller._handle("trader", tweet(201))
+        await drain(poller)
+        assert not poller._handle("trader", tweet(201))
+
+    asyncio.run(run())
+    assert poller.fake_api.posted == ["200", "201"]
+    assert poller.seen.high_water("42") == 201
+
+
+def test_unresolved_users_are_retried(serve, tmp_path, monkeypatch):
+    # 起動時の /users が 503 でも、各ユーザーのループがバックオフしながら解決し直して取得を始める
+    monkeypatch.setattr(twitter_poll, "BACKOFF_BASE_SEC", 0.01)
+    fake = fake_timeline_server.FakeTimelines(["alice", "bob"], tweets_per_min=600)
+    url = serve(fake_timeline_server.make_handler(fake, 0.0, 0.0, fail_users=3))
+    api = FakeApi()
+
+    async def run():
+        async with httpx.AsyncClient(base_url=url) as timeline, \
+                httpx.AsyncClient(transport=httpx.MockTransport(api.handler), base_url="http://api") as client:
+            poller = TwitterPoller(
+                HttpTimelineSource(timeline), client, poll_sec=0.05, seen=SeenIndex(tmp_path / "seen.json")
+            )
+            task = asyncio.create_task(poller.run(["alice", "bob"]))
+            for _ in range(100):
+                if {api.authors.get(i) for i in api.posted} >= {"alice", "bob"}:
+                    break
+                await asyncio.sleep(0.05)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return poller
+
+    poller = asyncio.run(run())
+    assert poller.user_ids == fake.users
+    assert {api.authors[i] for i in api.posted} == {"alice", "bob"}